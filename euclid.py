@@ -60,14 +60,26 @@ if sys.version_info[0] < 3:
     from Tkinter import *
     import tkMessageBox
     import tkFileDialog
+    import Queue as queue
 else:
     from tkinter import *
     from tkinter import messagebox as tkMessageBox
     from tkinter import filedialog as tkFileDialog
+    import queue
 from PIL import Image, ImageTk
 import os
-import glob
 import random
+import bisect
+import time
+import threading
+import sqlite3
+import argparse
+from euclid_dimindex import openIndex
+from euclid_prefetch import PrefetchCache
+from euclid_viewport import ImagePyramid, TiledView
+from euclid_labelstore import LabelStore, LABEL_STORE_FILE_NAME, readTrainList
+from euclid_boxes import BoxSet, parseLabelText, formatLabels, labelExtension
+from euclid_prelabel import Prelabeler, ProposalCache, PROPOSAL_CACHE_FILE_NAME
 
     
 # Usage
@@ -80,9 +92,59 @@ USAGE = " \
 6. Click Save in the File Navigation panel in bottom, to save the bounding boxes \n \
 7. Labels are saved in folder named LabelData in same directory as the images \n \
 8. Can use Left/Right arrows for navigating prev/next images \n \
-Note: Default is KITTI format \
+9. Mouse wheel or +/- keys to zoom, Home key to fit, drag with the right (or middle) button to pan \n \
+10. With a pre-labelling model (--prelabel), suggested boxes are shown dashed: double click one or press a to accept all \n \
+Note: Default is KITTI format, YOLO and Pascal VOC can be selected \
 "
 
+# Number of images decoded ahead (and behind) of the current image
+PREFETCH_AHEAD = 3
+
+# Pre-labelling: proposals are requested for the current and this many next images, and polled (ms) while
+# the proposals of the current image are pending. Suggested boxes are drawn dashed in this color
+PRELABEL_AHEAD = 8
+PRELABEL_POLL_MS = 100
+SUGGESTION_COLOR = '#ff8c00'
+
+# Mouse motion is coalesced, the crosshair and the box being drawn are redrawn at most once per frame (ms)
+MOTION_FRAME_MS = 16
+
+# Images are scaled down to fit this size (width, height) when loaded, zoom in for full resolution
+VIEWPORT_SIZE = (1024, 768)
+
+# Image folder scanning: extensions (matched case-insensitively), and how often (ms) the
+# list is refreshed from the scanner thread
+IMAGE_EXTENSIONS = ('.jpeg', '.jpg', '.png')
+SCAN_POLL_MS = 200
+SCAN_BATCH_SIZE = 4096
+
+def scanImageDir(imageDir, outQueue, stopEvent):
+    # Single os.scandir pass over imageDir, on a background thread. Image paths are put on outQueue
+    # in batches, the first image on its own so it can be shown right away. None marks the end of the scan.
+    # Entries are deduplicated on their normalised case (case-insensitive filesystems)
+    seen = set()
+    batch = []
+    batchSize = 1
+    try:
+        for entry in os.scandir(imageDir):
+            if stopEvent.is_set():
+                return
+            if os.path.splitext(entry.name)[1].lower() not in IMAGE_EXTENSIONS:
+                continue
+            key = os.path.normcase(entry.name)
+            if key in seen or not entry.is_file():
+                continue
+            seen.add(key)
+            batch.append(entry.path)
+            if len(batch) >= batchSize:
+                outQueue.put(batch)
+                batch = []
+                batchSize = SCAN_BATCH_SIZE
+    except OSError:
+        pass
+    if len(batch) > 0:
+        outQueue.put(batch)
+    outQueue.put(None)
 
 class Euclid():
 
@@ -110,11 +172,65 @@ class Euclid():
             configFile.write(newPath + "\n")
             configFile.close()
 
+    def trainFileName(self):
+        return os.path.join(sys.path[0], "train.txt")
+
     def AddFileToTrainingList(self, newFile):
-        #training file
-        trainfile = open(os.path.join(sys.path[0], "train.txt"), "a+")
+        #training file, each image is listed once
+        if self.trainList is None:
+            self.trainList = set(readTrainList(self.trainFileName()))
+        if newFile in self.trainList:
+            return
+        self.trainList.add(newFile)
+        trainfile = open(self.trainFileName(), "a+")
         trainfile.write(newFile + "\n")
         trainfile.close()
+
+    def openLabelStore(self):
+        # optional SQLite store of the boxes, in the label folder
+        self.closeLabelStore()
+        if self.useLabelStore.get() == 0:
+            return
+        try:
+            self.labelStore = LabelStore(os.path.join(self.outDir, LABEL_STORE_FILE_NAME))
+        except sqlite3.Error as e:
+            tkMessageBox.showerror("Label store error", message = str(e))
+
+    def closeLabelStore(self):
+        if self.labelStore is not None:
+            self.labelStore.close()
+            self.labelStore = None
+
+    def exportLabels(self):
+        # label files (and the training list) from the label store
+        if self.labelStore is None:
+            tkMessageBox.showwarning("Label store", message = "The label store is not enabled for this folder!")
+            return
+        count = self.labelStore.export(self.outDir, self.trainFileName())
+        self.trainList = None
+        self.prefetcher.clear()
+        self.updateStatus('%d label files exported to %s' %(count, self.outDir))
+
+    def showLabelStats(self):
+        if self.labelStore is None:
+            tkMessageBox.showwarning("Label store", message = "The label store is not enabled for this folder!")
+            return
+        perClass = self.labelStore.countPerClass()
+        noBoxes = self.labelStore.imagesWithoutBoxes()
+        lines = ['Class %s: %d boxes' %(classLabel, count) for classLabel, count in perClass.items()]
+        lines.append('%d of %d images without boxes' %(len(noBoxes), self.labelStore.imageCount()))
+        lines.extend([os.path.basename(path) for path in noBoxes[:10]])
+        if len(noBoxes) > 10:
+            lines.append('...')
+        tkMessageBox.showinfo("Label stats", message = "\n".join(lines))
+
+    def closeWindow(self):
+        self.closeLabelStore()
+        if self.prelabeler is not None:
+            print("Euclid pre-labelling: " + self.prelabeler.report())
+            self.prelabeler.shutdown()
+        print("Euclid session: " + self.sessionSummary())
+        self.parent.destroy()
         
     def TestClassEntry(self,inStr,i,acttyp):
         ind=int(i)
@@ -132,36 +248,192 @@ class Euclid():
             tkMessageBox.showerror("Folder error", message = "The specified directory doesn't exist!")
             return        
         self.SavePathToConfig(self.imageDir)
-         #get image list
-        imageFileTypes = ('*.JPEG', '*.JPG', '*.PNG') # the tuple of file types
+         # set up output dir
+        self.outDir = os.path.join(self.imageDir + '/LabelData')
+        if not os.path.exists(self.outDir):
+            os.mkdir(self.outDir)
+
+        # Image dimensions (for YOLO boxes) are read from the image headers, and indexed in the background
+        try:
+            self.dimIndex = openIndex(self.imageDir)
+        except sqlite3.Error:
+            self.dimIndex = openIndex(self.imageDir, ':memory:')
+        # Next and previous images are decoded on worker threads
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
+        self.prefetcher = PrefetchCache(self.labelPathFor, capacity = 4 * PREFETCH_AHEAD + 2, decoder = self.decodeImage)
+        self.openLabelStore()
+        if self.prelabeler is not None:
+            self.prelabeler.setCache(ProposalCache(os.path.join(self.outDir, PROPOSAL_CACHE_FILE_NAME), self.prelabeler.spec))
+
+        # get image list. The folder is scanned on a background thread, the first image is shown
+        # as soon as it is found, and the (sorted) list fills in while labelling
+        if self.scanStop is not None:
+            self.scanStop.set()
+        self.scanStop = threading.Event()
+        self.scanQueue = queue.Queue()
+        self.scanning = True
         self.imageList = []
-        for files in imageFileTypes:
-            self.imageList.extend(glob.glob(os.path.join(self.imageDir, files.lower())) )
-            if (False == self.is_windows):
-                self.imageList.extend(glob.glob(os.path.join(self.imageDir, files)) )
-            
-        if len(self.imageList) == 0:
-            tkMessageBox.showerror("File not found", message = "No images (png, jpeg, jpg) found in folder!")
-            self.updateStatus( 'No image files found in the specified dir!')
+        self.cur = 0
+        self.total = 0
+        scanThread = threading.Thread(target = scanImageDir, args = (self.imageDir, self.scanQueue, self.scanStop))
+        scanThread.daemon = True
+        scanThread.start()
+        self.updateStatus('Scanning %s' %(self.imageDir))
+        self.pollScan(self.scanQueue)
+
+    def pollScan(self, scanQueue):
+        # Merges the scanned batches into the image list, on the Tk thread
+        if scanQueue is not self.scanQueue:
+            # a newer folder was loaded
             return
-        # Change title
-        self.parent.title("Euclid Labeller (" + self.imageDir + ") " + str(len(self.imageList)) + " images")
+        batches = []
+        try:
+            while True:
+                batches.append(scanQueue.get_nowait())
+        except queue.Empty:
+            pass
+        done = None in batches
+        newPaths = [path for batch in batches if batch is not None for path in batch]
+        if len(newPaths) > 0:
+            currentPath = self.imageList[self.cur - 1] if self.cur > 0 else None
+            # the list is already sorted, so this sort only merges in the new (sorted) run
+            newPaths.sort()
+            self.imageList.extend(newPaths)
+            self.imageList.sort()
+            self.total = len(self.imageList)
+            if self.labelStore is not None:
+                self.labelStore.addImages(newPaths)
+            if currentPath is None:
+                # default to the 1st image found
+                self.cur = 1
+                self.loadImageAndLabels()
+            else:
+                # keep pointing at the displayed image
+                self.cur = bisect.bisect_left(self.imageList, currentPath) + 1
+        if done:
+            self.scanning = False
+            if self.total == 0:
+                tkMessageBox.showerror("File not found", message = "No images (png, jpeg, jpg) found in folder!")
+                self.updateStatus( 'No image files found in the specified dir!')
+                return
+            self.updateStatus( '%d images loaded from %s' %(self.total, self.imageDir))
+            warmThread = threading.Thread(target = self.warmDimIndex, args = (self.dimIndex, list(self.imageList)))
+            warmThread.daemon = True
+            warmThread.start()
+        else:
+            self.parent.after(SCAN_POLL_MS, self.pollScan, scanQueue)
+        self.updateProgress()
 
+    def updateProgress(self):
+        scanningText = ' (scanning...)' if self.scanning else ''
+        self.parent.title("Euclid Labeller (" + self.imageDir + ") " + str(self.total) + " images" + scanningText)
+        self.progLabel.config(text = "Progress: [ %04d / %04d ]%s" %(self.cur, self.total, scanningText))
 
-        # default to the 1st image in the collection
-        self.cur = 1
-        self.total = len(self.imageList)
+    def decodeImage(self, imagepath):
+        # only the level matching the viewport is decoded
+        return ImagePyramid(imagepath, VIEWPORT_SIZE)
 
-         # set up output dir
-        self.outDir = os.path.join(self.imageDir + '/LabelData')
-        if not os.path.exists(self.outDir):
-            os.mkdir(self.outDir)
+    def labelPathFor(self, imagepath):
+        # YOLO/KITTI .txt, else the Pascal VOC .xml if there is one
+        lastPartFileName, lastPartFileExtension = os.path.splitext(os.path.split(imagepath)[-1])
+        labelPath = os.path.join(self.outDir, lastPartFileName + '.txt')
+        vocPath = os.path.join(self.outDir, lastPartFileName + '.xml')
+        if not os.path.exists(labelPath) and os.path.exists(vocPath):
+            return vocPath
+        return labelPath
+
+    def prefetchNeighbours(self):
+        # next images first, then previous ones
+        paths = []
+        for step in range(1, PREFETCH_AHEAD + 1):
+            for idx in (self.cur - 1 + step, self.cur - 1 - step):
+                if 0 <= idx < self.total:
+                    paths.append(self.imageList[idx])
+        self.prefetcher.prefetch(paths)
+
+    def requestProposals(self):
+        # current and next images without labels, the proposals are ready by the time they are shown
+        if self.prelabeler is None or self.useSuggestions.get() == 0:
+            return
+        paths = []
+        for idx in range(self.cur - 1, min(self.total, self.cur + PRELABEL_AHEAD)):
+            imagepath = self.imageList[idx]
+            if self.labelStore is not None or not os.path.exists(self.labelPathFor(imagepath)):
+                paths.append(imagepath)
+        self.prelabeler.request(paths)
+
+    def showSuggestions(self, imagepath):
+        # proposals of the pre-labelling model, for an image without boxes. Polled until they arrive
+        if self.prelabeler is None or self.useSuggestions.get() == 0 or imagepath != self.imagefilename:
+            return
+        if len(self.boxes) > 0 or len(self.suggestions) > 0:
+            return
+        proposals = self.prelabeler.get(imagepath)
+        if proposals is None:
+            if self.prelabeler.isPending(imagepath):
+                self.parent.after(PRELABEL_POLL_MS, self.showSuggestions, imagepath)
+            return
+        self.suggestions, self.suggestionScores = proposals
+        for idx in range(len(self.suggestions)):
+            bbTuple = self.suggestions.box(idx)
+            tmpId = self.mainPanel.create_rectangle(*self.view.toCanvas(bbTuple), width = 2, dash = (4, 2), \
+                                                    outline = SUGGESTION_COLOR)
+            self.suggestionIdList.append(tmpId)
+            self.listbox.insert(END, '(%d, %d) -> (%d, %d) [Class %d] suggested %.2f' %(int(bbTuple[0]), int(bbTuple[1]), \
+                                int(bbTuple[2]), int(bbTuple[3]), self.suggestions.classes[idx], self.suggestionScores[idx]))
+            self.listbox.itemconfig(END, fg = SUGGESTION_COLOR)
+        self.updateStatus('%d suggested boxes  [%s]' %(len(self.suggestions), self.prelabeler.report()))
+
+    def removeSuggestion(self, idx):
+        # idx in the suggestions, their list rows follow the boxes
+        self.mainPanel.delete(self.suggestionIdList.pop(idx))
+        self.listbox.delete(len(self.boxes) + idx)
+        box = self.suggestions.box(idx)
+        classId = int(self.suggestions.classes[idx])
+        self.suggestions.delete(idx)
+        self.suggestionScores = self.suggestionScores[:idx] + self.suggestionScores[idx + 1:]
+        return classId, box
+
+    def acceptSuggestion(self, idx):
+        # the suggested box becomes a box of the image, with the proposed class
+        classId, (x1, y1, x2, y2) = self.removeSuggestion(idx)
+        currColor = '#%02x%02x%02x' % (self.redColor, self.greenColor, self.blueColor)
+        self.greenColor = (self.greenColor + 45) % 255
+        self.bboxIdList.append(self.mainPanel.create_rectangle(*self.view.toCanvas((x1, y1, x2, y2)), \
+                                                               width = 2, outline = currColor))
+        self.boxes.append(classId, (x1, y1, x2, y2))
+        self.listbox.insert(len(self.bboxIdList) - 1, '(%d, %d) -> (%d, %d)[Class %d]' %(x1, y1, x2, y2, classId))
+        self.listbox.itemconfig(len(self.bboxIdList) - 1, fg = currColor)
+        self.updateDirty()
+
+    def acceptSuggestions(self, event = None):
+        while len(self.suggestions) > 0:
+            self.acceptSuggestion(0)
+
+    def listDoubleClick(self, event):
+        sel = self.listbox.curselection()
+        if len(sel) == 1 and int(sel[0]) >= len(self.boxes):
+            self.acceptSuggestion(int(sel[0]) - len(self.boxes))
+
+    def warmDimIndex(self, dimIndex, imageList):
+        dimIndex.scan(imageList)
+        try:
+            dimIndex.save()
+        except sqlite3.Error:
+            pass
 
-        self.updateStatus( '%d images loaded from %s' %(self.total, self.imageDir))
-        self.loadImageAndLabels()
+    def getImageSize(self, imagepath):
+        # full resolution (width, height) of the image, from the dimension index
+        size = None
+        if self.dimIndex is not None:
+            size = self.dimIndex.get(imagepath)
+        if size is None:
+            size = self.pyramid.size
+        return size
 
         
-    def __init__(self, master):
+    def __init__(self, master, prelabelSpec = None, prelabelWorkers = 1):
         # set up the main frame
         self.parent = master
         self.parent.title("Euclid Labeller (Press F1 for Help)")
@@ -182,7 +454,26 @@ class Euclid():
         self.labelfilename = ''
         self.currLabelMode = 'YOLO' #'KITTI' #'YOLO' # Other modes TODO
         self.imagefilename = ''
-        self.tkimg = None
+        self.pyramid = None
+        self.dimIndex = None
+        self.prefetcher = None
+        self.imageSize = (0, 0)
+        self.scanQueue = None
+        self.scanStop = None
+        self.scanning = False
+        self.labelStore = None
+        self.trainList = None
+        # labels of the current image as loaded or last saved, navigation saves only when they differ
+        self.savedLabelState = BoxSet()
+        self.labelWrites = 0
+        self.writesAvoided = 0
+        # box proposals of the pre-labelling model, shown dashed until accepted
+        self.prelabeler = None
+        if prelabelSpec:
+            self.prelabeler = Prelabeler(prelabelSpec, prelabelWorkers)
+        self.suggestions = BoxSet()
+        self.suggestionScores = []
+        self.suggestionIdList = []
 
         # initialize mouse state
         self.STATE = {}
@@ -198,11 +489,20 @@ class Euclid():
         # reference to bbox
         self.bboxIdList = []
         self.bboxId = None
-        self.bboxList = []
+        # class ids and full resolution boxes, the canvas item of each box is in bboxIdList
+        self.boxes = BoxSet()
         self.currClassLabel = 0
-        self.classLabelList = []
         self.hl = None
         self.vl = None
+        self.rubberBand = None
+        self.rubberBandColor = '#000000'
+        self.pendingMotion = None
+        self.motionJob = None
+        self.motionEvents = 0
+        self.motionRedraws = 0
+        self.motionRedrawSeconds = 0.
+        self.motionPeriodStart = time.time()
+        self.motionReport = ''
 
         # ----------------- GUI stuff ---------------------
 
@@ -215,6 +515,16 @@ class Euclid():
         self.mainPanel = Canvas(self.imagePanelFrame, cursor='tcross', borderwidth=2, background='light blue')
         self.mainPanel.bind("<Button-1>", self.mouseClick)
         self.mainPanel.bind("<Motion>", self.mouseMove)
+        self.mainPanel.bind("<MouseWheel>", self.mouseWheel)
+        self.mainPanel.bind("<Button-4>", self.mouseWheel)
+        self.mainPanel.bind("<Button-5>", self.mouseWheel)
+        for button in ('2', '3'):
+            self.mainPanel.bind("<ButtonPress-%s>" % button, self.panStart)
+            self.mainPanel.bind("<B%s-Motion>" % button, self.panMove)
+        self.parent.bind("<plus>", self.zoomIn)
+        self.parent.bind("<equal>", self.zoomIn)
+        self.parent.bind("<minus>", self.zoomOut)
+        self.parent.bind("<Home>", self.zoomFit)
         self.parent.bind("n", self.nextImage)    
         self.parent.bind("x", self.selectPointXY)
         self.parent.bind("<Escape>", self.cancelBBox)  # press <Escape> to cancel current bbox
@@ -222,8 +532,11 @@ class Euclid():
         self.parent.bind("<Left>", self.prevImage) # press 'Left Arrow' to go backforward
         self.parent.bind("<Right>", self.nextImage) # press 'Right Arrow' to go forward
         self.parent.bind("c", self.cancelKnownBoxFunc) # Cancel knownbox
+        self.parent.bind("a", self.acceptSuggestions) # accept all the suggested boxes
         
         self.mainPanel.grid(row = 1, column = 0, rowspan = 4, sticky = W+N)
+        self.view = TiledView(self.mainPanel)
+        self.createOverlay()
 
         # Boundingbox info panel
         self.bboxControlPanelFrame = Frame(self.frame)
@@ -233,10 +546,18 @@ class Euclid():
         self.lb1.grid(row = 0, column = 0,  sticky = W+N)
         self.listbox = Listbox(self.bboxControlPanelFrame, width = 40, height = 22,  background='white')
         self.listbox.grid(row = 1, column = 0, sticky = N)
+        self.listbox.bind("<Double-Button-1>", self.listDoubleClick)
         self.btnDel = Button(self.bboxControlPanelFrame, text = 'Delete', command = self.delBBox)
         self.btnDel.grid(row = 2, column = 0, sticky = W+E+N)
         self.btnClear = Button(self.bboxControlPanelFrame, text = 'Clear All', command = self.clearBBox)
         self.btnClear.grid(row = 3, column = 0, sticky = W+E+N)
+        self.useSuggestions = IntVar()
+        self.useSuggestions.set(1 if self.prelabeler is not None else 0)
+        self.suggestCheckBox = Checkbutton(self.bboxControlPanelFrame, variable = self.useSuggestions, text = "Suggest boxes", \
+                                           state = NORMAL if self.prelabeler is not None else DISABLED)
+        self.suggestCheckBox.grid(row = 4, column = 0, sticky = W+N)
+        self.btnAccept = Button(self.bboxControlPanelFrame, text = 'Accept Suggested', command = self.acceptSuggestions)
+        self.btnAccept.grid(row = 5, column = 0, sticky = W+E+N)
 
 	    #Class labels selection
         # control panel for label navigation
@@ -279,6 +600,16 @@ class Euclid():
         self.yoloCheckBox.grid(row = 3, column = 0, sticky = N)
         self.kittiCheckBox = Radiobutton(self.FileControlPanelFrame, variable=self.isYoloCheckBox, value=0, text="KITTI Format")
         self.kittiCheckBox.grid(row = 3, column = 1, sticky = N)
+        self.vocCheckBox = Radiobutton(self.FileControlPanelFrame, variable=self.isYoloCheckBox, value=2, text="VOC Format")
+        self.vocCheckBox.grid(row = 3, column = 2, sticky = N)
+        self.useLabelStore = IntVar()
+        self.useLabelStore.set(0)
+        self.labelStoreCheckBox = Checkbutton(self.FileControlPanelFrame, variable=self.useLabelStore, text="Label store (SQLite)")
+        self.labelStoreCheckBox.grid(row = 4, column = 0, sticky = N)
+        self.exportBtn = Button(self.FileControlPanelFrame, text = "Export labels", command = self.exportLabels)
+        self.exportBtn.grid(row = 4, column = 1, sticky = N)
+        self.statsBtn = Button(self.FileControlPanelFrame, text = "Label stats", command = self.showLabelStats)
+        self.statsBtn.grid(row = 4, column = 2, sticky = N)
        
             
             
@@ -302,6 +633,8 @@ class Euclid():
         self.goBtn.pack(side = LEFT)
         self.progLabel = Label(self.ctrPanel, text = "Progress: [  0   /  0  ]")
         self.progLabel.pack(side = LEFT, padx = 5)
+        self.dirtyLabel = Label(self.ctrPanel, text = "")
+        self.dirtyLabel.pack(side = LEFT, padx = 5)
 
         # Status panel for image navigation
         self.statusPanel = Frame(self.frame)
@@ -317,6 +650,8 @@ class Euclid():
 
         self.frame.columnconfigure(1, weight = 1)
         self.frame.rowconfigure(4, weight = 1)
+        # queued label store saves are written before exit
+        self.parent.protocol("WM_DELETE_WINDOW", self.closeWindow)
 
 
 
@@ -325,123 +660,145 @@ class Euclid():
         # load image
         imagepath = self.imageList[self.cur - 1]
         self.imagefilename = imagepath
-        self.img = Image.open(imagepath)
-        self.tkimg = ImageTk.PhotoImage(self.img)
-        self.mainPanel.config(width = max(self.tkimg.width(), 400), height = max(self.tkimg.height(), 400))
-        self.mainPanel.create_image(0, 0, image = self.tkimg, anchor=NW)
-        self.progLabel.config(text = "Progress: [ %04d / %04d ]" %(self.cur, self.total))
-        self.updateStatus("Loaded file " + imagepath)
-        
-        if self.tkimg.width() > 1024 or self.tkimg.height() > 1024:
-            tkMessageBox.showwarning("Too large image", message = "Image dimensions not suited for Deep Learning frameworks!")
-            
+        # decoded (and label file read) by the prefetcher, usually ahead of time
+        if self.pyramid is not None:
+            self.pyramid.trim()
+        self.pyramid, labelText = self.prefetcher.get(imagepath)
+        self.imageSize = self.getImageSize(imagepath)
+        # shown scaled to the viewport, boxes are kept in full resolution pixels
+        self.view.setImage(self.pyramid)
+        self.hideCrosshair()
+        self.updateProgress()
+        largeText = ''
+        if self.imageSize[0] > 1024 or self.imageSize[1] > 1024:
+            largeText = " (large image, not suited for Deep Learning frameworks)"
+        self.updateStatus("Loaded file " + imagepath + largeText + "  [" + self.prefetcher.report() + ", " + self.view.report() + "]")
+        self.prefetchNeighbours()
+
         # load labels
         self.clearBBox()
-        self.classLabelList = []
-        lastPartFileName, lastPartFileExtension = os.path.splitext(os.path.split(imagepath)[-1])      
+        lastPartFileName, lastPartFileExtension = os.path.splitext(os.path.split(imagepath)[-1])
         self.imagename = lastPartFileName
-        labelname = self.imagename + '.txt'
-        self.labelfilename = os.path.join(self.outDir, labelname)
-        bbox_cnt = 0
-        if os.path.exists(self.labelfilename):
-            with open(self.labelfilename) as f:
-                for (i, line) in enumerate(f):
-                    bbox_cnt = len(line)
-                    tmp = [elements.strip() for elements in line.split()]
-                    
-                    if(len(tmp) > 5):
-                        self.currLabelMode='KITTI'
-                        bbTuple = (int(float(tmp[4])),int(float(tmp[5])), int(float(tmp[6])),int(float(tmp[7])) )
-                        self.classLabelList.append('Class'+tmp[0])
-                        
-                    else:
-                        self.currLabelMode='YOLO'
-                        bbTuple = self.GetBoundariesFromYoloFile(float(tmp[1]),float(tmp[2]), float(tmp[3]),float(tmp[4]), 
-                                                            self.tkimg.width(), self.tkimg.height() )
-                        self.classLabelList.append(tmp[0])                        
-                    
-
-                    self.bboxList.append( bbTuple  )
-                    #color set
-                    currColor = '#%02x%02x%02x' % (self.redColor, self.greenColor, self.blueColor)
-                    self.greenColor = (self.greenColor + 45) % 255
-                    tmpId = self.mainPanel.create_rectangle(int(bbTuple[0]), int(bbTuple[1]), \
-                                                            int(bbTuple[2]), int(bbTuple[3]), \
-                                                            width = 2, \
-                                                            outline = currColor)
-                    self.bboxIdList.append(tmpId)
-                    self.listbox.insert(END, '(%d, %d) -> (%d, %d) [%s]' %(int(bbTuple[0]), int(bbTuple[1]), \
-                                                            int(bbTuple[2]), int(bbTuple[3]), tmp[0]))
-                    self.listbox.itemconfig(len(self.bboxIdList) - 1, fg = currColor)
-
-    def GetBoundariesFromYoloFile(self, centerX, centerY, width, height, imageWidth, imageHeight):
-        topLeftX = (int)(centerX*imageWidth - (width*imageWidth)/2)
-        topLeftY = (int)(centerY*imageHeight - (height*imageHeight)/2)
-        bottomRightX = (int)(centerX*imageWidth + (width*imageWidth)/2)
-        bottomRightY = (int)(centerY*imageHeight + (height*imageHeight)/2)
-        return topLeftX, topLeftY, bottomRightX, bottomRightY
-    
+        self.labelfilename = self.labelPathFor(imagepath)
+        record = None
+        if self.labelStore is not None:
+            record = self.labelStore.load(imagepath)
+        if record is not None:
+            self.currLabelMode = record[2]
+            self.boxes = record[3].copy()
+        elif labelText is not None:
+            labelFormat, self.boxes = parseLabelText(labelText, self.imageSize)
+            if labelFormat is not None:
+                self.currLabelMode = labelFormat.upper()
 
-    def convert2Yolo(self, image, boxCoords):
-        
-        invWidth = 1./image[0]
-        invHeight = 1./image[1]
-        x = invWidth * (boxCoords[0] + boxCoords[2])/2.0
-        y = invHeight * (boxCoords[1] + boxCoords[3])/2.0
-        boxWidth = invWidth * (boxCoords[2] - boxCoords[0])
-        boxHeight = invHeight * (boxCoords[3] - boxCoords[1])
-        return (x,y,boxWidth,boxHeight)
-                
+        for idx in range(len(self.boxes)):
+            bbTuple = self.boxes.box(idx)
+            #color set
+            currColor = '#%02x%02x%02x' % (self.redColor, self.greenColor, self.blueColor)
+            self.greenColor = (self.greenColor + 45) % 255
+            tmpId = self.mainPanel.create_rectangle(*self.view.toCanvas(bbTuple), \
+                                                    width = 2, \
+                                                    outline = currColor)
+            self.bboxIdList.append(tmpId)
+            self.listbox.insert(END, '(%d, %d) -> (%d, %d) [Class %d]' %(int(bbTuple[0]), int(bbTuple[1]), \
+                                                    int(bbTuple[2]), int(bbTuple[3]), self.boxes.classes[idx]))
+            self.listbox.itemconfig(len(self.bboxIdList) - 1, fg = currColor)
+        self.savedLabelState = self.labelState()
+        self.updateDirty()
+        # suggested boxes of the pre-labelling model, and proposals for the next images
+        self.requestProposals()
+        self.showSuggestions(imagepath)
 
     def saveLabel(self):
-        if self.labelfilename == '': 
-            return            
-        if(len(self.bboxList) == 0):
+        if self.labelfilename == '':
             return
-        if self.isYoloCheckBox.get() == 0:
-            self.currLabelMode = 'KITTI'
-        else:
-            self.currLabelMode = 'YOLO'
-            
-        if self.currLabelMode == 'KITTI':
-            with open(self.labelfilename, 'w') as f:
-                labelCnt=0
-                ##class1 0 0 0 x1,y1,x2,y2 0,0,0 0,0,0 0 0  
-                # fields ignored by DetectNet: alpha, scenario, roty, occlusion, dimensions, location.
-                for bbox in self.bboxList:
-                    f.write('%s' % 'Class'+ str(self.classLabelList[labelCnt]))               
-                    f.write(' 0.0 0 0.0 ')
-                    #f.write(str(bbox[0])+' '+str(bbox[1])+' '+str(bbox[2])+' '+str(bbox[3]))
-                    f.write('%.2f %.2f %.2f %.2f' % (bbox[0], bbox[1], bbox[2], bbox[3]))                 
-                    f.write(' 0.0 0.0 0.0 0.0 0.0 0.0 0.0 0.0 ')
-                    f.write('\n')
-                    labelCnt = labelCnt+1
-            self.updateStatus ('Label Image No. %d saved' %(self.cur))
-        elif self.currLabelMode == 'YOLO':
-            with open(self.labelfilename, 'w') as f:
-                labelCnt=0
-                ##class1 center_box_x_ratio center_box_y_ratio width_ratio height_ratio
-                for bbox in self.bboxList:                
-                    yoloOut = self.convert2Yolo(
-                                [self.tkimg.width(), self.tkimg.height()], 
-                                [bbox[0], bbox[1], bbox[2], bbox[3]]
-                                );
-                    f.write('%s' %self.classLabelList[labelCnt])               
-                    f.write(' %.7f %.7f %.7f %.7f' % (yoloOut[0], yoloOut[1], yoloOut[2], yoloOut[3]))                 
-                    f.write('\n')
-                    #tkMessageBox.showinfo("Save Info", message = self.classLabelList[labelCnt])
-                    labelCnt = labelCnt+1
+        self.currLabelMode = ['KITTI', 'YOLO', 'VOC'][self.isYoloCheckBox.get()]
+        if self.labelStore is not None:
+            # queued, written in a batch by the store thread. Label files are written by Export
+            self.labelStore.save(self.imagefilename, self.imageSize, self.currLabelMode, self.boxes)
+            self.labelSaved()
+            self.updateStatus ('Label Image No. %d queued  [%s]' %(self.cur, self.labelStore.report()))
+            return
+        # the prefetched label text of this image is stale after the save
+        self.prefetcher.invalidate(self.imagefilename)
+        if(len(self.boxes) == 0):
+            # an image without boxes has no label file, the one of the deleted boxes is removed
+            if os.path.exists(self.labelfilename):
+                os.remove(self.labelfilename)
+            self.labelSaved()
+            self.updateStatus ('Label Image No. %d has no boxes' %(self.cur))
+            return
+
+        if self.currLabelMode in ('KITTI', 'YOLO', 'VOC'):
+            # written in the selected format, replacing the label file of the other extension
+            labelfilename = os.path.splitext(self.labelfilename)[0] + labelExtension(self.currLabelMode)
+            with open(labelfilename, 'w') as f:
+                f.write(formatLabels(self.currLabelMode, self.boxes, self.imageSize, os.path.basename(self.imagefilename)))
+            if labelfilename != self.labelfilename and os.path.exists(self.labelfilename):
+                os.remove(self.labelfilename)
+            self.labelfilename = labelfilename
+            self.labelSaved()
             self.updateStatus ('Label Image No. %d saved' %(self.cur))
-            self.AddFileToTrainingList(self.imagefilename);
+            if self.currLabelMode == 'YOLO':
+                self.AddFileToTrainingList(self.imagefilename);
         else:
             tkMessageBox.showerror("Labelling error", message = 'Unknown Label format')
-        
+
+
+    def labelSaved(self):
+        self.labelWrites = self.labelWrites + 1
+        self.savedLabelState = self.labelState()
+        self.updateDirty()
 
     def selectPointXY(self, event):
         self.handleMouseOrXKey(self.currentMouseX, self.currentMouseY)
 
     def mouseClick(self, event):
-        self.handleMouseOrXKey(event.x, event.y)
+        if self.pyramid is None:
+            return
+        xCoord, yCoord = self.view.toImage(event.x, event.y)
+        self.handleMouseOrXKey(xCoord, yCoord)
+
+    def mouseWheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.zoomAt(1, event.x, event.y)
+        elif event.num == 5 or event.delta < 0:
+            self.zoomAt(-1, event.x, event.y)
+
+    def zoomIn(self, event = None):
+        self.zoomAt(1, self.mainPanel.winfo_width() // 2, self.mainPanel.winfo_height() // 2)
+
+    def zoomOut(self, event = None):
+        self.zoomAt(-1, self.mainPanel.winfo_width() // 2, self.mainPanel.winfo_height() // 2)
+
+    def zoomFit(self, event = None):
+        if self.view.fit():
+            self.redrawBoxes()
+
+    def zoomAt(self, steps, wx, wy):
+        if self.view.zoom(steps, wx, wy):
+            self.redrawBoxes()
+            self.updateStatus("Zoom " + self.imagefilename + "  [" + self.view.report() + "]")
+
+    def panStart(self, event):
+        self.view.panStart(event.x, event.y)
+
+    def panMove(self, event):
+        self.view.panTo(event.x, event.y)
+
+    def redrawBoxes(self):
+        # boxes are kept in image coordinates, move their canvas items to the current zoom
+        for idx in range(len(self.bboxIdList)):
+            self.mainPanel.coords(self.bboxIdList[idx], *self.view.toCanvas(self.boxes.box(idx)))
+        for idx in range(len(self.suggestionIdList)):
+            self.mainPanel.coords(self.suggestionIdList[idx], *self.view.toCanvas(self.suggestions.box(idx)))
+        self.mainPanel.coords(self.rubberBand, *self.view.toCanvas((self.STATE['x'], self.STATE['y'],
+                                                                    self.currentMouseX, self.currentMouseY)))
+        self.hideCrosshair()
+
+    def hideCrosshair(self):
+        self.mainPanel.itemconfig(self.hl, state = HIDDEN)
+        self.mainPanel.itemconfig(self.vl, state = HIDDEN)
 
     def handleMouseOrXKey(self, xCoord, yCoord):
         if self.imagefilename == '':
@@ -452,15 +809,20 @@ class Euclid():
             #Got a new BB, store the class label also
             x1, x2 = min(self.STATE['x'], xCoord), max(self.STATE['x'], xCoord)
             y1, y2 = min(self.STATE['y'], yCoord), max(self.STATE['y'], yCoord)
-            self.bboxList.append((x1, y1, x2, y2))
+            # the rubber band is reused for the next box, the box gets its own item
+            self.mainPanel.itemconfig(self.rubberBand, state = HIDDEN)
+            self.bboxId = self.mainPanel.create_rectangle(*self.view.toCanvas((x1, y1, x2, y2)), \
+                                                            width = 2, \
+                                                            outline = self.rubberBandColor)
+            self.boxes.append(self.currClassLabel, (x1, y1, x2, y2))
             self.bboxIdList.append(self.bboxId)
-            self.classLabelList.append(self.currClassLabel)
             self.bboxId = None
-            self.listbox.insert(END, '(%d, %d) -> (%d, %d)[Class %d]' %(x1, y1, x2, y2 , self.currClassLabel))
+            self.listbox.insert(len(self.bboxIdList) - 1, '(%d, %d) -> (%d, %d)[Class %d]' %(x1, y1, x2, y2 , self.currClassLabel))
             #color set
             currColor = '#%02x%02x%02x' % (self.redColor, self.greenColor, self.blueColor)
             self.redColor = 25 + (self.redColor + 25) % 200         
             self.listbox.itemconfig(len(self.bboxIdList) - 1, fg = currColor)
+            self.updateDirty()
         self.STATE['click'] = 1 - self.STATE['click']
 
     def handleMouseOrXKeyKnownBox(self, xCoord, yCoord):
@@ -482,57 +844,89 @@ class Euclid():
         currColor = '#%02x%02x%02x' % (self.redColor, self.greenColor, self.blueColor)
         self.redColor = 255    
         self.greenColor = 200+(self.greenColor + 5) % 55           
-        self.bboxId = self.mainPanel.create_rectangle(x1, y1, x2, y2, \
+        self.bboxId = self.mainPanel.create_rectangle(*self.view.toCanvas((x1, y1, x2, y2)), \
                                                         width = 2, \
                                                         outline = currColor)         
         #Got a new BB, store the class label also
-        self.bboxList.append((x1, y1, x2, y2))
+        self.boxes.append(self.currClassLabel, (x1, y1, x2, y2))
         self.bboxIdList.append(self.bboxId)
-        self.classLabelList.append(self.currClassLabel)
               
         self.bboxId = None
-        self.listbox.insert(END, '(%d, %d) -> (%d, %d)[Class %d]' %(x1, y1, x2, y2 , self.currClassLabel))
+        self.listbox.insert(len(self.bboxIdList) - 1, '(%d, %d) -> (%d, %d)[Class %d]' %(x1, y1, x2, y2 , self.currClassLabel))
         #color set      
         self.listbox.itemconfig(len(self.bboxIdList) - 1, fg = currColor)
+        self.updateDirty()
 
         
         
+    def createOverlay(self):
+        # crosshair lines and the rubber band of the box being drawn, created once, and moved with coords()
+        self.hl = self.mainPanel.create_line(0, 0, 0, 0, width = 2, state = HIDDEN)
+        self.vl = self.mainPanel.create_line(0, 0, 0, 0, width = 2, state = HIDDEN)
+        self.rubberBand = self.mainPanel.create_rectangle(0, 0, 0, 0, width = 2, state = HIDDEN)
+
     def mouseMove(self, event):
+        # only remember the position, the overlay is redrawn once per frame
+        self.motionEvents = self.motionEvents + 1
+        self.pendingMotion = (event.x, event.y)
+        if self.motionJob is None:
+            self.motionJob = self.parent.after(MOTION_FRAME_MS, self.redrawOverlay)
+
+    def redrawOverlay(self):
+        self.motionJob = None
+        if self.pendingMotion is None:
+            return
+        timeStart = time.time()
+        self.drawOverlay(self.pendingMotion[0], self.pendingMotion[1])
+        self.pendingMotion = None
+        self.motionRedraws = self.motionRedraws + 1
+        self.motionRedrawSeconds = self.motionRedrawSeconds + time.time() - timeStart
+        if timeStart - self.motionPeriodStart >= 1.:
+            self.updateMotionReport(timeStart)
+
+    def updateMotionReport(self, now):
+        # input event rate against redraw rate, over the last second or so
+        seconds = now - self.motionPeriodStart
+        self.motionReport = 'events %d/s, redraws %d/s, redraw %.2f ms' % (
+            self.motionEvents / seconds, self.motionRedraws / seconds,
+            1000 * self.motionRedrawSeconds / max(1, self.motionRedraws))
+        self.motionPeriodStart = now
+        self.motionEvents = 0
+        self.motionRedraws = 0
+        self.motionRedrawSeconds = 0.
+
+    def drawOverlay(self, wx, wy):
         if self.imagefilename == '':
             return
-        self.disp.config(text = 'x: %d, y: %d' %(event.x, event.y))
-        if self.tkimg:
-            if event.x > self.tkimg.width():
+        # full resolution image pixel under the mouse
+        xCoord, yCoord = self.view.toImage(wx, wy)
+        self.disp.config(text = 'x: %d, y: %d  [%s]' %(xCoord, yCoord, self.motionReport))
+        if self.pyramid:
+            if xCoord > self.imageSize[0]:
                 return
-            if event.y > self.tkimg.height():
+            if yCoord > self.imageSize[1]:
                 return
-                
-            if self.hl:
-                self.mainPanel.delete(self.hl)
-            self.hl = self.mainPanel.create_line(0, event.y, self.tkimg.width(), event.y, width = 2)
-            if self.vl:
-                self.mainPanel.delete(self.vl)
-            self.vl = self.mainPanel.create_line(event.x, 0, event.x, self.tkimg.height(), width = 2)
+            canvasX = self.mainPanel.canvasx(wx)
+            canvasY = self.mainPanel.canvasy(wy)
+            displayWidth, displayHeight = self.view.displaySize()
+            self.mainPanel.coords(self.hl, 0, canvasY, displayWidth, canvasY)
+            self.mainPanel.coords(self.vl, canvasX, 0, canvasX, displayHeight)
+            self.mainPanel.itemconfig(self.hl, state = NORMAL)
+            self.mainPanel.itemconfig(self.vl, state = NORMAL)
         if 1 == self.STATE['click']:
-            if self.bboxId:
-                self.mainPanel.delete(self.bboxId)
             #color set
-            currColor = '#%02x%02x%02x' % (self.redColor, self.greenColor, self.blueColor)
-            self.blueColor = 10 + (self.blueColor + 1) % 230                
-            self.bboxId = self.mainPanel.create_rectangle(self.STATE['x'], self.STATE['y'], \
-                                                            event.x, event.y, \
-                                                            width = 2, \
-                                                            outline = currColor)
+            self.rubberBandColor = '#%02x%02x%02x' % (self.redColor, self.greenColor, self.blueColor)
+            self.blueColor = 10 + (self.blueColor + 1) % 230
+            self.mainPanel.coords(self.rubberBand, *self.view.toCanvas((self.STATE['x'], self.STATE['y'], xCoord, yCoord)))
+            self.mainPanel.itemconfig(self.rubberBand, outline = self.rubberBandColor, state = NORMAL)
         #Save current xy
-        self.currentMouseX = event.x;
-        self.currentMouseY = event.y;
+        self.currentMouseX = xCoord;
+        self.currentMouseY = yCoord;
 
     def cancelBBox(self, event):
         if 1 == self.STATE['click']:
-            if self.bboxId:
-                self.mainPanel.delete(self.bboxId)
-                self.bboxId = None
-                self.STATE['click'] = 0
+            self.mainPanel.itemconfig(self.rubberBand, state = HIDDEN)
+            self.STATE['click'] = 0
 
     def showHelp(self, event):
         tkMessageBox.showinfo("Help", USAGE)
@@ -543,24 +937,59 @@ class Euclid():
         if len(sel) != 1 :
             return
         idx = int(sel[0])
+        if idx >= len(self.boxes):
+            self.removeSuggestion(idx - len(self.boxes))
+            return
         self.mainPanel.delete(self.bboxIdList[idx])
         self.bboxIdList.pop(idx)
-        self.bboxList.pop(idx)
-        self.classLabelList.pop(idx)
+        self.boxes.delete(idx)
         self.listbox.delete(idx)
+        self.updateDirty()
 
     def clearBBox(self):
         for idx in range(len(self.bboxIdList)):
             self.mainPanel.delete(self.bboxIdList[idx])
-        self.listbox.delete(0, len(self.bboxList))
+        for idx in range(len(self.suggestionIdList)):
+            self.mainPanel.delete(self.suggestionIdList[idx])
+        self.listbox.delete(0, END)
         self.bboxIdList = []
-        self.bboxList = []
-        self.classLabelList = []
+        self.boxes = BoxSet()
+        self.suggestionIdList = []
+        self.suggestions = BoxSet()
+        self.suggestionScores = []
+        self.updateDirty()
+
+    def labelState(self):
+        # what a save writes, for the boxes and classes of the current image
+        return self.boxes.copy()
+
+    def isDirty(self):
+        return self.labelState() != self.savedLabelState
+
+    def updateDirty(self):
+        if self.labelfilename == '':
+            return
+        if self.isDirty():
+            self.dirtyLabel.config(text = 'Unsaved changes', fg = 'red')
+        else:
+            self.dirtyLabel.config(text = 'Saved', fg = 'dark green')
+
+    def saveIfDirty(self):
+        # navigation only writes the labels of the current image if they changed since loaded (or saved)
+        if self.labelfilename == '':
+            return
+        if self.isDirty():
+            self.saveLabel()
+        else:
+            self.writesAvoided = self.writesAvoided + 1
+
+    def sessionSummary(self):
+        return '%d label writes, %d writes avoided for unchanged images' %(self.labelWrites, self.writesAvoided)
 
     def prevImage(self, event = None):
         self.STATE['prevX'] = 0
         self.STATE['prevY'] = 0
-        self.saveLabel()    
+        self.saveIfDirty()
         if self.cur > 1:
             self.cur -= 1
             self.loadImageAndLabels()
@@ -574,7 +1003,7 @@ class Euclid():
     def nextImage(self, event = None):
         if((self.STATE['prevX']+self.STATE['prevY']) > 0):
             self.handleMouseOrXKey(self.STATE['prevX'], self.STATE['prevY'])
-        self.saveLabel()
+        self.saveIfDirty()
         if self.cur < self.total:
             self.cur += 1
             self.loadImageAndLabels()
@@ -594,7 +1023,12 @@ class Euclid():
         self.statusText.set("Status: " + newStatus)
     
 if __name__ == '__main__':
+    # --prelabel <model.onnx | module:function> (or EUCLID_PRELABEL) shows the proposals of a detector as suggested boxes
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--prelabel", default=os.environ.get('EUCLID_PRELABEL'), help="pre-labelling model spec")
+    parser.add_argument("--prelabel-workers", dest="prelabelWorkers", type=int, default=1)
+    args = parser.parse_args()
     root = Tk()
-    tool = Euclid(root)
+    tool = Euclid(root, args.prelabel, args.prelabelWorkers)
     root.mainloop()
 
@@ -0,0 +1,349 @@
+#-------------------------------------------------------------------------------
+# Euclid - benchmarks
+# Reproducible timings of the hot paths of the three tools:
+#   augment    euclidaug generation on the bundled sample objects and background
+#              (load, generate, label formatting and JPEG encode stages)
+#   boxes      pixel <-> YOLO conversions, label formatting and parsing (euclid_boxes)
+#   labelwrite labeller style saves, one label file per image, and the SQLite label store
+#   convert    headless converter over a synthetic KITTI label tree
+#   validate   dataset validation scanner over the same tree
+# Each stage runs in a fresh process, and reports items/s, boxes/s, per stage timings (wall and CPU)
+# and peak RSS. Synthetic data is generated from a fixed seed, so runs with the same options are comparable.
+# Results are saved as JSON, and --compare prints the change against a previous result file.
+#
+# python euclid_bench.py [--stages augment,boxes,...] [--files N] [--json out.json] [--compare base.json]
+#-------------------------------------------------------------------------------
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import tempfile
+import argparse
+import collections
+import multiprocessing
+import numpy as np
+try:
+    import resource
+except ImportError:
+    # not on Windows, peak RSS is not reported
+    resource = None
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+AUG_DIR = os.path.join(BENCH_DIR, 'euclidaug')
+sys.path.append(AUG_DIR)
+
+CLI_USAGE = "euclid_bench.py [--stages augment,boxes,labelwrite,convert,validate] [--files N] [--boxes-per-file K] " \
+            "[--aug-images N] [--workers N] [--repeat R] [--seed S] [--work-dir dir] [--json out.json] [--compare base.json]"
+
+STAGES = ['augment', 'boxes', 'labelwrite', 'convert', 'validate']
+# Format version of the result file
+RESULT_VERSION = 1
+
+# Size of the synthetic images, only their headers are read
+SYNTH_IMAGE_SIZE = (1280, 720)
+
+class StageTimer():
+    # Wall and CPU time of the named parts of a stage, summed over calls
+    def __init__(self):
+        self.wall = collections.OrderedDict()
+        self.cpu = collections.OrderedDict()
+        self.name = None
+
+    def start(self, name):
+        self.name = name
+        self.wallStart = time.perf_counter()
+        self.cpuStart = time.process_time()
+
+    def stop(self):
+        self.wall[self.name] = self.wall.get(self.name, 0.) + time.perf_counter() - self.wallStart
+        self.cpu[self.name] = self.cpu.get(self.name, 0.) + time.process_time() - self.cpuStart
+
+    def result(self):
+        return collections.OrderedDict([(name, {'wall': round(self.wall[name], 6), 'cpu': round(self.cpu[name], 6)})
+                                        for name in self.wall])
+
+def peakRssMB():
+    # Peak RSS of this process and of its waited for children (worker pools), in MB
+    if resource is None:
+        return None
+    scale = 1048576. if sys.platform == 'darwin' else 1024.
+    selfRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    childRss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(selfRss, childRss) / scale, 1)
+
+def syntheticBoxes(rng, numBoxes, imageSize):
+    # BoxSet of numBoxes random boxes inside imageSize, at least 2 pixels wide and high
+    from euclid_boxes import BoxSet
+    x1 = rng.integers(0, imageSize[0] - 2, numBoxes)
+    y1 = rng.integers(0, imageSize[1] - 2, numBoxes)
+    x2 = x1 + 2 + rng.integers(0, imageSize[0] - x1 - 1, numBoxes)
+    y2 = y1 + 2 + rng.integers(0, imageSize[1] - y1 - 1, numBoxes)
+    return BoxSet(rng.integers(0, 8, numBoxes), np.column_stack([x1, y1, x2, y2]))
+
+def makeLabelTree(root, numFiles, boxesPerFile, seed):
+    # Labeller layout: images in root, KITTI labels in root/LabelData. The images are copies of one small PNG
+    # with SYNTH_IMAGE_SIZE in its header. Returns the total number of boxes
+    from PIL import Image
+    from euclid_boxes import formatKitti
+    import io
+    labelDir = os.path.join(root, 'LabelData')
+    os.makedirs(labelDir)
+    encoded = io.BytesIO()
+    Image.new('L', SYNTH_IMAGE_SIZE).save(encoded, 'PNG')
+    imageBytes = encoded.getvalue()
+    rng = np.random.default_rng(seed)
+    numBoxes = 0
+    for fileId in range(numFiles):
+        name = 'synth%07d' % fileId
+        with open(os.path.join(root, name + '.png'), 'wb') as f:
+            f.write(imageBytes)
+        boxes = syntheticBoxes(rng, int(rng.integers(1, 2 * boxesPerFile)), SYNTH_IMAGE_SIZE)
+        numBoxes = numBoxes + len(boxes)
+        with open(os.path.join(labelDir, name + '.txt'), 'w') as f:
+            f.write(formatKitti(boxes))
+    return numBoxes
+
+def benchAugment(config, timer):
+    import io
+    import euclidaug
+    euclidaug.blendBackend = config['blend']
+    objectDir = os.path.join(AUG_DIR, 'sample-objects')
+    baseNames = euclidaug.get_file_list(os.path.join(AUG_DIR, 'sample-background'))
+    timer.start('load')
+    objects, maxPerClass = euclidaug.loadObjectImages(objectDir)
+    spriteCache = euclidaug.SpriteCache(objects, euclidaug.getScales(), int(euclidaug.spriteCacheMB * 1048576),
+                                        config['blend'] == 'numpy')
+    spriteCache.warm()
+    bases = euclidaug.loadBaseImages(baseNames)
+    if config['blend'] == 'numpy':
+        bases = [np.asarray(img, np.float32) for img in bases]
+    timer.stop()
+    images = 0
+    boxes = 0
+    for imageId in range(config['augImages']):
+        bgId = imageId % len(bases)
+        rng = random.Random(euclidaug.taskSeed(config['seed'], os.path.basename(baseNames[bgId]), imageId))
+        timer.start('generate')
+        canvases, stats = euclidaug.generateBatch(1, objects, bases[bgId], rng, spriteCache)
+        timer.stop()
+        if canvases[0] is None or canvases[0][2] is True:
+            continue
+        genImage, labelBoxes, bad = canvases[0]
+        timer.start('label')
+        genImage = genImage.convert('RGB')
+        euclidaug.formatLabel('bench.jpg', genImage, labelBoxes)
+        timer.stop()
+        timer.start('encode')
+        encoded = io.BytesIO()
+        genImage.save(encoded, 'jpeg')
+        timer.stop()
+        images = images + 1
+        boxes = boxes + stats.placedRects
+    return images, boxes
+
+def benchBoxes(config, timer):
+    from euclid_boxes import formatYolo, formatKitti, parseLabelText
+    from euclid_voc import formatVoc, parseVocText
+    rng = np.random.default_rng(config['seed'])
+    boxSets = [syntheticBoxes(rng, config['boxesPerFile'], SYNTH_IMAGE_SIZE) for fileId in range(config['files'])]
+    timer.start('formatYolo')
+    yoloTexts = [formatYolo(boxes, SYNTH_IMAGE_SIZE) for boxes in boxSets]
+    timer.stop()
+    timer.start('parseYolo')
+    for text in yoloTexts:
+        parseLabelText(text, SYNTH_IMAGE_SIZE)
+    timer.stop()
+    timer.start('formatKitti')
+    kittiTexts = [formatKitti(boxes) for boxes in boxSets]
+    timer.stop()
+    timer.start('parseKitti')
+    for text in kittiTexts:
+        parseLabelText(text, SYNTH_IMAGE_SIZE)
+    timer.stop()
+    timer.start('formatVoc')
+    vocTexts = [formatVoc(boxes, SYNTH_IMAGE_SIZE, 'synth.png') for boxes in boxSets]
+    timer.stop()
+    timer.start('parseVoc')
+    for text in vocTexts:
+        parseVocText(text)
+    timer.stop()
+    return len(boxSets), sum([len(boxes) for boxes in boxSets])
+
+def benchLabelWrite(config, timer):
+    from euclid_boxes import formatLabels
+    from euclid_labelstore import LabelStore
+    rng = np.random.default_rng(config['seed'])
+    boxSets = [syntheticBoxes(rng, config['boxesPerFile'], SYNTH_IMAGE_SIZE) for fileId in range(config['files'])]
+    outDir = os.path.join(config['workDir'], 'labelwrite')
+    os.makedirs(os.path.join(outDir, 'LabelData'))
+    # labeller saveLabel: format and write the whole label file of the image
+    timer.start('files')
+    for fileId, boxes in enumerate(boxSets):
+        with open(os.path.join(outDir, 'LabelData', 'synth%07d.txt' % fileId), 'w') as f:
+            f.write(formatLabels('YOLO', boxes, SYNTH_IMAGE_SIZE))
+    timer.stop()
+    timer.start('store')
+    store = LabelStore(os.path.join(outDir, 'labels.db'))
+    for fileId, boxes in enumerate(boxSets):
+        store.save(os.path.join(outDir, 'synth%07d.png' % fileId), SYNTH_IMAGE_SIZE, 'YOLO', boxes)
+    store.close()
+    timer.stop()
+    return len(boxSets), sum([len(boxes) for boxes in boxSets])
+
+def benchConvert(config, timer):
+    from euclid_yolo_kitti_converter import ConvertTree
+    treeDir = os.path.join(config['workDir'], 'tree')
+    outDir = os.path.join(config['workDir'], 'convert')
+    # new dimension index each run, the image headers are always read
+    os.makedirs(outDir)
+    timer.start('convert')
+    stats = ConvertTree(os.path.join(treeDir, 'LabelData'), 'yolo', os.path.join(outDir, 'labels'),
+                        treeDir, config['workers'], dimIndexPath=os.path.join(outDir, 'dims.db'))
+    timer.stop()
+    if len(stats.errors) > 0:
+        raise RuntimeError('%d conversion errors, first: %s' % (len(stats.errors), stats.errors[0]))
+    return stats.files, stats.boxes
+
+def benchValidate(config, timer):
+    from euclid_validate import validateTree
+    timer.start('validate')
+    stats = validateTree(os.path.join(config['workDir'], 'tree'), None, 8, config['workers'])
+    timer.stop()
+    return stats.labels, stats.boxes
+
+stageFunctions = {'augment': benchAugment, 'boxes': benchBoxes, 'labelwrite': benchLabelWrite,
+                  'convert': benchConvert, 'validate': benchValidate}
+
+def runStage(stage, config, results):
+    # Entry of the stage process, puts the result (or the error) in the results queue
+    try:
+        os.chdir(config['workDir'])
+        sys.path.append(BENCH_DIR)
+        timer = StageTimer()
+        wallStart = time.perf_counter()
+        items, boxes = stageFunctions[stage](config, timer)
+        totalSeconds = time.perf_counter() - wallStart
+        # throughputs are of the timed parts, without the setup of the synthetic inputs
+        seconds = sum(timer.wall.values())
+        cpuSeconds = sum(timer.cpu.values())
+        results.put(collections.OrderedDict([
+            ('items', items), ('boxes', boxes), ('seconds', round(seconds, 6)), ('cpuSeconds', round(cpuSeconds, 6)),
+            ('totalSeconds', round(totalSeconds, 6)),
+            ('itemsPerSec', round(items / max(seconds, 1e-9), 1)), ('boxesPerSec', round(boxes / max(seconds, 1e-9), 1)),
+            ('peakRssMB', peakRssMB()), ('parts', timer.result())]))
+    except Exception as e:
+        results.put({'error': '%s: %s' % (type(e).__name__, e)})
+
+def runStageProcess(stage, config):
+    # spawn, so that each stage starts from a fresh interpreter and its peak RSS is its own
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    process = context.Process(target=runStage, args=(stage, config, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def runBenchmarks(config, stages, repeat=1):
+    # Returns the result dict. With repeat > 1 each stage is run repeat times, and the fastest run is kept
+    result = collections.OrderedDict([
+        ('version', RESULT_VERSION),
+        ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('host', collections.OrderedDict([
+            ('python', platform.python_version()), ('platform', platform.platform()),
+            ('cpus', multiprocessing.cpu_count()), ('numpy', np.__version__)])),
+        ('config', config),
+        ('stages', collections.OrderedDict())])
+    if 'convert' in stages or 'validate' in stages:
+        timeStart = time.perf_counter()
+        treeBoxes = makeLabelTree(os.path.join(config['workDir'], 'tree'), config['files'], config['boxesPerFile'], config['seed'])
+        print("Info: Synthetic tree of [%d] images, [%d] boxes in [%.2f] (s)" % (config['files'], treeBoxes, time.perf_counter() - timeStart))
+    for stage in stages:
+        runs = []
+        for run in range(max(1, repeat)):
+            runs.append(runStageProcess(stage, config))
+            outDir = os.path.join(config['workDir'], stage)
+            if os.path.isdir(outDir):
+                shutil.rmtree(outDir)
+        failed = [r for r in runs if 'error' in r]
+        best = failed[0] if len(failed) > 0 else min(runs, key=lambda r: r['seconds'])
+        if repeat > 1 and len(failed) == 0:
+            best['runSeconds'] = [r['seconds'] for r in runs]
+        result['stages'][stage] = best
+        print(stageReport(stage, best))
+    return result
+
+def stageReport(stage, r):
+    if 'error' in r:
+        return "Error: [%s] %s" % (stage, r['error'])
+    parts = ', '.join(['%s %.3f' % (name, part['wall']) for name, part in r['parts'].items()])
+    return "Info: [%s] [%d] items, [%d] boxes in [%.3f] (s), [%.1f] items/s, [%.0f] boxes/s, peak RSS [%s] MB (%s)" % (
+        stage, r['items'], r['boxes'], r['seconds'], r['itemsPerSec'], r['boxesPerSec'], r['peakRssMB'], parts)
+
+def compareResults(base, current):
+    # Lines comparing the stages of two result dicts, ratios > 1 are faster than base
+    lines = []
+    if base.get('config') != current.get('config'):
+        lines.append("Warning: benchmark options differ from the base run, throughputs are compared")
+    for stage, r in current['stages'].items():
+        b = base['stages'].get(stage)
+        if b is None or 'error' in b or 'error' in r:
+            continue
+        lines.append("Compare: [%s] items/s [%.1f] -> [%.1f] (x%.2f), boxes/s [%.0f] -> [%.0f] (x%.2f), peak RSS [%s] -> [%s] MB" % (
+            stage, b['itemsPerSec'], r['itemsPerSec'], r['itemsPerSec'] / max(b['itemsPerSec'], 1e-9),
+            b['boxesPerSec'], r['boxesPerSec'], r['boxesPerSec'] / max(b['boxesPerSec'], 1e-9), b['peakRssMB'], r['peakRssMB']))
+        for name, part in r['parts'].items():
+            if name in b['parts']:
+                lines.append("Compare:   [%s] %.3f -> %.3f (s) (x%.2f)" % (
+                    name, b['parts'][name]['wall'], part['wall'], b['parts'][name]['wall'] / max(part['wall'], 1e-9)))
+    return lines
+
+def main(argv):
+    parser = argparse.ArgumentParser(usage=CLI_USAGE)
+    parser.add_argument("--stages", default=','.join(STAGES), help="comma separated, of " + ','.join(STAGES))
+    parser.add_argument("--files", type=int, default=20000, help="label files of the synthetic data")
+    parser.add_argument("--boxes-per-file", dest="boxesPerFile", type=int, default=8)
+    parser.add_argument("--aug-images", dest="augImages", type=int, default=50, help="images generated by euclidaug")
+    parser.add_argument("--blend", choices=["pil", "numpy"], default="pil", help="euclidaug blend backend")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count(), help="converter and validation workers")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per stage, the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", dest="workDir", default=None, help="synthetic data and outputs (default: a temporary directory)")
+    parser.add_argument("--json", dest="jsonPath", default=None, help="result file")
+    parser.add_argument("--compare", dest="comparePath", default=None, help="result file of a previous run")
+    args = parser.parse_args(argv)
+    stages = [stage for stage in args.stages.split(',') if stage != '']
+    for stage in stages:
+        if stage not in STAGES:
+            sys.exit("Error: Unknown stage [" + stage + "], of " + ','.join(STAGES))
+    base = None
+    if args.comparePath is not None:
+        with open(args.comparePath) as f:
+            base = json.load(f)
+    workDir = args.workDir if args.workDir is not None else tempfile.mkdtemp(prefix='euclid_bench')
+    if os.path.exists(workDir) and len(os.listdir(workDir)) > 0:
+        sys.exit("Error: The work directory is not empty [" + workDir + "]")
+    config = collections.OrderedDict([
+        ('files', args.files), ('boxesPerFile', args.boxesPerFile), ('augImages', args.augImages), ('blend', args.blend),
+        ('workers', args.workers), ('seed', args.seed), ('workDir', os.path.abspath(workDir))])
+    try:
+        result = runBenchmarks(config, stages, args.repeat)
+    finally:
+        if args.workDir is None:
+            shutil.rmtree(workDir)
+    # the work directory is not part of the compared configuration
+    result['config'] = collections.OrderedDict([(k, v) for k, v in config.items() if k != 'workDir'])
+    if args.jsonPath is not None:
+        with open(args.jsonPath, 'w') as f:
+            json.dump(result, f, indent=2)
+            f.write('\n')
+    if base is not None:
+        for line in compareResults(base, result):
+            print(line)
+    return 1 if any(['error' in r for r in result['stages'].values()]) else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
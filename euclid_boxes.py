@@ -0,0 +1,184 @@
+#-------------------------------------------------------------------------------
+# Euclid - box sets
+# Bounding boxes of one image as NumPy arrays, shared by the labeller, the label
+# converter and euclidaug:
+#   classes : (N,) integer class ids
+#   xyxy    : (N, 4) x1 y1 x2 y2, in full resolution pixels
+# Conversions between the pixel (xyxy), YOLO (cx cy w h, normalised) and KITTI row
+# layouts work on all the boxes at once, and each label format has a parse and a
+# format function. Pascal VOC files are read and written by euclid_voc.
+#-------------------------------------------------------------------------------
+import warnings
+import numpy as np
+
+# KITTI type of a class id (Euclid writes Class0, Class1, ..)
+CLASS_PREFIX = 'Class'
+
+# YOLO and KITTI rows, KITTI rows have 15 columns (truncated, occluded, alpha, dimensions, location
+# and rotation_y are written as 0)
+YOLO_ROW = '%d %.7f %.7f %.7f %.7f\n'
+KITTI_ROW = '%d 0.0 0 0.0 %.2f %.2f %.2f %.2f 0.0 0.0 0.0 0.0 0.0 0.0 0.0\n'
+
+def parseClassId(name):
+    # Class ids are written as "3" (YOLO, euclidaug) or "Class3" (KITTI output of Euclid)
+    while name.startswith(CLASS_PREFIX):
+        name = name[len(CLASS_PREFIX):]
+    return int(name)
+
+def xyxyToCxcywh(xyxy, imageSize):
+    # pixels -> YOLO (normalised center, width and height)
+    xyxy = np.asarray(xyxy, np.float64).reshape(-1, 4)
+    invWidth = 1. / imageSize[0]
+    invHeight = 1. / imageSize[1]
+    cxcywh = np.empty_like(xyxy)
+    cxcywh[:, 0] = invWidth * (xyxy[:, 0] + xyxy[:, 2]) / 2.0
+    cxcywh[:, 1] = invHeight * (xyxy[:, 1] + xyxy[:, 3]) / 2.0
+    cxcywh[:, 2] = invWidth * (xyxy[:, 2] - xyxy[:, 0])
+    cxcywh[:, 3] = invHeight * (xyxy[:, 3] - xyxy[:, 1])
+    return cxcywh
+
+def cxcywhToXyxy(cxcywh, imageSize):
+    # YOLO -> pixels, rounded (not truncated), so that pixel -> YOLO -> pixel conversions are exact
+    cxcywh = np.asarray(cxcywh, np.float64).reshape(-1, 4)
+    halfWidth = (cxcywh[:, 2] * imageSize[0]) / 2
+    halfHeight = (cxcywh[:, 3] * imageSize[1]) / 2
+    xyxy = np.empty_like(cxcywh)
+    xyxy[:, 0] = cxcywh[:, 0] * imageSize[0] - halfWidth
+    xyxy[:, 1] = cxcywh[:, 1] * imageSize[1] - halfHeight
+    xyxy[:, 2] = cxcywh[:, 0] * imageSize[0] + halfWidth
+    xyxy[:, 3] = cxcywh[:, 1] * imageSize[1] + halfHeight
+    return np.rint(xyxy)
+
+class BoxSet():
+    # Class ids and pixel boxes of one image
+    def __init__(self, classes=(), xyxy=None):
+        self.classes = np.asarray(classes, np.int64).reshape(-1)
+        if xyxy is None:
+            xyxy = np.zeros((len(self.classes), 4))
+        self.xyxy = np.asarray(xyxy, np.float64).reshape(-1, 4)
+        if len(self.classes) != len(self.xyxy):
+            raise ValueError('%d classes for %d boxes' % (len(self.classes), len(self.xyxy)))
+
+    def __len__(self):
+        return len(self.classes)
+
+    def append(self, classId, box):
+        self.classes = np.append(self.classes, int(classId))
+        self.xyxy = np.vstack([self.xyxy, np.asarray(box, np.float64).reshape(1, 4)])
+
+    def delete(self, idx):
+        self.classes = np.delete(self.classes, idx)
+        self.xyxy = np.delete(self.xyxy, idx, axis=0)
+
+    def box(self, idx):
+        return tuple(self.xyxy[idx].tolist())
+
+    def rows(self):
+        # [(classId, x1, y1, x2, y2)]
+        return [(classId,) + tuple(box) for classId, box in zip(self.classes.tolist(), self.xyxy.tolist())]
+
+    def copy(self):
+        return BoxSet(self.classes.copy(), self.xyxy.copy())
+
+    def __eq__(self, other):
+        return isinstance(other, BoxSet) and np.array_equal(self.classes, other.classes) and np.array_equal(self.xyxy, other.xyxy)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def cxcywh(self, imageSize):
+        return xyxyToCxcywh(self.xyxy, imageSize)
+
+def boxSetFromRows(rows):
+    # rows of (classId, x1, y1, x2, y2)
+    rows = list(rows)
+    return BoxSet([row[0] for row in rows], [row[1:5] for row in rows])
+
+def boxSetFromCxcywh(classes, cxcywh, imageSize):
+    return BoxSet(classes, cxcywhToXyxy(cxcywh, imageSize))
+
+def splitRows(text):
+    return [line.split() for line in text.splitlines() if line.strip() != '']
+
+def detectFormat(text):
+    # 'kitti' (more than 5 columns), 'yolo' (5 columns), 'voc' (XML), or None for an empty label file. Like Euclid does
+    if text.lstrip().startswith('<'):
+        return 'voc'
+    for line in text.splitlines():
+        row = line.split()
+        if len(row) > 5:
+            return 'kitti'
+        if len(row) == 5:
+            return 'yolo'
+    return None
+
+def parseYolo(text):
+    # Returns (classes, cxcywh), the boxes normalised to the image size
+    # Well formed files (only numbers, 5 per line) are parsed in one call, others row by row
+    # the number of values alone would accept rows of 4 and 6 values, every line is checked
+    rowWidths = [len(line.split()) for line in text.splitlines()]
+    numLines = len(rowWidths) - rowWidths.count(0)
+    try:
+        # older NumPy versions warn (instead of raising) on a partial parse
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            values = np.fromstring(text, np.float64, sep=' ')
+    except ValueError:
+        values = np.zeros(0)
+    if numLines > 0 and values.size == 5 * numLines and rowWidths.count(5) == numLines:
+        values = values.reshape(-1, 5)
+        return values[:, 0].astype(np.int64), values[:, 1:5]
+    rows = [row for row in splitRows(text) if len(row) == 5]
+    if len(rows) == 0:
+        return np.zeros(0, np.int64), np.zeros((0, 4))
+    values = np.array(rows, np.float64)
+    return values[:, 0].astype(np.int64), values[:, 1:5]
+
+def parseKitti(text):
+    rows = [row for row in splitRows(text) if len(row) > 5]
+    if len(rows) == 0:
+        return BoxSet()
+    return BoxSet([parseClassId(row[0]) for row in rows], np.array([row[4:8] for row in rows], np.float64))
+
+def parseLabelText(text, imageSize=None):
+    # Returns (format, BoxSet) of a YOLO, KITTI or VOC label file. imageSize is needed for YOLO boxes
+    labelFormat = detectFormat(text)
+    if labelFormat == 'voc':
+        # euclid_voc builds on this module
+        from euclid_voc import parseVocText
+        return labelFormat, parseVocText(text)[2]
+    if labelFormat == 'yolo':
+        if imageSize is None:
+            raise ValueError('image size needed for YOLO boxes')
+        classes, cxcywh = parseYolo(text)
+        return labelFormat, boxSetFromCxcywh(classes, cxcywh, imageSize)
+    if labelFormat == 'kitti':
+        return labelFormat, parseKitti(text)
+    return labelFormat, BoxSet()
+
+def formatYolo(boxes, imageSize):
+    if len(boxes) == 0:
+        return ''
+    values = np.column_stack([boxes.classes, boxes.cxcywh(imageSize)])
+    return (YOLO_ROW * len(boxes)) % tuple(values.ravel().tolist())
+
+def formatKitti(boxes, classPrefix=CLASS_PREFIX):
+    if len(boxes) == 0:
+        return ''
+    values = np.column_stack([boxes.classes, boxes.xyxy])
+    return ((classPrefix + KITTI_ROW) * len(boxes)) % tuple(values.ravel().tolist())
+
+def labelExtension(labelFormat):
+    return '.xml' if labelFormat.lower() == 'voc' else '.txt'
+
+def formatLabels(labelFormat, boxes, imageSize=None, imageName=''):
+    # text of a YOLO, KITTI or VOC label file (format names are not case sensitive). imageName is for VOC
+    labelFormat = labelFormat.lower()
+    if labelFormat == 'yolo':
+        return formatYolo(boxes, imageSize)
+    if labelFormat == 'kitti':
+        return formatKitti(boxes)
+    if labelFormat == 'voc':
+        from euclid_voc import formatVoc
+        return formatVoc(boxes, imageSize, imageName)
+    raise ValueError('Unknown label format ' + str(labelFormat))
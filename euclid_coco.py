@@ -0,0 +1,453 @@
+#-------------------------------------------------------------------------------
+# Euclid - COCO export and import
+# Export: a labelled image tree (labeller LabelData, converter input layouts, euclidaug
+# output folders or shards) to one COCO JSON file. Images are written as they are read
+# and the annotations spooled to a temporary file, so memory does not grow with the
+# number of images.
+# Import: COCO JSON to YOLO, KITTI or VOC label files. The file is read in blocks and
+# decoded one array element at a time, image and annotation records are spilled to
+# hash buckets on disk (sized from the memory budget), and each bucket is grouped per
+# image in memory.
+#
+# python euclid_coco.py export <image dir> [--labels dir] [--names file] [--out coco.json] [--workers N]
+# python euclid_coco.py import <coco json> --to yolo|kitti|voc [--out dir] [--memory-mb M]
+#-------------------------------------------------------------------------------
+import os
+import io
+import re
+import sys
+import json
+import math
+import time
+import zlib
+import codecs
+import shutil
+import argparse
+import tempfile
+import itertools
+import collections
+import multiprocessing
+import numpy as np
+from euclid_dimindex import readImageSize
+from euclid_boxes import BoxSet, parseLabelText, formatLabels, labelExtension
+from euclid_validate import walkPairs, readLabels
+from euclid_yolo_kitti_converter import WriteFileAtomic
+
+AUG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'euclidaug')
+sys.path.append(AUG_DIR)
+from euclidshard import ShardReader, SHARD_LIST_FILE_NAME
+
+CLI_USAGE = "euclid_coco.py export <image dir> [--labels dir] [--names file] [--out coco.json] [--workers N]\n" \
+            "       euclid_coco.py import <coco json> --to yolo|kitti|voc [--out dir] [--memory-mb M]"
+
+COCO_READ_BLOCK = 1 << 20
+# Label files per export job
+CHUNK_SIZE = 256
+CHUNKS_PER_WORKER = 4
+# Memory of a bucket grouped in memory, per byte of the input file
+BUCKET_EXPANSION = 6
+MAX_BUCKETS = 512
+DEFAULT_MEMORY_MB = 256
+# Class names written by import, in class id order
+NAMES_FILE_NAME = 'coco.names'
+
+COCO_ANNOTATION = '{"id": %d, "image_id": %d, "category_id": %d, "bbox": [%.2f, %.2f, %.2f, %.2f], "area": %.2f, "iscrowd": 0}'
+
+class CocoWriter():
+    # Streams a COCO file to f: addImage() for every image, then close(). Category ids are the class ids + 1,
+    # every class up to the largest one seen (or named) is listed
+    def __init__(self, f, names=None):
+        self.f = f
+        self.names = names if names is not None else []
+        self.images = 0
+        self.annotations = 0
+        self.maxClass = len(self.names) - 1
+        self.spool = tempfile.TemporaryFile('w+')
+        self.f.write('{\n"info": %s,\n"licenses": [],\n"images": [' % json.dumps(
+            {'description': 'Euclid export', 'date_created': time.strftime('%Y-%m-%d %H:%M:%S')}))
+
+    def addImage(self, fileName, width, height, boxes, extra=None):
+        self.images = self.images + 1
+        image = {'id': self.images, 'file_name': fileName, 'width': width, 'height': height}
+        if extra is not None:
+            image.update(extra)
+        self.f.write(('\n' if self.images == 1 else ',\n') + json.dumps(image))
+        if len(boxes) == 0:
+            return
+        ids = np.arange(self.annotations + 1, self.annotations + len(boxes) + 1)
+        widths = boxes.xyxy[:, 2] - boxes.xyxy[:, 0]
+        heights = boxes.xyxy[:, 3] - boxes.xyxy[:, 1]
+        values = np.column_stack([ids, np.full(len(boxes), self.images), boxes.classes + 1, boxes.xyxy[:, 0], boxes.xyxy[:, 1],
+                                  widths, heights, widths * heights])
+        rows = ',\n'.join([COCO_ANNOTATION] * len(boxes)) % tuple(values.ravel().tolist())
+        self.spool.write((',\n' if self.annotations > 0 else '\n') + rows)
+        self.annotations = self.annotations + len(boxes)
+        self.maxClass = max(self.maxClass, int(boxes.classes.max()))
+
+    def close(self):
+        self.f.write('\n],\n"annotations": [')
+        self.spool.seek(0)
+        shutil.copyfileobj(self.spool, self.f)
+        self.spool.close()
+        categories = []
+        for classId in range(0, self.maxClass + 1):
+            name = self.names[classId] if classId < len(self.names) else 'Class%d' % classId
+            categories.append(json.dumps({'id': classId + 1, 'name': name, 'supercategory': 'none'}))
+        self.f.write('\n],\n"categories": [\n' + ',\n'.join(categories) + '\n]\n}\n')
+
+def exportChunk(job):
+    # Returns [(image path, width, height, classes, xyxy, error)], error None if the boxes were read
+    pairs, imageDir = job
+    results = []
+    for labelPath, imagePath in pairs:
+        if imagePath is None:
+            continue
+        try:
+            imageSize = readImageSize(imagePath)
+            if imageSize is None:
+                raise ValueError('cannot read the image size')
+            if labelPath is None:
+                classes, xyxy = np.zeros(0, np.int64), np.zeros((0, 4))
+            else:
+                labelFormat, classes, xyxy, malformedRows = readLabels(labelPath, imageSize)
+            results.append((os.path.relpath(imagePath, imageDir), imageSize[0], imageSize[1], classes, xyxy, None))
+        except Exception as e:
+            results.append((os.path.relpath(imagePath, imageDir), 0, 0, None, None, str(e)))
+    return results
+
+def treeRecords(imageDir, labelDir=None, workers=1, recursive=True):
+    # (file name, width, height, classes, xyxy, error, extra) of every image of the tree, in walk order
+    pairs = walkPairs(imageDir, labelDir, recursive)
+    def jobs():
+        while True:
+            chunk = list(itertools.islice(pairs, CHUNK_SIZE))
+            if len(chunk) == 0:
+                return
+            yield chunk, imageDir
+    if workers <= 1:
+        for job in jobs():
+            for record in exportChunk(job):
+                yield record + (None,)
+        return
+    # bounded number of chunks in flight, like the validator
+    pool = multiprocessing.Pool(workers)
+    try:
+        inFlight = collections.deque()
+        for job in jobs():
+            inFlight.append(pool.apply_async(exportChunk, (job,)))
+            if len(inFlight) >= workers * CHUNKS_PER_WORKER:
+                for record in inFlight.popleft().get():
+                    yield record + (None,)
+        while len(inFlight) > 0:
+            for record in inFlight.popleft().get():
+                yield record + (None,)
+    finally:
+        pool.close()
+        pool.join()
+
+def shardRecords(shardDir):
+    # Records of the samples of euclidaug shards, in the order of the shard list. File names are the member names,
+    # with the shard in the image record
+    with open(os.path.join(shardDir, SHARD_LIST_FILE_NAME)) as f:
+        shards = [json.loads(line)['shard'] for line in f if line.strip() != '']
+    for shard in shards:
+        reader = ShardReader(os.path.join(shardDir, shard))
+        try:
+            for sample in reader:
+                fileName = sample['__key__'] + '.jpg'
+                try:
+                    imageSize = readImageSize(io.BytesIO(sample['jpg']))
+                    labelText = sample.get('txt', sample.get('xml', b'')).decode('utf-8')
+                    boxes = parseLabelText(labelText, imageSize)[1]
+                    yield fileName, imageSize[0], imageSize[1], boxes.classes, boxes.xyxy, None, {'shard': shard}
+                except Exception as e:
+                    yield fileName, 0, 0, None, None, str(e), {'shard': shard}
+        finally:
+            reader.close()
+
+class ExportStats():
+    def __init__(self):
+        self.images = 0
+        self.annotations = 0
+        self.errors = []
+        self.seconds = 0.
+
+    def report(self):
+        return "Exported [%d] images, [%d] annotations in [%.2f] (s), [%d] errors" % (
+            self.images, self.annotations, self.seconds, len(self.errors))
+
+def exportCoco(imageDir, outPath, labelDir=None, names=None, workers=1, recursive=True):
+    # Writes the COCO file of the tree (or of the euclidaug shards in imageDir) to outPath. Returns ExportStats.
+    # Images whose labels cannot be read are left out
+    stats = ExportStats()
+    timeStart = time.time()
+    if os.path.exists(os.path.join(imageDir, SHARD_LIST_FILE_NAME)):
+        records = shardRecords(imageDir)
+    else:
+        records = treeRecords(imageDir, labelDir, workers, recursive)
+    tmpPath = outPath + '.tmp'
+    with open(tmpPath, 'w') as f:
+        writer = CocoWriter(f, names)
+        for fileName, width, height, classes, xyxy, error, extra in records:
+            if error is None and xyxy is None:
+                error = 'image size needed for YOLO boxes'
+            if error is not None:
+                stats.errors.append((fileName, error))
+                continue
+            writer.addImage(fileName, width, height, BoxSet(classes, xyxy), extra)
+        writer.close()
+        stats.images = writer.images
+        stats.annotations = writer.annotations
+    os.replace(tmpPath, outPath)
+    stats.seconds = time.time() - timeStart
+    return stats
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# characters that can continue a number
+NUMBER_CHARS = '.eE+-0123456789'
+
+class JsonStream():
+    # Top level object of a JSON file, read in blocks. members() yields (key, value, False) of the top level members,
+    # and (key, element, True) for each element of the top level arrays, one at a time
+    def __init__(self, f, blockSize=COCO_READ_BLOCK):
+        self.f = f
+        self.blockSize = blockSize
+        self.decoder = json.JSONDecoder()
+        self.textDecoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.bytesRead = 0
+
+    def fill(self):
+        if self.eof is True:
+            return False
+        # grows with the pending text, values larger than a block are decoded again at most log times
+        data = self.f.read(max(self.blockSize, len(self.buf) - self.pos))
+        self.bytesRead = self.bytesRead + len(data)
+        self.eof = len(data) == 0
+        self.buf = self.buf[self.pos:] + self.textDecoder.decode(data, final=self.eof)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        # next character that is not white space, None at the end of the file
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, chars):
+        c = self.peek()
+        if c is None or c not in chars:
+            raise ValueError('expected %s near byte %d, found %r' % (' or '.join(chars), self.bytesRead, c))
+        self.pos = self.pos + 1
+        return c
+
+    def value(self):
+        if self.pos >= len(self.buf) or self.buf[self.pos] in ' \t\n\r':
+            self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a number cut by the end of the buffer (after "1" or "1.") continues in the next block
+                cut = (isinstance(value, (int, float)) and not isinstance(value, bool) and
+                       (end == len(self.buf) or self.buf[end] in NUMBER_CHARS))
+                if not cut or self.eof is True:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof is True:
+                    raise
+            self.fill()
+
+    def members(self):
+        self.expect('{')
+        if self.peek() == '}':
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            if self.peek() == '[':
+                self.pos = self.pos + 1
+                if self.peek() == ']':
+                    self.pos = self.pos + 1
+                else:
+                    while True:
+                        yield key, self.value(), True
+                        # usually the separator follows the element directly
+                        if self.pos < len(self.buf) and self.buf[self.pos] == ',':
+                            self.pos = self.pos + 1
+                        elif self.expect(',]') == ']':
+                            break
+            else:
+                yield key, self.value(), False
+            if self.expect(',}') == '}':
+                return
+
+class ImportStats():
+    def __init__(self):
+        self.images = 0
+        self.annotations = 0
+        self.crowd = 0
+        self.orphans = 0
+        self.buckets = 0
+        self.names = []
+        self.files = 0
+        self.errors = []
+        self.seconds = 0.
+
+    def report(self):
+        return "Imported [%d] images, [%d] annotations ([%d] crowd skipped, [%d] without image) in [%.2f] (s), [%d] buckets, [%d] label files, [%d] errors" % (
+            self.images, self.annotations, self.crowd, self.orphans, self.seconds, self.buckets, self.files, len(self.errors))
+
+# Bucket records are tab separated lines, 'a' annotations (image id, category id, bbox) and 'i' images
+# (image id, JSON record). Ids are written as numbers, or as JSON strings
+BUCKET_ANNOTATION = 'a\t%s\t%s\t%r\t%r\t%r\t%r\n'
+BUCKET_IMAGE = 'i\t%s\t%s\n'
+
+def writeId(value):
+    return str(value) if isinstance(value, int) else json.dumps(value)
+
+def readId(text):
+    return json.loads(text) if text[0] == '"' else int(text)
+
+def bucketOf(imageId, numBuckets):
+    if isinstance(imageId, int):
+        return imageId % numBuckets
+    return zlib.crc32(str(imageId).encode('utf-8')) % numBuckets
+
+def iterCocoImages(path, memoryMB=DEFAULT_MEMORY_MB, stats=None):
+    # Yields (image, BoxSet) of every image of a COCO file, image is the COCO image record. Class ids are the
+    # positions of the category ids in sorted order (COCO 1..90 becomes 0..79), their names are in stats.names once
+    # the first image is yielded. Images are grouped per bucket, in id order within a bucket
+    if stats is None:
+        stats = ImportStats()
+    numBuckets = min(MAX_BUCKETS, max(1, int(math.ceil(os.path.getsize(path) * BUCKET_EXPANSION / (memoryMB * 1048576.)))))
+    stats.buckets = numBuckets
+    buckets = [tempfile.TemporaryFile('w+') for b in range(numBuckets)]
+    try:
+        categories = []
+        with open(path, 'rb') as f:
+            for key, value, isItem in JsonStream(f).members():
+                if isItem is False:
+                    continue
+                if key == 'annotations':
+                    if value.get('iscrowd', 0) == 1:
+                        stats.crowd = stats.crowd + 1
+                        continue
+                    imageId = value['image_id']
+                    bbox = value['bbox']
+                    buckets[bucketOf(imageId, numBuckets)].write(BUCKET_ANNOTATION % (writeId(imageId), writeId(value['category_id']),
+                                                                                      bbox[0], bbox[1], bbox[2], bbox[3]))
+                elif key == 'images':
+                    imageId = value['id']
+                    buckets[bucketOf(imageId, numBuckets)].write(BUCKET_IMAGE % (writeId(imageId), json.dumps(value)))
+                elif key == 'categories':
+                    categories.append((value['id'], value.get('name', str(value['id']))))
+        categories.sort()
+        stats.names = [name for categoryId, name in categories]
+        classOf = dict([(categoryId, classId) for classId, (categoryId, name) in enumerate(categories)])
+        for bucket in buckets:
+            bucket.seek(0)
+            images = {}
+            boxes = collections.defaultdict(list)
+            for line in bucket:
+                record = line.rstrip('\n').split('\t')
+                if record[0] == 'a':
+                    boxes[readId(record[1])].append(record[2:])
+                else:
+                    images[readId(record[1])] = json.loads(record[2])
+            bucket.close()
+            for imageId in list(boxes.keys()):
+                if imageId not in images:
+                    stats.orphans = stats.orphans + len(boxes.pop(imageId))
+            for imageId in sorted(images, key=lambda imageId: (str(type(imageId)), imageId)):
+                rows = boxes.pop(imageId, [])
+                if len(rows) > 0:
+                    values = np.array([row[1:5] for row in rows], np.float64)
+                    classes = [classOf.get(categoryId, categoryId) for categoryId in [readId(row[0]) for row in rows]]
+                    xyxy = np.column_stack([values[:, 0], values[:, 1], values[:, 0] + values[:, 2], values[:, 1] + values[:, 3]])
+                else:
+                    classes, xyxy = [], None
+                stats.images = stats.images + 1
+                stats.annotations = stats.annotations + len(rows)
+                yield images[imageId], BoxSet(classes, xyxy)
+            images = None
+            boxes = None
+    finally:
+        for bucket in buckets:
+            bucket.close()
+
+def importCoco(path, outFormat, outDir, memoryMB=DEFAULT_MEMORY_MB):
+    # Writes a label file (outFormat yolo, kitti or voc) per COCO image to outDir, at the relative path of its
+    # file_name, and the class names to NAMES_FILE_NAME. Returns ImportStats
+    stats = ImportStats()
+    timeStart = time.time()
+    for image, boxes in iterCocoImages(path, memoryMB, stats):
+        fileName = image.get('file_name', str(image['id']))
+        relPath = os.path.normpath(fileName)
+        if os.path.isabs(relPath) or relPath.startswith('..'):
+            relPath = os.path.basename(relPath)
+        labelPath = os.path.join(outDir, os.path.splitext(relPath)[0] + labelExtension(outFormat))
+        try:
+            imageSize = (int(image['width']), int(image['height']))
+            WriteFileAtomic(labelPath, formatLabels(outFormat, boxes, imageSize, os.path.basename(fileName)))
+            stats.files = stats.files + 1
+        except Exception as e:
+            stats.errors.append((fileName, str(e)))
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    with open(os.path.join(outDir, NAMES_FILE_NAME), 'w') as f:
+        for name in stats.names:
+            f.write(name + '\n')
+    stats.seconds = time.time() - timeStart
+    return stats
+
+def main(argv):
+    parser = argparse.ArgumentParser(usage=CLI_USAGE)
+    subparsers = parser.add_subparsers(dest="command")
+    export = subparsers.add_parser("export")
+    export.add_argument("imageDir")
+    export.add_argument("--labels", dest="labelDir", default=None,
+                        help="label tree, same layout as the image tree (default: LabelData of each image folder, else next to the images)")
+    export.add_argument("--names", dest="namesPath", default=None, help="class names, one per line in class id order")
+    export.add_argument("--out", dest="outPath", default=None, help="COCO file (default: <image dir>/coco.json)")
+    export.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    export.add_argument("--no-recursive", dest="recursive", action="store_false")
+    ingest = subparsers.add_parser("import")
+    ingest.add_argument("cocoPath")
+    ingest.add_argument("--to", dest="outFormat", required=True, choices=['yolo', 'kitti', 'voc'])
+    ingest.add_argument("--out", dest="outDir", default=None, help="label directory (default: ConvertedLabelData next to the COCO file)")
+    ingest.add_argument("--memory-mb", dest="memoryMB", type=float, default=DEFAULT_MEMORY_MB,
+                        help="memory budget of the per image grouping")
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        if not os.path.isdir(args.imageDir):
+            sys.exit("Error: The specified directory doesn't exist! [" + args.imageDir + "]")
+        names = None
+        if args.namesPath is not None:
+            with open(args.namesPath) as f:
+                names = [line.strip() for line in f if line.strip() != '']
+        outPath = args.outPath if args.outPath is not None else os.path.join(args.imageDir, 'coco.json')
+        stats = exportCoco(args.imageDir, outPath, args.labelDir, names, args.workers, args.recursive)
+        for fileName, error in stats.errors:
+            print("Error: " + fileName + ": " + error)
+        print("Info: " + stats.report() + ", to [" + outPath + "]")
+        return 1 if len(stats.errors) > 0 else 0
+    if args.command == "import":
+        if not os.path.isfile(args.cocoPath):
+            sys.exit("Error: The specified file doesn't exist! [" + args.cocoPath + "]")
+        outDir = args.outDir if args.outDir is not None else os.path.join(os.path.dirname(os.path.abspath(args.cocoPath)), 'ConvertedLabelData')
+        stats = importCoco(args.cocoPath, args.outFormat, outDir, args.memoryMB)
+        for fileName, error in stats.errors:
+            print("Error: " + fileName + ": " + error)
+        print("Info: " + stats.report() + ", to [" + outDir + "]")
+        return 1 if len(stats.errors) > 0 else 0
+    parser.print_usage()
+    return 2
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,165 @@
+#-------------------------------------------------------------------------------
+# Euclid - image dimension index
+# Image width/height, read from the PNG/JPEG headers only (pixels are not decoded),
+# and kept in a persistent SQLite index keyed by path, mtime and file size.
+# Used to denormalise YOLO boxes in the labeller, by the label converter and by euclidaug.
+#
+# Once the index is warm, a rescan only stats the files, headers are read again
+# only for new or modified images.
+#-------------------------------------------------------------------------------
+import os
+import struct
+import sqlite3
+import threading
+from multiprocessing.pool import ThreadPool
+
+# Default index file name, created in the scanned directory
+INDEX_FILE_NAME = '.euclid_dims.db'
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# JPEG start of frame markers (SOF0..SOF15, except DHT, JPG and DAC)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - set([0xC4, 0xC8, 0xCC])
+
+def readPngSize(f):
+    # IHDR is always the first chunk
+    header = f.read(24)
+    if len(header) < 24 or header[12:16] != b'IHDR':
+        return None
+    return struct.unpack('>II', header[16:24])
+
+def readJpegSize(f):
+    # Walk the segments up to the first start of frame, skipping the segment payloads
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)
+        while byte == b'\xff':
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = ord(byte)
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            # standalone markers, without length
+            continue
+        lengthBytes = f.read(2)
+        if len(lengthBytes) < 2:
+            return None
+        length = struct.unpack('>H', lengthBytes)[0]
+        if marker in JPEG_SOF_MARKERS:
+            frame = f.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack('>HH', frame[1:5])
+            return width, height
+        f.seek(length - 2, 1)
+
+def readImageSize(path):
+    # Returns (width, height) from the file header, or None if it is not a readable PNG or JPEG.
+    # path can also be a seekable binary file object (an image in memory)
+    if not hasattr(path, 'read'):
+        with open(path, 'rb') as f:
+            return readImageSize(f)
+    f = path
+    signature = f.read(8)
+    if signature == PNG_SIGNATURE:
+        f.seek(0)
+        return readPngSize(f)
+    if signature[:2] == b'\xff\xd8':
+        return readJpegSize(f)
+    # Other formats, Image.open also reads the header only
+    try:
+        from PIL import Image
+        f.seek(0)
+        with Image.open(f) as img:
+            return img.size
+    except Exception:
+        return None
+
+class DimensionIndex():
+    # Persistent path -> (width, height) index. Entries are valid while the file mtime and size match.
+    # All entries are loaded in memory when opened, new entries are written by save().
+    def __init__(self, indexPath):
+        self.indexPath = indexPath
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.newEntries = {}
+        self.headerReads = 0
+        self.lookups = 0
+        db = sqlite3.connect(indexPath)
+        try:
+            db.execute('CREATE TABLE IF NOT EXISTS dims (path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, '
+                       'width INTEGER, height INTEGER)')
+            for path, mtime, size, width, height in db.execute('SELECT path, mtime, size, width, height FROM dims'):
+                self.entries[path] = (mtime, size, width, height)
+        finally:
+            db.close()
+
+    def get(self, path, stat=None):
+        # Returns (width, height) or None. stat can be passed in if already known (os.scandir entries)
+        path = os.path.abspath(path)
+        if stat is None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+        mtime = int(stat.st_mtime * 1e6)
+        with self.lock:
+            self.lookups = self.lookups + 1
+            entry = self.entries.get(path)
+        if entry is not None and entry[0] == mtime and entry[1] == stat.st_size:
+            return entry[2], entry[3]
+        try:
+            dims = readImageSize(path)
+        except (IOError, OSError):
+            dims = None
+        if dims is None:
+            return None
+        with self.lock:
+            self.headerReads = self.headerReads + 1
+            self.entries[path] = self.newEntries[path] = (mtime, stat.st_size, dims[0], dims[1])
+        return dims
+
+    def scan(self, paths, threads=16):
+        # Fills the index for all paths, header reads are done in parallel. Returns {path: (width, height)}
+        paths = list(paths)
+        if len(paths) == 0:
+            return {}
+        pool = ThreadPool(max(1, min(threads, len(paths))))
+        try:
+            dims = pool.map(self.get, paths, 64)
+        finally:
+            pool.close()
+            pool.join()
+        return dict([(path, d) for path, d in zip(paths, dims) if d is not None])
+
+    def scanDir(self, imageDir, extensions=('.jpg', '.jpeg', '.png'), threads=16):
+        # Single os.scandir pass over imageDir (not recursive), returns {path: (width, height)}
+        paths = []
+        for entry in os.scandir(imageDir):
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in extensions:
+                paths.append(entry.path)
+        return self.scan(paths, threads)
+
+    def save(self):
+        with self.lock:
+            newEntries = self.newEntries
+            self.newEntries = {}
+        if len(newEntries) == 0:
+            return
+        db = sqlite3.connect(self.indexPath)
+        try:
+            with db:
+                db.executemany('INSERT OR REPLACE INTO dims (path, mtime, size, width, height) VALUES (?, ?, ?, ?, ?)',
+                               [(path,) + entry for path, entry in newEntries.items()])
+        finally:
+            db.close()
+
+    def report(self):
+        return "[%d] images indexed, [%d] lookups, [%d] header reads" % (len(self.entries), self.lookups, self.headerReads)
+
+def openIndex(directory, indexPath=None):
+    # Index of the images of directory, stored in the directory unless indexPath is given
+    if indexPath is None:
+        indexPath = os.path.join(directory, INDEX_FILE_NAME)
+    return DimensionIndex(indexPath)
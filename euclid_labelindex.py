@@ -0,0 +1,405 @@
+#-------------------------------------------------------------------------------
+# Euclid - columnar label index
+# Compiles a label tree (YOLO, KITTI or Pascal VOC, parsed like the labeller does) into
+# fixed width NumPy columns, readable in place with numpy.memmap, for whole-dataset queries
+# like "images with class 5 boxes smaller than 20 pixels" without opening the label files.
+#
+# Index directory (default <image dir>/.euclid_labelindex):
+#   meta.json         counts, roots and format version
+#   paths.tsv         label path <tab> image path of each label row, relative to the image dir
+#   label_<c>.npy     per label file: mtime, size (change detection), width, height (-1 unknown),
+#                     first, count (its boxes, count -1 for a deleted label file)
+#   box_<c>.npy       per box: image (label row, -1 for a tombstone), class, x1, y1, x2, y2
+#                     (full resolution pixels, NaN for YOLO boxes of an image of unknown size)
+# Columns are allocated with spare capacity, the rows in use are given by meta.json.
+#
+# Updates only parse new and modified label files (mtime or size changed). Their old boxes are
+# tombstoned and the new ones appended, deleted label files are tombstoned, and the box columns
+# are compacted once more than half of the rows are tombstones.
+#
+# python euclid_labelindex.py build <image dir> [--labels dir] [--index dir] [--workers N]
+# python euclid_labelindex.py query <index dir> [--class C] [--min-side N] [--max-side N]
+#-------------------------------------------------------------------------------
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import collections
+import multiprocessing
+import numpy as np
+from numpy.lib.format import open_memmap
+from euclid_dimindex import readImageSize
+from euclid_validate import walkPairs, readLabels
+
+CLI_USAGE = "euclid_labelindex.py build <image dir> [--labels dir] [--index dir] [--workers N] [--compact]\n" \
+            "       euclid_labelindex.py query <index dir> [--class C] [--min-side N] [--max-side N] [--limit N]"
+
+LABEL_INDEX_DIR_NAME = '.euclid_labelindex'
+LABEL_INDEX_VERSION = 1
+
+LABEL_COLUMNS = [('mtime', np.int64), ('size', np.int64), ('width', np.int32), ('height', np.int32),
+                 ('first', np.int64), ('count', np.int32)]
+BOX_COLUMNS = [('image', np.int32), ('class', np.int32), ('x1', np.float32), ('y1', np.float32),
+               ('x2', np.float32), ('y2', np.float32)]
+
+# Label files parsed per job
+CHUNK_SIZE = 256
+# Fraction of tombstoned boxes that triggers a compaction
+COMPACT_RATIO = 0.5
+MIN_CAPACITY = 1024
+
+def columnPath(indexDir, prefix, name):
+    return os.path.join(indexDir, '%s_%s.npy' % (prefix, name))
+
+def parseChunk(jobs):
+    # jobs is [(labelId or None, labelPath, imagePath, mtime, size)].
+    # Returns [(labelId, labelPath, imagePath, mtime, size, width, height, classes, xyxy, error)]
+    results = []
+    for labelId, labelPath, imagePath, mtime, size in jobs:
+        imageSize = None
+        if imagePath is not None:
+            try:
+                imageSize = readImageSize(imagePath)
+            except (IOError, OSError):
+                imageSize = None
+        width, height = imageSize if imageSize is not None else (-1, -1)
+        try:
+            labelFormat, classes, xyxy, malformedRows = readLabels(labelPath, imageSize)
+            if xyxy is None:
+                xyxy = np.full((len(classes), 4), np.nan)
+            error = None
+        except Exception as e:
+            classes, xyxy, error = np.zeros(0, np.int64), np.zeros((0, 4)), str(e)
+        results.append((labelId, labelPath, imagePath, mtime, size, width, height, classes, xyxy, error))
+    return results
+
+class LabelIndex():
+    # Columns of an index directory, as memmaps of the rows in use. mode 'r' for queries, 'r+' for updates
+    def __init__(self, indexDir, mode='r'):
+        self.indexDir = indexDir
+        self.mode = mode
+        with open(os.path.join(indexDir, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.labels = {}
+        self.boxes = {}
+        self.mapColumns()
+        self.paths = None
+
+    def mapColumns(self):
+        numLabels = self.meta['numLabels']
+        numBoxes = self.meta['numBoxes']
+        for name, dtype in LABEL_COLUMNS:
+            self.labels[name] = np.load(columnPath(self.indexDir, 'label', name), mmap_mode=self.mode)[:numLabels]
+        for name, dtype in BOX_COLUMNS:
+            self.boxes[name] = np.load(columnPath(self.indexDir, 'box', name), mmap_mode=self.mode)[:numBoxes]
+
+    def loadPaths(self):
+        # [(label path, image path or None)], relative to the image dir
+        if self.paths is None:
+            self.paths = []
+            with open(os.path.join(self.indexDir, 'paths.tsv')) as f:
+                for line in itertools.islice(f, self.meta['numLabels']):
+                    labelPath, imagePath = line.rstrip('\n').split('\t')
+                    self.paths.append((labelPath, imagePath if imagePath != '' else None))
+        return self.paths
+
+    def liveBoxes(self):
+        return self.boxes['image'] >= 0
+
+    def query(self, classId=None, minSide=None, maxSide=None):
+        # Returns the box rows (indices into the box columns) matching all the given conditions.
+        # side is the larger of the box width and height, in pixels
+        mask = self.liveBoxes()
+        if classId is not None:
+            mask &= self.boxes['class'] == classId
+        if minSide is not None or maxSide is not None:
+            side = np.maximum(self.boxes['x2'] - self.boxes['x1'], self.boxes['y2'] - self.boxes['y1'])
+            if minSide is not None:
+                mask &= side >= minSide
+            if maxSide is not None:
+                mask &= side < maxSide
+        return np.flatnonzero(mask)
+
+    def report(self):
+        return "[%d] label files, [%d] boxes ([%d] rows, [%d] tombstones)" % (
+            int((self.labels['count'] >= 0).sum()), self.meta['numBoxes'] - self.meta['deadBoxes'],
+            self.meta['numBoxes'], self.meta['deadBoxes'])
+
+class UpdateStats():
+    def __init__(self):
+        self.unchanged = 0
+        self.added = 0
+        self.modified = 0
+        self.deleted = 0
+        self.boxes = 0
+        self.compacted = False
+        self.rebuilt = False
+        self.errors = []
+        self.seconds = 0.
+
+    def report(self):
+        return "Indexed [%d] new, [%d] modified, [%d] deleted, [%d] unchanged label files, [%d] boxes added in [%.2f] (s)%s%s, [%d] errors" % (
+            self.added, self.modified, self.deleted, self.unchanged, self.boxes, self.seconds,
+            ', rebuilt' if self.rebuilt else '', ', compacted' if self.compacted else '', len(self.errors))
+
+def writeMeta(indexDir, meta):
+    tmpPath = os.path.join(indexDir, 'meta.json.tmp')
+    with open(tmpPath, 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(tmpPath, os.path.join(indexDir, 'meta.json'))
+
+def createColumns(indexDir, prefix, columns, capacity, count=0, old=None):
+    # New column files of capacity rows, with the first count rows copied from old ({name: array}) if given
+    for name, dtype in columns:
+        path = columnPath(indexDir, prefix, name)
+        tmpPath = path + '.tmp.npy'
+        column = open_memmap(tmpPath, mode='w+', dtype=dtype, shape=(capacity,))
+        if old is not None and count > 0:
+            column[:count] = old[name][:count]
+        column.flush()
+        del column
+        os.replace(tmpPath, path)
+
+def newIndex(indexDir, imageDir, labelDir):
+    if not os.path.isdir(indexDir):
+        os.makedirs(indexDir)
+    createColumns(indexDir, 'label', LABEL_COLUMNS, MIN_CAPACITY)
+    createColumns(indexDir, 'box', BOX_COLUMNS, MIN_CAPACITY)
+    open(os.path.join(indexDir, 'paths.tsv'), 'w').close()
+    meta = {'version': LABEL_INDEX_VERSION, 'imageDir': os.path.abspath(imageDir),
+            'labelDir': os.path.abspath(labelDir) if labelDir is not None else None,
+            'numLabels': 0, 'numBoxes': 0, 'deadBoxes': 0, 'labelCapacity': MIN_CAPACITY, 'boxCapacity': MIN_CAPACITY,
+            'updating': False}
+    writeMeta(indexDir, meta)
+
+class IndexUpdater():
+    # Applies parsed label files to an index opened for update
+    def __init__(self, indexDir, stats):
+        self.indexDir = indexDir
+        self.stats = stats
+        self.index = LabelIndex(indexDir, 'r+')
+        self.meta = self.index.meta
+        self.pathsFile = open(os.path.join(indexDir, 'paths.tsv'), 'a')
+        self.imageDir = self.meta['imageDir']
+
+    def reserve(self, prefix, columns, needed):
+        # grows the columns (doubling) to hold needed rows
+        capacityKey = prefix + 'Capacity'
+        if needed <= self.meta[capacityKey]:
+            return
+        capacity = max(needed, 2 * self.meta[capacityKey])
+        current = self.index.labels if prefix == 'label' else self.index.boxes
+        count = self.meta['numLabels' if prefix == 'label' else 'numBoxes']
+        old = dict([(name, np.array(current[name][:count])) for name, dtype in columns])
+        self.index.labels = {}
+        self.index.boxes = {}
+        createColumns(self.indexDir, prefix, columns, capacity, count, old)
+        self.meta[capacityKey] = capacity
+        self.remap()
+
+    def remap(self):
+        # columns mapped up to the capacity, so that appends can be written in place
+        for name, dtype in LABEL_COLUMNS:
+            self.index.labels[name] = np.load(columnPath(self.indexDir, 'label', name), mmap_mode='r+')
+        for name, dtype in BOX_COLUMNS:
+            self.index.boxes[name] = np.load(columnPath(self.indexDir, 'box', name), mmap_mode='r+')
+
+    def tombstone(self, labelId):
+        labels = self.index.labels
+        first, count = int(labels['first'][labelId]), int(labels['count'][labelId])
+        if count > 0:
+            self.index.boxes['image'][first:first + count] = -1
+            self.meta['deadBoxes'] = self.meta['deadBoxes'] + count
+
+    def apply(self, results):
+        numNew = len([r for r in results if r[0] is None])
+        numBoxes = sum([len(r[7]) for r in results])
+        self.reserve('label', LABEL_COLUMNS, self.meta['numLabels'] + numNew)
+        self.reserve('box', BOX_COLUMNS, self.meta['numBoxes'] + numBoxes)
+        labels = self.index.labels
+        boxes = self.index.boxes
+        for labelId, labelPath, imagePath, mtime, size, width, height, classes, xyxy, error in results:
+            if error is not None:
+                self.stats.errors.append((labelPath, error))
+            if labelId is None:
+                labelId = self.meta['numLabels']
+                self.meta['numLabels'] = labelId + 1
+                self.pathsFile.write('%s\t%s\n' % (os.path.relpath(labelPath, self.imageDir),
+                                                   os.path.relpath(imagePath, self.imageDir) if imagePath is not None else ''))
+                self.stats.added = self.stats.added + 1
+            else:
+                self.tombstone(labelId)
+                self.stats.modified = self.stats.modified + 1
+            first = self.meta['numBoxes']
+            count = len(classes)
+            boxes['image'][first:first + count] = labelId
+            boxes['class'][first:first + count] = classes
+            for column, name in enumerate(['x1', 'y1', 'x2', 'y2']):
+                boxes[name][first:first + count] = xyxy[:, column]
+            self.meta['numBoxes'] = first + count
+            self.stats.boxes = self.stats.boxes + count
+            labels['mtime'][labelId] = mtime
+            labels['size'][labelId] = size
+            labels['width'][labelId] = width
+            labels['height'][labelId] = height
+            labels['first'][labelId] = first
+            labels['count'][labelId] = count
+
+    def delete(self, labelId):
+        self.tombstone(labelId)
+        self.index.labels['count'][labelId] = -1
+        self.index.labels['first'][labelId] = 0
+        self.stats.deleted = self.stats.deleted + 1
+
+    def compact(self):
+        # rewrites the box columns without the tombstones, the boxes of a label file stay contiguous
+        numBoxes = self.meta['numBoxes']
+        live = np.asarray(self.index.boxes['image'][:numBoxes]) >= 0
+        newPosition = np.cumsum(live) - live
+        kept = dict([(name, np.asarray(self.index.boxes[name][:numBoxes])[live]) for name, dtype in BOX_COLUMNS])
+        numLabels = self.meta['numLabels']
+        labels = self.index.labels
+        hasBoxes = np.asarray(labels['count'][:numLabels]) > 0
+        if numBoxes > 0:
+            labels['first'][:numLabels] = np.where(hasBoxes, newPosition[np.minimum(labels['first'][:numLabels], max(numBoxes - 1, 0))], 0)
+        self.index.boxes = {}
+        capacity = max(MIN_CAPACITY, 2 * len(kept['image']))
+        createColumns(self.indexDir, 'box', BOX_COLUMNS, capacity, len(kept['image']), kept)
+        self.meta['boxCapacity'] = capacity
+        self.meta['numBoxes'] = len(kept['image'])
+        self.meta['deadBoxes'] = 0
+        self.remap()
+        self.stats.compacted = True
+
+    def close(self):
+        for column in list(self.index.labels.values()) + list(self.index.boxes.values()):
+            column.flush()
+        self.pathsFile.close()
+        self.meta['updating'] = False
+        writeMeta(self.indexDir, self.meta)
+
+def updateIndex(imageDir, labelDir=None, indexDir=None, workers=1, compact=False, recursive=True):
+    # Builds the index of the tree, or updates it with the label files changed since. Returns UpdateStats
+    stats = UpdateStats()
+    timeStart = time.time()
+    if indexDir is None:
+        indexDir = os.path.join(imageDir, LABEL_INDEX_DIR_NAME)
+    metaPath = os.path.join(indexDir, 'meta.json')
+    meta = None
+    if os.path.exists(metaPath):
+        with open(metaPath) as f:
+            meta = json.load(f)
+    if (meta is None or meta['version'] != LABEL_INDEX_VERSION or meta['updating'] is True or
+            meta['imageDir'] != os.path.abspath(imageDir) or
+            meta['labelDir'] != (os.path.abspath(labelDir) if labelDir is not None else None)):
+        # new, of another tree, or an update was interrupted
+        stats.rebuilt = meta is not None
+        newIndex(indexDir, imageDir, labelDir)
+    updater = IndexUpdater(indexDir, stats)
+    # an interrupted update is detected on the next one, and the index rebuilt
+    updater.meta['updating'] = True
+    writeMeta(indexDir, updater.meta)
+    updater.remap()
+    # stored paths are relative to the image dir (../ for a label dir outside it), normalised to match the walk
+    labelIds = dict([(os.path.normpath(os.path.join(updater.imageDir, labelPath)), labelId)
+                     for labelId, (labelPath, imagePath) in enumerate(updater.index.loadPaths())])
+    seen = np.zeros(updater.meta['numLabels'], bool)
+    indexPrefix = os.path.abspath(indexDir) + os.sep
+    def jobs():
+        chunk = []
+        for labelPath, imagePath in walkPairs(imageDir, labelDir, recursive):
+            if labelPath is None or os.path.abspath(labelPath).startswith(indexPrefix):
+                continue
+            labelPath = os.path.abspath(labelPath)
+            try:
+                stat = os.stat(labelPath)
+            except OSError:
+                continue
+            labelId = labelIds.get(labelPath)
+            if labelId is not None:
+                seen[labelId] = True
+                labels = updater.index.labels
+                if labels['mtime'][labelId] == stat.st_mtime_ns and labels['size'][labelId] == stat.st_size and labels['count'][labelId] >= 0:
+                    stats.unchanged = stats.unchanged + 1
+                    continue
+            chunk.append((labelId, labelPath, os.path.abspath(imagePath) if imagePath is not None else None,
+                          stat.st_mtime_ns, stat.st_size))
+            if len(chunk) >= CHUNK_SIZE:
+                yield chunk
+                chunk = []
+        if len(chunk) > 0:
+            yield chunk
+    if workers <= 1:
+        for results in map(parseChunk, jobs()):
+            updater.apply(results)
+    else:
+        # bounded number of chunks in flight, results applied in walk order
+        pool = multiprocessing.Pool(workers)
+        try:
+            inFlight = collections.deque()
+            for chunk in jobs():
+                inFlight.append(pool.apply_async(parseChunk, (chunk,)))
+                if len(inFlight) >= 4 * workers:
+                    updater.apply(inFlight.popleft().get())
+            while len(inFlight) > 0:
+                updater.apply(inFlight.popleft().get())
+        finally:
+            pool.close()
+            pool.join()
+    counts = updater.index.labels['count']
+    for labelId in np.flatnonzero(~seen).tolist():
+        if counts[labelId] >= 0:
+            updater.delete(labelId)
+    if updater.meta['numBoxes'] > 0 and (compact or updater.meta['deadBoxes'] > COMPACT_RATIO * updater.meta['numBoxes']):
+        updater.compact()
+    updater.close()
+    stats.seconds = time.time() - timeStart
+    return stats
+
+def main(argv):
+    parser = argparse.ArgumentParser(usage=CLI_USAGE)
+    subparsers = parser.add_subparsers(dest="command")
+    build = subparsers.add_parser("build")
+    build.add_argument("imageDir")
+    build.add_argument("--labels", dest="labelDir", default=None,
+                       help="label tree, same layout as the image tree (default: LabelData of each image folder, else next to the images)")
+    build.add_argument("--index", dest="indexDir", default=None, help="index directory (default: <image dir>/" + LABEL_INDEX_DIR_NAME + ")")
+    build.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    build.add_argument("--compact", action="store_true", help="remove all tombstones")
+    build.add_argument("--no-recursive", dest="recursive", action="store_false")
+    query = subparsers.add_parser("query")
+    query.add_argument("indexDir")
+    query.add_argument("--class", dest="classId", type=int, default=None)
+    query.add_argument("--min-side", dest="minSide", type=float, default=None, help="larger box side at least N pixels")
+    query.add_argument("--max-side", dest="maxSide", type=float, default=None, help="larger box side below N pixels")
+    query.add_argument("--limit", type=int, default=0, help="images printed (default all)")
+    args = parser.parse_args(argv)
+    if args.command == "build":
+        if not os.path.isdir(args.imageDir):
+            sys.exit("Error: The specified directory doesn't exist! [" + args.imageDir + "]")
+        stats = updateIndex(args.imageDir, args.labelDir, args.indexDir, args.workers, args.compact, args.recursive)
+        for labelPath, error in stats.errors:
+            print("Error: " + labelPath + ": " + error)
+        print("Info: " + stats.report())
+        print("Info: Index " + LabelIndex(args.indexDir or os.path.join(args.imageDir, LABEL_INDEX_DIR_NAME)).report())
+        return 0
+    if args.command == "query":
+        if not os.path.exists(os.path.join(args.indexDir, 'meta.json')):
+            sys.exit("Error: No label index in [" + args.indexDir + "]")
+        index = LabelIndex(args.indexDir)
+        rows = index.query(args.classId, args.minSide, args.maxSide)
+        labelIds, counts = np.unique(index.boxes['image'][rows], return_counts=True)
+        paths = index.loadPaths()
+        shown = labelIds if args.limit <= 0 else labelIds[:args.limit]
+        for labelId, count in zip(shown.tolist(), counts.tolist()):
+            labelPath, imagePath = paths[labelId]
+            print("%s\t%d" % (imagePath if imagePath is not None else labelPath, count))
+        print("Info: [%d] boxes in [%d] images" % (len(rows), len(labelIds)))
+        return 0
+    parser.print_usage()
+    return 2
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
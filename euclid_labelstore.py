@@ -0,0 +1,191 @@
+#-------------------------------------------------------------------------------
+# Euclid - label store
+# Optional SQLite store of the labeller boxes, instead of one text file per image.
+# Saves are queued, and written in batches (one transaction) by a background thread,
+# repeated saves of the same image before a write are coalesced.
+# The KITTI/YOLO label files and the training list are written on demand by export().
+#
+# Tables:
+#   images (path, width, height, format) - one row per image of the folder, format is NULL until saved
+#   boxes  (path, idx, class, x1, y1, x2, y2) - full resolution pixel coordinates
+#-------------------------------------------------------------------------------
+import os
+import sqlite3
+import threading
+from euclid_boxes import formatLabels, boxSetFromRows, labelExtension
+
+# Default store file name, created in the label folder
+LABEL_STORE_FILE_NAME = 'euclid_labels.db'
+
+class LabelStore():
+    # Boxes of each image, keyed by the image path. save() only queues, reads see queued saves
+    def __init__(self, dbPath, batchSize=64, flushSeconds=1.0):
+        self.dbPath = dbPath
+        self.batchSize = batchSize
+        self.flushSeconds = flushSeconds
+        self.condition = threading.Condition()
+        self.pending = {}          # path -> (width, height, format, BoxSet), not written yet
+        self.pendingImages = []    # images known to the labeller, listed even without a save
+        self.writing = {}          # batch being written
+        self.closing = False
+        self.error = None
+        self.writes = 0
+        self.commits = 0
+        db = sqlite3.connect(dbPath)
+        try:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('CREATE TABLE IF NOT EXISTS images (path TEXT PRIMARY KEY, width INTEGER, height INTEGER, format TEXT)')
+            db.execute('CREATE TABLE IF NOT EXISTS boxes (path TEXT, idx INTEGER, class INTEGER, '
+                       'x1 REAL, y1 REAL, x2 REAL, y2 REAL, PRIMARY KEY (path, idx))')
+            db.execute('CREATE INDEX IF NOT EXISTS boxes_class ON boxes (class)')
+            db.commit()
+        finally:
+            db.close()
+        # connection of the calling (Tk) thread, for the reads
+        self.db = sqlite3.connect(dbPath)
+        self.writer = threading.Thread(target=self.run)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def save(self, path, imageSize, labelFormat, boxes):
+        # boxes is a BoxSet, in full resolution pixels
+        with self.condition:
+            if self.error is not None:
+                raise self.error
+            self.pending[os.path.abspath(path)] = (imageSize[0], imageSize[1], labelFormat, boxes.copy())
+            if len(self.pending) >= self.batchSize:
+                self.condition.notify()
+
+    def run(self):
+        db = sqlite3.connect(self.dbPath)
+        try:
+            while True:
+                with self.condition:
+                    if len(self.pending) < self.batchSize and not self.closing:
+                        self.condition.wait(self.flushSeconds)
+                    if len(self.pending) == 0 and len(self.pendingImages) == 0:
+                        if self.closing:
+                            return
+                        continue
+                    self.writing = self.pending
+                    self.pending = {}
+                    images = self.pendingImages
+                    self.pendingImages = []
+                self.writeBatch(db, self.writing, images)
+                with self.condition:
+                    self.writes = self.writes + len(self.writing)
+                    self.commits = self.commits + 1
+                    self.writing = {}
+                    self.condition.notify_all()
+        except sqlite3.Error as e:
+            with self.condition:
+                self.error = e
+                self.condition.notify_all()
+        finally:
+            db.close()
+
+    def addImages(self, paths):
+        # registers images (with no boxes unless saved), so that imagesWithoutBoxes() covers the whole folder
+        with self.condition:
+            self.pendingImages.extend([os.path.abspath(path) for path in paths])
+            self.condition.notify()
+
+    def writeBatch(self, db, batch, images):
+        with db:
+            db.executemany('INSERT OR IGNORE INTO images (path) VALUES (?)', [(path,) for path in images])
+            paths = [(path,) for path in batch]
+            db.executemany('DELETE FROM boxes WHERE path = ?', paths)
+            db.executemany('INSERT OR REPLACE INTO images (path, width, height, format) VALUES (?, ?, ?, ?)',
+                           [(path,) + record[:3] for path, record in batch.items()])
+            db.executemany('INSERT INTO boxes (path, idx, class, x1, y1, x2, y2) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           [(path, idx) + row
+                            for path, record in batch.items() for idx, row in enumerate(record[3].rows())])
+
+    def flush(self):
+        # waits until all queued saves are committed
+        with self.condition:
+            self.condition.notify()
+            while (len(self.pending) > 0 or len(self.pendingImages) > 0 or len(self.writing) > 0) and self.error is None and self.writer.is_alive():
+                self.condition.wait(0.1)
+                self.condition.notify()
+            if self.error is not None:
+                raise self.error
+
+    def load(self, path):
+        # (width, height, format, BoxSet) of an image, or None if it was never saved in the store
+        path = os.path.abspath(path)
+        with self.condition:
+            record = self.pending.get(path) or self.writing.get(path)
+        if record is not None:
+            return record
+        row = self.db.execute('SELECT width, height, format FROM images WHERE path = ?', (path,)).fetchone()
+        if row is None or row[2] is None:
+            return None
+        boxes = self.db.execute('SELECT class, x1, y1, x2, y2 FROM boxes WHERE path = ? ORDER BY idx', (path,)).fetchall()
+        return row[0], row[1], row[2], boxSetFromRows(boxes)
+
+    def imagesWithoutBoxes(self):
+        self.flush()
+        return [row[0] for row in self.db.execute(
+            'SELECT path FROM images WHERE NOT EXISTS (SELECT 1 FROM boxes WHERE boxes.path = images.path) ORDER BY path')]
+
+    def countPerClass(self):
+        self.flush()
+        return dict(self.db.execute('SELECT class, COUNT(*) FROM boxes GROUP BY class ORDER BY class'))
+
+    def imageCount(self):
+        self.flush()
+        return self.db.execute('SELECT COUNT(*) FROM images').fetchone()[0]
+
+    def export(self, outDir, trainFileName=None):
+        # Writes the label file of every image in the store (in its saved format) to outDir.
+        # YOLO images are merged into trainFileName, without duplicates. Returns the number of label files
+        self.flush()
+        count = 0
+        trainPaths = []
+        rows = self.db.execute('SELECT path, width, height, format FROM images ORDER BY path').fetchall()
+        for path, width, height, labelFormat in rows:
+            boxes = self.db.execute('SELECT class, x1, y1, x2, y2 FROM boxes WHERE path = ? ORDER BY idx', (path,)).fetchall()
+            if labelFormat is None or len(boxes) == 0:
+                continue
+            name = os.path.splitext(os.path.basename(path))[0] + labelExtension(labelFormat)
+            with open(os.path.join(outDir, name), 'w') as f:
+                f.write(formatLabels(labelFormat, boxSetFromRows(boxes), (width, height), os.path.basename(path)))
+            count = count + 1
+            if labelFormat == 'YOLO':
+                trainPaths.append(path)
+        if trainFileName is not None:
+            writeTrainList(trainFileName, trainPaths)
+        return count
+
+    def report(self):
+        return "[%d] saves written in [%d] commits, [%d] queued" % (self.writes, self.commits, len(self.pending))
+
+    def close(self):
+        with self.condition:
+            self.closing = True
+            self.condition.notify()
+        self.writer.join()
+        self.db.close()
+        if self.error is not None:
+            raise self.error
+
+def readTrainList(trainFileName):
+    if not os.path.exists(trainFileName):
+        return []
+    with open(trainFileName) as f:
+        return [line.rstrip('\n') for line in f if line.strip() != '']
+
+def writeTrainList(trainFileName, paths):
+    # Merges paths into the training list file, keeping the existing order and dropping duplicates
+    entries = readTrainList(trainFileName)
+    seen = set(entries)
+    for path in paths:
+        if path not in seen:
+            seen.add(path)
+            entries.append(path)
+    tmpName = trainFileName + '.tmp'
+    with open(tmpName, 'w') as f:
+        for path in entries:
+            f.write(path + '\n')
+    os.replace(tmpName, trainFileName)
@@ -0,0 +1,117 @@
+#-------------------------------------------------------------------------------
+# Euclid - image prefetch
+# Decodes upcoming images (and reads their label files) on worker threads, into a
+# bounded LRU cache. The labeller then only has to hand the decoded image to Tk.
+#-------------------------------------------------------------------------------
+import os
+import time
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+def readLabelText(labelPath):
+    if labelPath is None or not os.path.exists(labelPath):
+        return None
+    with open(labelPath) as f:
+        return f.read()
+
+def decodeImage(imagePath):
+    img = Image.open(imagePath)
+    # decode now (on the worker thread), not on first use
+    img.load()
+    return img
+
+class PrefetchCache():
+    # path -> (decoded image, label file text or None). labelPathFor(imagePath) gives the label file of an image.
+    # get() returns a cached entry, waits for one being prefetched, or decodes on the calling thread (a miss)
+    def __init__(self, labelPathFor, capacity=16, threads=2, decoder=decodeImage):
+        self.labelPathFor = labelPathFor
+        self.capacity = capacity
+        self.decoder = decoder
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.hits = 0
+        self.waits = 0
+        self.misses = 0
+        self.decodeCount = 0
+        self.decodeSeconds = 0.
+        self.lastGetSeconds = 0.
+
+    def load(self, imagePath):
+        timeStart = time.time()
+        img = self.decoder(imagePath)
+        labelText = readLabelText(self.labelPathFor(imagePath))
+        with self.lock:
+            self.decodeCount = self.decodeCount + 1
+            self.decodeSeconds = self.decodeSeconds + time.time() - timeStart
+        return img, labelText
+
+    def prefetchOne(self, imagePath):
+        try:
+            entry = self.load(imagePath)
+        except Exception:
+            entry = None
+        with self.lock:
+            self.pending.pop(imagePath, None)
+            if entry is not None:
+                self.store(imagePath, entry)
+        return entry
+
+    def store(self, imagePath, entry):
+        # called with the lock held
+        self.entries[imagePath] = entry
+        self.entries.move_to_end(imagePath)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def prefetch(self, imagePaths):
+        # schedule the decode of imagePaths (in priority order), unless cached or already scheduled
+        with self.lock:
+            for imagePath in imagePaths:
+                if imagePath in self.entries:
+                    # keep neighbours of the current image from being evicted
+                    self.entries.move_to_end(imagePath)
+                elif imagePath not in self.pending:
+                    self.pending[imagePath] = self.executor.submit(self.prefetchOne, imagePath)
+
+    def get(self, imagePath):
+        timeStart = time.time()
+        with self.lock:
+            entry = self.entries.get(imagePath)
+            future = self.pending.get(imagePath)
+            if entry is not None:
+                self.entries.move_to_end(imagePath)
+                self.hits = self.hits + 1
+        if entry is None and future is not None:
+            entry = future.result()
+            if entry is not None:
+                with self.lock:
+                    self.waits = self.waits + 1
+        if entry is None:
+            entry = self.load(imagePath)
+            with self.lock:
+                self.misses = self.misses + 1
+                self.store(imagePath, entry)
+        self.lastGetSeconds = time.time() - timeStart
+        return entry
+
+    def invalidate(self, imagePath):
+        # drop a cached entry, for example after its label file was written
+        with self.lock:
+            self.entries.pop(imagePath, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def report(self):
+        requests = max(1, self.hits + self.waits + self.misses)
+        return "cache hit %d%%, wait %d%%, load %d ms, decode avg %d ms" % (
+            100 * self.hits / requests, 100 * self.waits / requests, 1000 * self.lastGetSeconds,
+            1000 * self.decodeSeconds / max(1, self.decodeCount))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
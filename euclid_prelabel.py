@@ -0,0 +1,306 @@
+#-------------------------------------------------------------------------------
+# Euclid - pre-labelling
+# Box proposals for the labeller, from a CPU detector run on batches of the upcoming
+# images in a background process pool. Proposals are cached per image (JSON lines in
+# the label folder, keyed by the image mtime and size and the model), and shown by the
+# labeller as suggested boxes, to be accepted or deleted.
+#
+# Detectors (the model spec):
+#   <file>.onnx          YOLO style ONNX model, run with onnxruntime (pip install onnxruntime).
+#                        Outputs (N, 5 + classes) with objectness (YOLOv5) or (4 + classes, N) (YOLOv8)
+#   <module>:<function>  Python callable, function(images) -> [(classes, xyxy, scores)] for a list
+#                        of PIL RGB images, boxes in the pixels of the images given
+# Images may be given to the detector at a reduced size (JPEG draft decode), boxes are scaled
+# back to full resolution pixels.
+#-------------------------------------------------------------------------------
+import os
+import json
+import time
+import importlib
+import threading
+import multiprocessing
+import numpy as np
+from PIL import Image
+from euclid_boxes import BoxSet
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+PROPOSAL_CACHE_FILE_NAME = 'euclid_proposals.jsonl'
+# Proposals below this score are dropped, and overlapping ones (same class) suppressed above this IoU
+PRELABEL_SCORE = 0.25
+PRELABEL_IOU = 0.45
+PRELABEL_MAX_BOXES = 100
+# Images per detector call, and batches queued per worker
+PRELABEL_BATCH_SIZE = 4
+PRELABEL_BATCHES_PER_WORKER = 2
+# Images are decoded at no less than this size, for the detector input
+PRELABEL_DECODE_SIZE = (640, 640)
+
+def nms(xyxy, scores, classes, iouThreshold, maxBoxes):
+    # Greedy non maximum suppression, per class (boxes of different classes are offset apart). Returns kept indices
+    if len(scores) == 0:
+        return np.zeros(0, np.int64)
+    offset = classes.astype(np.float64)[:, None] * (float(np.abs(xyxy).max()) + 1)
+    boxes = xyxy + offset
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = np.argsort(-scores)
+    keep = []
+    while len(order) > 0 and len(keep) < maxBoxes:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.clip(np.minimum(boxes[i, 2], boxes[rest, 2]) - np.maximum(boxes[i, 0], boxes[rest, 0]), 0, None)
+        h = np.clip(np.minimum(boxes[i, 3], boxes[rest, 3]) - np.maximum(boxes[i, 1], boxes[rest, 1]), 0, None)
+        inter = w * h
+        iou = inter / np.maximum(areas[i] + areas[rest] - inter, 1e-9)
+        order = rest[iou <= iouThreshold]
+    return np.array(keep, np.int64)
+
+def letterbox(img, size):
+    # Scales img to fit size (width, height), centered on grey padding. Returns (CHW float32 tensor, scale, dx, dy)
+    scale = min(size[0] / float(img.size[0]), size[1] / float(img.size[1]))
+    newSize = (max(1, int(round(img.size[0] * scale))), max(1, int(round(img.size[1] * scale))))
+    dx, dy = (size[0] - newSize[0]) // 2, (size[1] - newSize[1]) // 2
+    canvas = np.full((size[1], size[0], 3), 114, np.uint8)
+    canvas[dy:dy + newSize[1], dx:dx + newSize[0]] = np.asarray(img.resize(newSize, Image.BILINEAR))
+    return canvas.transpose(2, 0, 1).astype(np.float32) / 255., scale, dx, dy
+
+class OnnxDetector():
+    # YOLO style ONNX detector on the CPU
+    def __init__(self, modelPath, scoreThreshold=PRELABEL_SCORE, iouThreshold=PRELABEL_IOU, threads=1):
+        if onnxruntime is None:
+            raise ImportError('onnxruntime is needed for ONNX models (pip install onnxruntime)')
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(modelPath, options, providers=['CPUExecutionProvider'])
+        modelInput = self.session.get_inputs()[0]
+        self.inputName = modelInput.name
+        shape = modelInput.shape
+        # dynamic dimensions are names (or None)
+        self.batched = not isinstance(shape[0], int)
+        self.inputSize = (shape[3], shape[2]) if isinstance(shape[2], int) and isinstance(shape[3], int) else PRELABEL_DECODE_SIZE
+        self.scoreThreshold = scoreThreshold
+        self.iouThreshold = iouThreshold
+
+    def decode(self, pred):
+        # (N, 5 + classes) with objectness, or (4 + classes, N) without. Returns (classes, xyxy, scores) in input pixels
+        pred = np.asarray(pred, np.float32)
+        if pred.shape[0] < pred.shape[1]:
+            pred = pred.T
+            classScores = pred[:, 4:]
+        else:
+            classScores = pred[:, 5:] * pred[:, 4:5]
+        classes = classScores.argmax(axis=1)
+        scores = classScores[np.arange(len(classes)), classes]
+        keep = scores >= self.scoreThreshold
+        pred, classes, scores = pred[keep], classes[keep], scores[keep]
+        xyxy = np.column_stack([pred[:, 0] - pred[:, 2] / 2, pred[:, 1] - pred[:, 3] / 2,
+                                pred[:, 0] + pred[:, 2] / 2, pred[:, 1] + pred[:, 3] / 2]).astype(np.float64)
+        kept = nms(xyxy, scores, classes, self.iouThreshold, PRELABEL_MAX_BOXES)
+        return classes[kept], xyxy[kept].reshape(-1, 4), scores[kept]
+
+    def __call__(self, images):
+        inputs = [letterbox(img, self.inputSize) for img in images]
+        if self.batched:
+            outputs = self.session.run(None, {self.inputName: np.stack([tensor for tensor, scale, dx, dy in inputs])})[0]
+        else:
+            outputs = [self.session.run(None, {self.inputName: tensor[None]})[0][0] for tensor, scale, dx, dy in inputs]
+        results = []
+        for img, (tensor, scale, dx, dy), pred in zip(images, inputs, outputs):
+            classes, xyxy, scores = self.decode(pred)
+            # letterbox -> image pixels
+            xyxy = (xyxy - [dx, dy, dx, dy]) / scale
+            xyxy = np.clip(xyxy, 0, [img.size[0], img.size[1], img.size[0], img.size[1]])
+            # boxes on the padding are empty once clipped
+            inside = (xyxy[:, 2] > xyxy[:, 0]) & (xyxy[:, 3] > xyxy[:, 1])
+            results.append((classes[inside], xyxy[inside], scores[inside]))
+        return results
+
+def loadDetector(spec):
+    # Detector callable of a model spec, see the top of this file
+    if spec.lower().endswith('.onnx'):
+        return OnnxDetector(spec)
+    moduleName, sep, functionName = spec.rpartition(':')
+    if sep == '' or moduleName == '':
+        raise ValueError('model spec is <file>.onnx or <module>:<function>, got ' + spec)
+    return getattr(importlib.import_module(moduleName), functionName)
+
+# Detector of a pool worker, loaded once by initWorker. A failed load is reported for every image
+# (an initializer exception would make the pool restart the worker forever)
+workerDetector = {}
+
+def initWorker(spec):
+    try:
+        workerDetector['detector'] = loadDetector(spec)
+    except Exception as e:
+        workerDetector['error'] = 'cannot load %s: %s' % (spec, e)
+
+def proposeBatch(paths):
+    # Runs the worker detector on the images. Returns [(path, mtime, size, classes, xyxy, scores, error)]
+    if 'error' in workerDetector:
+        return [(path, 0, 0, None, None, None, workerDetector['error']) for path in paths]
+    images = []
+    results = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            img = Image.open(path)
+            fullSize = img.size
+            # JPEGs are decoded at a reduced size, no smaller than the detector input
+            img.draft('RGB', PRELABEL_DECODE_SIZE)
+            images.append((path, stat, fullSize, img.convert('RGB')))
+        except Exception as e:
+            results.append((path, 0, 0, None, None, None, str(e)))
+    if len(images) == 0:
+        return results
+    try:
+        detections = workerDetector['detector']([img for path, stat, fullSize, img in images])
+    except Exception as e:
+        return results + [(path, stat.st_mtime_ns, stat.st_size, None, None, None, str(e)) for path, stat, fullSize, img in images]
+    for (path, stat, fullSize, img), (classes, xyxy, scores) in zip(images, detections):
+        ratio = np.array([fullSize[0] / float(img.size[0]), fullSize[1] / float(img.size[1])] * 2)
+        xyxy = np.asarray(xyxy, np.float64).reshape(-1, 4) * ratio
+        results.append((path, stat.st_mtime_ns, stat.st_size, np.asarray(classes, np.int64).tolist(),
+                        np.rint(xyxy).tolist(), np.asarray(scores, np.float64).round(4).tolist(), None))
+    return results
+
+class ProposalCache():
+    # path -> proposals of the image, valid while its mtime and size match. Persisted as JSON lines, one per result,
+    # the last line of a path wins. Thread safe
+    def __init__(self, fileName, model):
+        self.fileName = fileName
+        self.model = model
+        self.lock = threading.Lock()
+        self.entries = {}
+        if fileName is not None and os.path.exists(fileName):
+            with open(fileName) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get('model') == model:
+                        self.entries[record['path']] = record
+        self.file = open(fileName, 'a') if fileName is not None else None
+
+    def get(self, path):
+        # (BoxSet, scores) or None if there are no valid proposals for the image
+        with self.lock:
+            record = self.entries.get(path)
+        if record is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if record['mtime'] != stat.st_mtime_ns or record['size'] != stat.st_size:
+            return None
+        return BoxSet(record['classes'], record['xyxy'] if len(record['classes']) > 0 else None), record['scores']
+
+    def __contains__(self, path):
+        return self.get(path) is not None
+
+    def put(self, path, mtime, size, classes, xyxy, scores):
+        record = {'path': path, 'mtime': mtime, 'size': size, 'model': self.model,
+                  'classes': classes, 'xyxy': xyxy, 'scores': scores}
+        with self.lock:
+            self.entries[path] = record
+            if self.file is not None:
+                self.file.write(json.dumps(record) + '\n')
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+class Prelabeler():
+    # request(paths) queues images for proposals (skipping cached and pending ones), get(path) returns the cached
+    # proposals. The detector runs in a pool of worker processes, results are stored from the pool result thread
+    def __init__(self, spec, workers=1, batchSize=PRELABEL_BATCH_SIZE):
+        self.spec = spec
+        self.batchSize = batchSize
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.queued = []
+        self.inFlight = 0
+        self.cache = ProposalCache(None, spec)
+        self.errors = 0
+        self.lastError = ''
+        self.batches = 0
+        self.images = 0
+        self.seconds = 0.
+        # spawn, the labeller process has Tk and threads
+        self.pool = multiprocessing.get_context('spawn').Pool(workers, initWorker, (spec,))
+
+    def setCache(self, cache):
+        # proposals of another image folder
+        with self.lock:
+            self.queued = []
+        self.cache.close()
+        self.cache = cache
+
+    def get(self, path):
+        return self.cache.get(path)
+
+    def isPending(self, path):
+        with self.lock:
+            return path in self.pending
+
+    def request(self, paths):
+        # paths in priority order, replaces the requests not yet sent to the workers
+        with self.lock:
+            self.queued = [path for path in paths if path not in self.pending and path not in self.cache]
+        self.submit()
+
+    def submit(self):
+        # keeps at most PRELABEL_BATCHES_PER_WORKER batches per worker in flight, the rest wait in queued
+        with self.lock:
+            while len(self.queued) > 0 and self.inFlight < self.workers * PRELABEL_BATCHES_PER_WORKER:
+                batch = self.queued[:self.batchSize]
+                self.queued = self.queued[self.batchSize:]
+                self.pending.update(batch)
+                self.inFlight = self.inFlight + 1
+                self.pool.apply_async(proposeBatch, (batch,), callback=self.batchDone(time.time(), self.cache),
+                                      error_callback=self.batchFailed(batch))
+
+    def batchDone(self, timeStart, cache):
+        def done(results):
+            for path, mtime, size, classes, xyxy, scores, error in results:
+                if error is None:
+                    cache.put(path, mtime, size, classes, xyxy, scores)
+                else:
+                    self.errors = self.errors + 1
+                    self.lastError = os.path.basename(path) + ': ' + error
+            with self.lock:
+                self.pending.difference_update([result[0] for result in results])
+                self.inFlight = self.inFlight - 1
+                self.batches = self.batches + 1
+                self.images = self.images + len(results)
+                self.seconds = self.seconds + time.time() - timeStart
+            self.submit()
+        return done
+
+    def batchFailed(self, batch):
+        def failed(error):
+            self.errors = self.errors + len(batch)
+            self.lastError = str(error)
+            with self.lock:
+                self.pending.difference_update(batch)
+                self.inFlight = self.inFlight - 1
+            self.submit()
+        return failed
+
+    def report(self):
+        return "proposals [%d] images in [%d] batches, [%.0f] ms/image, [%d] pending, [%d] errors%s" % (
+            self.images, self.batches, 1000. * self.seconds / max(1, self.images), len(self.pending), self.errors,
+            (' (' + self.lastError + ')') if self.errors > 0 else '')
+
+    def shutdown(self):
+        self.pool.terminate()
+        self.pool.join()
+        self.cache.close()
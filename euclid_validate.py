@@ -0,0 +1,345 @@
+#-------------------------------------------------------------------------------
+# Euclid - dataset validation
+# Headless scanner of an image tree and its labels (YOLO, KITTI or Pascal VOC), reporting
+# per-class box counts, box size histograms, and the errors found:
+#   missing_label    image without a label file
+#   missing_image    label file without an image
+#   bad_image        image size cannot be read from its header
+#   bad_label        label file cannot be read or parsed
+#   malformed_rows   rows of a .txt label that are neither YOLO (5 columns) nor KITTI (more than 5 columns),
+#                    or rows of the other format than the one of the file
+#   out_of_bounds    boxes outside the image
+#   zero_area        boxes with x2 <= x1 or y2 <= y1
+#   unknown_class    class ids outside 0 .. numClasses - 1 (negative ids only, without numClasses)
+#
+# Labels are parsed with the same rules as the labeller and the converter (euclid_boxes).
+# The tree is walked one directory at a time, files are validated in chunks on a process pool
+# with a bounded number of chunks in flight, and errors are spooled to a temporary file until
+# the JSON is written - memory does not grow with the number of files.
+#
+# python euclid_validate.py <image dir> [--labels dir] [--num-classes N] [--json file] [--workers N]
+#-------------------------------------------------------------------------------
+import os
+import sys
+import json
+import time
+import tempfile
+import argparse
+import itertools
+import collections
+import multiprocessing
+import numpy as np
+from euclid_dimindex import readImageSize
+from euclid_boxes import detectFormat, parseLabelText, splitRows
+from euclid_yolo_kitti_converter import ReadLabelFile
+
+CLI_USAGE = "euclid_validate.py <image dir> [--labels dir] [--num-classes N] [--json file] [--workers N] [--no-recursive]"
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG']
+LABEL_EXTENSIONS = ['.txt', '.xml']
+# Label folders of the labeller and the converter, not scanned for images
+LABEL_DIR_NAMES = ['LabelData', 'ConvertedLabelData']
+
+# Files per job, and jobs queued per worker
+CHUNK_SIZE = 256
+CHUNKS_PER_WORKER = 4
+
+# Box width, height and size (square root of the area) histogram bins, in pixels: [0, 2), [2, 4), [4, 8) .. [8192, inf)
+SIZE_BIN_EDGES = np.array([0] + [2 ** n for n in range(1, 14)], np.float64)
+SIZE_BIN_NAMES = ['%d-%d' % (lo, hi) for lo, hi in zip(SIZE_BIN_EDGES[:-1], SIZE_BIN_EDGES[1:])] + ['%d+' % SIZE_BIN_EDGES[-1]]
+
+def sizeBins(values):
+    # bin index of each (non negative) value
+    return np.searchsorted(SIZE_BIN_EDGES, values, side='right') - 1
+
+class ValidateStats():
+    # Counts of one chunk of files (in the workers), or of the whole tree (merged)
+    def __init__(self):
+        self.images = 0
+        self.labels = 0
+        self.boxes = 0
+        self.emptyLabels = 0
+        self.formats = collections.Counter()
+        self.classBoxes = collections.Counter()
+        self.classFiles = collections.Counter()
+        self.classSizes = {}
+        self.widths = np.zeros(len(SIZE_BIN_EDGES), np.int64)
+        self.heights = np.zeros(len(SIZE_BIN_EDGES), np.int64)
+        self.errorCounts = collections.Counter()
+        self.errors = []           # (path, error, detail), of the chunk only
+        self.seconds = 0.
+        # classes and pixel boxes of the chunk, histograms are computed once per chunk by flush()
+        self.chunkClasses = []
+        self.chunkBoxes = []
+
+    def addError(self, path, error, detail=''):
+        self.errorCounts[error] += 1
+        self.errors.append((path, error, detail))
+
+    def addBoxes(self, classes, xyxy):
+        # classes and pixel boxes of one label file, xyxy None if the image size is not known
+        self.boxes = self.boxes + len(classes)
+        for classId in set(classes.tolist()):
+            self.classFiles[classId] += 1
+        if xyxy is None:
+            self.classBoxes.update(classes.tolist())
+            return
+        self.chunkClasses.append(classes)
+        self.chunkBoxes.append(xyxy)
+
+    def flush(self):
+        # class counts and size histograms of the boxes added since the last flush
+        if len(self.chunkClasses) == 0:
+            return
+        classes = np.concatenate(self.chunkClasses)
+        xyxy = np.concatenate(self.chunkBoxes)
+        self.chunkClasses = []
+        self.chunkBoxes = []
+        numBins = len(SIZE_BIN_EDGES)
+        widths = np.maximum(xyxy[:, 2] - xyxy[:, 0], 0)
+        heights = np.maximum(xyxy[:, 3] - xyxy[:, 1], 0)
+        self.widths += np.bincount(sizeBins(widths), minlength=numBins)
+        self.heights += np.bincount(sizeBins(heights), minlength=numBins)
+        ids, inverse = np.unique(classes, return_inverse=True)
+        perClass = np.bincount(inverse.reshape(-1) * numBins + sizeBins(np.sqrt(widths * heights)),
+                               minlength=len(ids) * numBins).reshape(len(ids), numBins)
+        for classId, histogram in zip(ids.tolist(), perClass):
+            self.classBoxes[classId] += int(histogram.sum())
+            if classId in self.classSizes:
+                self.classSizes[classId] += histogram
+            else:
+                self.classSizes[classId] = histogram
+
+    def merge(self, other):
+        # Adds the counts of other. Its errors are not kept, they are spooled by the caller
+        self.images = self.images + other.images
+        self.labels = self.labels + other.labels
+        self.boxes = self.boxes + other.boxes
+        self.emptyLabels = self.emptyLabels + other.emptyLabels
+        self.formats.update(other.formats)
+        self.classBoxes.update(other.classBoxes)
+        self.classFiles.update(other.classFiles)
+        for classId, histogram in other.classSizes.items():
+            if classId in self.classSizes:
+                self.classSizes[classId] += histogram
+            else:
+                self.classSizes[classId] = histogram.copy()
+        self.widths += other.widths
+        self.heights += other.heights
+        self.errorCounts.update(other.errorCounts)
+
+    def summary(self):
+        # JSON-able dict, without the errors
+        classes = {}
+        for classId in sorted(self.classBoxes):
+            histogram = self.classSizes.get(classId, np.zeros(len(SIZE_BIN_EDGES), np.int64))
+            classes[str(classId)] = {'boxes': self.classBoxes[classId], 'files': self.classFiles[classId],
+                                     'sizeHistogram': histogram.tolist()}
+        return collections.OrderedDict([
+            ('images', self.images), ('labels', self.labels), ('boxes', self.boxes),
+            ('emptyLabels', self.emptyLabels), ('seconds', round(self.seconds, 3)),
+            ('formats', dict(self.formats)), ('sizeBins', SIZE_BIN_NAMES),
+            ('widthHistogram', self.widths.tolist()), ('heightHistogram', self.heights.tolist()),
+            ('classes', classes), ('errorCounts', dict(self.errorCounts))])
+
+    def report(self):
+        seconds = max(self.seconds, 1e-9)
+        return "Validated [%d] images, [%d] label files, [%d] boxes in [%.2f] (s), [%.0f] files/s, [%d] errors" % (
+            self.images, self.labels, self.boxes, self.seconds, (self.images + self.labels) / seconds,
+            sum(self.errorCounts.values()))
+
+def readLabels(labelPath, imageSize):
+    # Returns (format, classes, xyxy or None, malformed row count). xyxy is None for YOLO without the image size
+    if labelPath.endswith('.xml'):
+        labelFormat, vocSize, boxes = ReadLabelFile(labelPath, imageSize)
+        return labelFormat, boxes.classes, boxes.xyxy, 0
+    with open(labelPath) as f:
+        text = f.read()
+    labelFormat = detectFormat(text)
+    if labelFormat == 'yolo' and imageSize is None:
+        # pixel boxes need the image size, the classes are still checked
+        boxes = parseLabelText(text, (1, 1))[1]
+        classes, xyxy = boxes.classes, None
+    else:
+        boxes = parseLabelText(text, imageSize)[1]
+        classes, xyxy = boxes.classes, boxes.xyxy
+    return labelFormat, classes, xyxy, len(splitRows(text)) - len(classes)
+
+def validateFile(stats, labelPath, imagePath, numClasses):
+    imageSize = None
+    if imagePath is not None:
+        stats.images = stats.images + 1
+        try:
+            imageSize = readImageSize(imagePath)
+        except (IOError, OSError):
+            imageSize = None
+        if imageSize is None:
+            stats.addError(imagePath, 'bad_image', 'cannot read the image size')
+    if labelPath is None:
+        stats.addError(imagePath, 'missing_label')
+        return
+    stats.labels = stats.labels + 1
+    if imagePath is None:
+        stats.addError(labelPath, 'missing_image')
+    try:
+        labelFormat, classes, xyxy, malformedRows = readLabels(labelPath, imageSize)
+    except Exception as e:
+        stats.addError(labelPath, 'bad_label', str(e))
+        return
+    if malformedRows > 0:
+        stats.addError(labelPath, 'malformed_rows', '%d rows' % malformedRows)
+    if labelFormat is not None:
+        stats.formats[labelFormat] += 1
+    if len(classes) == 0:
+        stats.emptyLabels = stats.emptyLabels + 1
+        return
+    stats.addBoxes(classes, xyxy)
+    unknown = (classes < 0) if numClasses is None else ((classes < 0) | (classes >= numClasses))
+    if unknown.any():
+        stats.addError(labelPath, 'unknown_class', 'boxes %s, classes %s' % (
+            np.flatnonzero(unknown).tolist(), sorted(set(classes[unknown].tolist()))))
+    if xyxy is None:
+        return
+    zeroArea = (xyxy[:, 2] <= xyxy[:, 0]) | (xyxy[:, 3] <= xyxy[:, 1])
+    if zeroArea.any():
+        stats.addError(labelPath, 'zero_area', 'boxes %s' % np.flatnonzero(zeroArea).tolist())
+    if imageSize is not None:
+        outside = ((xyxy[:, 0] < 0) | (xyxy[:, 1] < 0) | (xyxy[:, 2] > imageSize[0]) | (xyxy[:, 3] > imageSize[1]))
+        if outside.any():
+            stats.addError(labelPath, 'out_of_bounds', 'boxes %s, image %dx%d' % (
+                np.flatnonzero(outside).tolist(), imageSize[0], imageSize[1]))
+
+def validateChunk(job):
+    # job is ([(labelPath, imagePath)], numClasses), either path None if missing. Returns ValidateStats of the chunk
+    pairs, numClasses = job
+    stats = ValidateStats()
+    for labelPath, imagePath in pairs:
+        validateFile(stats, labelPath, imagePath, numClasses)
+    stats.flush()
+    return stats
+
+def walkPairs(imageDir, labelDir=None, recursive=True):
+    # Yields (labelPath, imagePath) of every image and label, one directory listing at a time.
+    # Labels of an image directory are in the same relative directory under labelDir if given,
+    # else in its LabelData folder (labeller layout) if it exists, else next to the images
+    for dirPath, dirNames, fileNames in os.walk(imageDir):
+        relDir = os.path.relpath(dirPath, imageDir)
+        if labelDir is not None:
+            labelPath = os.path.normpath(os.path.join(labelDir, relDir))
+            dirNames[:] = [d for d in dirNames if os.path.abspath(os.path.join(dirPath, d)) != os.path.abspath(labelDir)]
+        elif os.path.isdir(os.path.join(dirPath, 'LabelData')):
+            labelPath = os.path.join(dirPath, 'LabelData')
+        else:
+            labelPath = dirPath
+        if recursive is True:
+            dirNames[:] = sorted([d for d in dirNames if d not in LABEL_DIR_NAMES])
+        else:
+            dirNames[:] = []
+        images = {}
+        for name in sorted(fileNames):
+            stem, ext = os.path.splitext(name)
+            if ext in IMAGE_EXTENSIONS and stem not in images:
+                images[stem] = os.path.join(dirPath, name)
+        if labelPath == dirPath:
+            labelNames = fileNames
+        else:
+            try:
+                labelNames = os.listdir(labelPath)
+            except OSError:
+                labelNames = []
+        labelled = set()
+        for name in sorted(labelNames):
+            stem, ext = os.path.splitext(name)
+            if ext in LABEL_EXTENSIONS:
+                labelled.add(stem)
+                yield os.path.join(labelPath, name), images.get(stem)
+        for stem in sorted(images):
+            if stem not in labelled:
+                yield None, images[stem]
+
+def writeJson(outFile, summary, spool):
+    # summary keys, then the spooled errors, streamed one at a time
+    outFile.write('{\n')
+    for key, value in summary.items():
+        outFile.write('  %s: %s,\n' % (json.dumps(key), json.dumps(value)))
+    outFile.write('  "errors": [')
+    spool.seek(0)
+    first = True
+    for line in spool:
+        outFile.write(('\n    ' if first else ',\n    ') + line.rstrip('\n'))
+        first = False
+    outFile.write('\n  ]\n}\n')
+
+def validateTree(imageDir, labelDir=None, numClasses=None, workers=1, recursive=True, jsonPath=None, maxPrinted=0):
+    # Validates the tree, returns the merged ValidateStats. The JSON report is written to jsonPath ('-' for stdout),
+    # the first maxPrinted errors are printed
+    stats = ValidateStats()
+    timeStart = time.time()
+    pairs = walkPairs(imageDir, labelDir, recursive)
+    def jobs():
+        while True:
+            chunk = list(itertools.islice(pairs, CHUNK_SIZE))
+            if len(chunk) == 0:
+                return
+            yield chunk, numClasses
+    spool = tempfile.TemporaryFile('w+')
+    printed = [0]
+    def collect(chunkStats):
+        stats.merge(chunkStats)
+        for path, error, detail in chunkStats.errors:
+            spool.write(json.dumps({'path': path, 'error': error, 'detail': detail}) + '\n')
+            if printed[0] < maxPrinted:
+                print("Error: " + error + ": " + path + ((" (" + detail + ")") if detail != '' else ''))
+                printed[0] = printed[0] + 1
+    try:
+        if workers <= 1:
+            for job in jobs():
+                collect(validateChunk(job))
+        else:
+            # apply_async with a bounded queue, Pool.imap would read the whole walk ahead of the workers
+            pool = multiprocessing.Pool(workers)
+            try:
+                inFlight = collections.deque()
+                for job in jobs():
+                    inFlight.append(pool.apply_async(validateChunk, (job,)))
+                    if len(inFlight) >= workers * CHUNKS_PER_WORKER:
+                        collect(inFlight.popleft().get())
+                while len(inFlight) > 0:
+                    collect(inFlight.popleft().get())
+            finally:
+                pool.close()
+                pool.join()
+        stats.seconds = time.time() - timeStart
+        if jsonPath == '-':
+            writeJson(sys.stdout, stats.summary(), spool)
+        elif jsonPath is not None:
+            with open(jsonPath, 'w') as f:
+                writeJson(f, stats.summary(), spool)
+    finally:
+        spool.close()
+    return stats
+
+def main(argv):
+    parser = argparse.ArgumentParser(usage=CLI_USAGE)
+    parser.add_argument("imageDir")
+    parser.add_argument("--labels", dest="labelDir", default=None,
+                        help="label tree, same layout as the image tree (default: LabelData of each image folder, else next to the images)")
+    parser.add_argument("--num-classes", dest="numClasses", type=int, default=None, help="valid class ids are 0 .. N-1")
+    parser.add_argument("--json", dest="jsonPath", default=None, help="JSON report file, - for stdout")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--no-recursive", dest="recursive", action="store_false")
+    parser.add_argument("--print-errors", dest="maxPrinted", type=int, default=20, help="errors printed (default 20)")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.imageDir):
+        sys.exit("Error: The specified directory doesn't exist! [" + args.imageDir + "]")
+    maxPrinted = 0 if args.jsonPath == '-' else args.maxPrinted
+    stats = validateTree(args.imageDir, args.labelDir, args.numClasses, args.workers, args.recursive,
+                         args.jsonPath, maxPrinted)
+    if args.jsonPath != '-':
+        print("Info: " + stats.report())
+        for error, count in sorted(stats.errorCounts.items()):
+            print("Info: [%d] %s" % (count, error))
+    return 1 if len(stats.errorCounts) > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
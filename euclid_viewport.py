@@ -0,0 +1,219 @@
+#-------------------------------------------------------------------------------
+# Euclid - viewport rendering
+# Large images are shown scaled to the viewport, from a pyramid of downsampled levels
+# (1/2, 1/4, 1/8 .. of the full resolution). JPEG levels are decoded at reduced size
+# (Image.draft), so showing an 8K frame costs about the same as showing a 1K one.
+# The visible part of the image is drawn as tiles, cached per zoom level.
+#
+# Coordinates:
+# - image  : full resolution pixels, used for the boxes and the label files
+# - canvas : pixels of the image as displayed at the current zoom (scrolled by the canvas)
+# - window : pixels of the canvas widget (mouse events)
+#-------------------------------------------------------------------------------
+import time
+import math
+import collections
+from PIL import Image, ImageTk
+
+# Display tile size, in pixels
+TILE_SIZE = 256
+# Number of display tiles kept (for all zoom levels of the current image)
+TILE_CACHE_TILES = 192
+# Each zoom step multiplies the scale by ZOOM_STEP, from the fit-to-viewport scale up to MAX_SCALE
+ZOOM_STEP = math.sqrt(2.)
+MAX_SCALE = 8.
+
+def normaliseMode(img):
+    # modes that resize and display without surprises
+    if img.mode in ('L', 'RGB', 'RGBA'):
+        return img
+    if 'A' in img.mode or 'transparency' in img.info:
+        return img.convert('RGBA')
+    return img.convert('RGB')
+
+class ImagePyramid():
+    # Downsampled levels of one image, keyed by the reduction factor (1 is the full resolution).
+    # Only the level used to fit the image in viewportSize is decoded up front, other levels are made on demand
+    def __init__(self, path, viewportSize):
+        self.path = path
+        img = Image.open(path)
+        self.size = img.size
+        self.fitScale = min(1., viewportSize[0] / float(self.size[0]), viewportSize[1] / float(self.size[1]))
+        self.levels = {}
+        self.previewFactor = self.levelFactor(self.fitScale)
+        self.level(self.previewFactor, img)
+
+    def levelFactor(self, scale):
+        # coarsest level that is still at least as fine as the display scale
+        factor = 1
+        while 2 * factor * scale <= 1. and 2 * factor <= min(self.size):
+            factor = 2 * factor
+        return factor
+
+    def levelSize(self, factor):
+        return (self.size[0] + factor - 1) // factor, (self.size[1] + factor - 1) // factor
+
+    def level(self, factor, img=None):
+        lvl = self.levels.get(factor)
+        if lvl is not None:
+            return lvl
+        finer = [f for f in self.levels if f < factor]
+        if len(finer) > 0:
+            lvl = self.levels[max(finer)].resize(self.levelSize(factor), Image.BOX)
+        else:
+            if img is None:
+                img = Image.open(self.path)
+            # JPEG only: decode at 1/2, 1/4 or 1/8 of the size (at least the requested size)
+            img.draft('RGB', self.levelSize(factor))
+            img.load()
+            img = normaliseMode(img)
+            if img.size == self.size:
+                self.levels[1] = img
+            lvl = img
+            if img.size != self.levelSize(factor):
+                lvl = img.resize(self.levelSize(factor), Image.BOX)
+        self.levels[factor] = lvl
+        return lvl
+
+    def region(self, scale, box):
+        # box (canvas coordinates at scale) of the image, as displayed
+        factor = self.levelFactor(scale)
+        lvl = self.level(factor)
+        k = scale * factor
+        size = (box[2] - box[0], box[3] - box[1])
+        if k == 1.:
+            return lvl.crop(box)
+        srcBox = (box[0] / k, box[1] / k, min(box[2] / k, lvl.size[0]), min(box[3] / k, lvl.size[1]))
+        return lvl.resize(size, Image.BILINEAR, box=srcBox)
+
+    def trim(self):
+        # drop the levels made for zooming, once the image is not displayed anymore
+        self.levels = {self.previewFactor: self.levels[self.previewFactor]}
+
+class TiledView():
+    # Draws an ImagePyramid on a Tk canvas, at the fit-to-viewport scale times ZOOM_STEP ** zoomStep.
+    # The canvas scrolls over the image displayed at that scale, only the visible tiles are on the canvas
+    def __init__(self, canvas, minCanvasSize=400, tileSize=TILE_SIZE, cacheTiles=TILE_CACHE_TILES):
+        self.canvas = canvas
+        self.minCanvasSize = minCanvasSize
+        self.tileSize = tileSize
+        self.cacheTiles = cacheTiles
+        self.pyramid = None
+        self.zoomStep = 0
+        self.scale = 1.
+        self.items = {}                          # (tx, ty) -> (canvas item, PhotoImage)
+        self.tiles = collections.OrderedDict()   # (zoomStep, tx, ty) -> PhotoImage
+        self.tileHits = 0
+        self.tileMisses = 0
+        self.renderSeconds = 0.
+
+    def setImage(self, pyramid):
+        self.clearTiles()
+        self.tiles.clear()
+        self.pyramid = pyramid
+        self.zoomStep = 0
+        self.scale = pyramid.fitScale
+        width, height = self.displaySize()
+        self.canvas.config(width = max(width, self.minCanvasSize), height = max(height, self.minCanvasSize))
+        self.updateRegion()
+        self.canvas.xview_moveto(0)
+        self.canvas.yview_moveto(0)
+        self.render()
+
+    def clearTiles(self):
+        self.canvas.delete('tile')
+        self.items = {}
+
+    def displaySize(self):
+        return max(1, int(round(self.pyramid.size[0] * self.scale))), max(1, int(round(self.pyramid.size[1] * self.scale)))
+
+    def updateRegion(self):
+        width, height = self.displaySize()
+        self.canvas.config(scrollregion = (0, 0, width, height))
+
+    def getTile(self, tx, ty):
+        key = (self.zoomStep, tx, ty)
+        photo = self.tiles.get(key)
+        if photo is not None:
+            self.tiles.move_to_end(key)
+            self.tileHits = self.tileHits + 1
+            return photo
+        width, height = self.displaySize()
+        box = (tx * self.tileSize, ty * self.tileSize, min((tx + 1) * self.tileSize, width), min((ty + 1) * self.tileSize, height))
+        photo = ImageTk.PhotoImage(self.pyramid.region(self.scale, box))
+        self.tileMisses = self.tileMisses + 1
+        self.tiles[key] = photo
+        while len(self.tiles) > self.cacheTiles:
+            self.tiles.popitem(last=False)
+        return photo
+
+    def render(self):
+        # puts the visible tiles on the canvas, and removes the others
+        if self.pyramid is None:
+            return
+        timeStart = time.time()
+        width, height = self.displaySize()
+        x0 = int(self.canvas.canvasx(0))
+        y0 = int(self.canvas.canvasy(0))
+        # the widget size is not updated yet right after a config()
+        x1 = x0 + max(self.canvas.winfo_width(), int(self.canvas.cget('width')))
+        y1 = y0 + max(self.canvas.winfo_height(), int(self.canvas.cget('height')))
+        T = self.tileSize
+        visible = set()
+        for ty in range(max(0, y0 // T), min((height + T - 1) // T, y1 // T + 1)):
+            for tx in range(max(0, x0 // T), min((width + T - 1) // T, x1 // T + 1)):
+                visible.add((tx, ty))
+                if (tx, ty) not in self.items:
+                    photo = self.getTile(tx, ty)
+                    item = self.canvas.create_image(tx * T, ty * T, image = photo, anchor = 'nw', tags = 'tile')
+                    self.items[(tx, ty)] = (item, photo)
+        for key in list(self.items.keys()):
+            if key not in visible:
+                self.canvas.delete(self.items.pop(key)[0])
+        # boxes and crosshair stay on top of the image
+        self.canvas.tag_lower('tile')
+        self.renderSeconds = time.time() - timeStart
+
+    def maxZoomStep(self):
+        return max(0, int(math.floor(math.log(MAX_SCALE / self.pyramid.fitScale) / math.log(ZOOM_STEP))))
+
+    def zoom(self, steps, wx, wy):
+        # zoom by steps, keeping the image point under window position (wx, wy) in place. Returns True if zoomed
+        if self.pyramid is None:
+            return False
+        zoomStep = max(0, min(self.zoomStep + steps, self.maxZoomStep()))
+        if zoomStep == self.zoomStep:
+            return False
+        ix = self.canvas.canvasx(wx) / self.scale
+        iy = self.canvas.canvasy(wy) / self.scale
+        self.zoomStep = zoomStep
+        self.scale = self.pyramid.fitScale * ZOOM_STEP ** zoomStep
+        self.clearTiles()
+        self.updateRegion()
+        width, height = self.displaySize()
+        self.canvas.xview_moveto(max(0., ix * self.scale - wx) / width)
+        self.canvas.yview_moveto(max(0., iy * self.scale - wy) / height)
+        self.render()
+        return True
+
+    def fit(self):
+        return self.zoom(-self.zoomStep, 0, 0)
+
+    def panStart(self, wx, wy):
+        self.canvas.scan_mark(wx, wy)
+
+    def panTo(self, wx, wy):
+        self.canvas.scan_dragto(wx, wy, gain = 1)
+        self.render()
+
+    def toImage(self, wx, wy):
+        # window position -> full resolution image pixel
+        return int(round(self.canvas.canvasx(wx) / self.scale)), int(round(self.canvas.canvasy(wy) / self.scale))
+
+    def toCanvas(self, coords):
+        # full resolution image coordinates -> canvas coordinates
+        return [v * self.scale for v in coords]
+
+    def report(self):
+        lookups = max(1, self.tileHits + self.tileMisses)
+        return "zoom %d%%, render %d ms, tile hit %d%%" % (100 * self.scale, 1000 * self.renderSeconds, 100 * self.tileHits / lookups)
@@ -0,0 +1,104 @@
+#-------------------------------------------------------------------------------
+# Euclid - Pascal VOC labels
+# Writer and reader of Pascal VOC annotation files, shared by the labeller, the label
+# converter, the validator and euclidaug.
+# VocWriter streams one well formed annotation per image in a single pass (header,
+# then the objects as they come), with the text escaped. The reader feeds the file in
+# blocks to the C ElementTree parser (iterparse yields every element through Python,
+# twice as slow for per-image annotations), and reads the objects from the tree.
+# Object names are the class ids, optionally with a prefix ("3" or "Class3").
+#-------------------------------------------------------------------------------
+import io
+import numpy as np
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import escape
+from euclid_boxes import BoxSet, parseClassId
+
+VOC_OBJECT = ('\t<object>\n\t\t<name>%s</name>\n\t\t<pose>Unspecified</pose>\n\t\t<truncated>0</truncated>\n'
+              '\t\t<difficult>%d</difficult>\n\t\t<bndbox>\n\t\t\t<xmin>%d</xmin>\n\t\t\t<ymin>%d</ymin>\n'
+              '\t\t\t<xmax>%d</xmax>\n\t\t\t<ymax>%d</ymax>\n\t\t</bndbox>\n\t</object>\n')
+
+class VocWriter():
+    # start(), then addObject() / addBoxes() any number of times, then finish(). Writes text to f
+    def __init__(self, f):
+        self.f = f
+
+    def start(self, imageName, imageSize=None, depth=3, imagePath=None, folder=None):
+        # imageSize is (width, height), the size element is left out if None
+        parts = ['<?xml version="1.0" encoding="utf-8"?>\n<annotation>\n']
+        if folder is not None:
+            parts.append('\t<folder>%s</folder>\n' % escape(folder))
+        parts.append('\t<filename>%s</filename>\n' % escape(imageName))
+        if imagePath is not None:
+            parts.append('\t<path>%s</path>\n' % escape(imagePath))
+        if imageSize is not None:
+            parts.append('\t<size>\n\t\t<width>%d</width>\n\t\t<height>%d</height>\n\t\t<depth>%d</depth>\n\t</size>\n'
+                         % (imageSize[0], imageSize[1], depth))
+        parts.append('\t<segmented>0</segmented>\n')
+        self.f.write(''.join(parts))
+
+    def addObject(self, name, xmin, ymin, xmax, ymax, difficult=0):
+        # coordinates are rounded to whole pixels
+        self.f.write(VOC_OBJECT % (escape(str(name)), difficult, round(xmin), round(ymin), round(xmax), round(ymax)))
+
+    def addBoxes(self, boxes, classPrefix=''):
+        # all the boxes of a BoxSet, formatted at once
+        if len(boxes) == 0:
+            return
+        template = VOC_OBJECT.replace('<name>%s', '<name>' + escape(classPrefix).replace('%', '%%') + '%d', 1)
+        values = np.column_stack([boxes.classes, np.zeros(len(boxes)), np.rint(boxes.xyxy)]).astype(np.int64)
+        self.f.write((template * len(boxes)) % tuple(values.ravel().tolist()))
+
+    def finish(self):
+        self.f.write('</annotation>\n')
+
+def formatVoc(boxes, imageSize=None, imageName='', imagePath=None, classPrefix=''):
+    # text of the VOC annotation of one image
+    out = io.StringIO()
+    writer = VocWriter(out)
+    writer.start(imageName, imageSize, imagePath=imagePath)
+    writer.addBoxes(boxes, classPrefix)
+    writer.finish()
+    return out.getvalue()
+
+VOC_READ_BLOCK = 65536
+
+def parseVocRoot(root):
+    # Returns (imageSize or None, image file name or None, BoxSet) of a parsed annotation.
+    # Only the direct children of an object are read, parts of an object have their own name and bndbox
+    imageSize = None
+    size = root.find('size')
+    if size is not None:
+        width, height = size.findtext('width'), size.findtext('height')
+        if width is not None and height is not None:
+            imageSize = (int(float(width)), int(float(height)))
+    imageName = root.findtext('filename')
+    classes = []
+    xyxy = []
+    for obj in root.iterfind('object'):
+        bndbox = obj.find('bndbox')
+        if bndbox is None:
+            raise ValueError('object without bndbox')
+        classes.append(parseClassId(obj.findtext('name', '').strip()))
+        corners = dict([(child.tag, child.text) for child in bndbox])
+        xyxy.append((float(corners['xmin']), float(corners['ymin']), float(corners['xmax']), float(corners['ymax'])))
+    return imageSize, imageName.strip() if imageName is not None else None, BoxSet(classes, xyxy)
+
+def parseVoc(source):
+    # source is a file path or a binary file object, read in blocks
+    parser = ET.XMLParser()
+    f = open(source, 'rb') if isinstance(source, str) else source
+    try:
+        for block in iter(lambda: f.read(VOC_READ_BLOCK), b''):
+            parser.feed(block)
+    finally:
+        if f is not source:
+            f.close()
+    return parseVocRoot(parser.close())
+
+def parseVocText(text):
+    if isinstance(text, str):
+        text = text.encode('utf-8')
+    parser = ET.XMLParser()
+    parser.feed(text)
+    return parseVocRoot(parser.close())
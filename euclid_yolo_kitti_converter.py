@@ -52,18 +52,30 @@
 #   1    Bbox_Height  Float from 0 to 1, Height of b-box, normalised to image height
 #-------------------------------------------------------------------------------
 import sys
-if sys.version_info[0] < 3:
-    from Tkinter import *
-    import tkMessageBox
-    import tkFileDialog
-else:
-    from tkinter import *
-    import tkinter.messagebox as tkMessageBox
-    import tkinter.filedialog as tkFileDialog
-from PIL import Image, ImageTk
+# Tk is only needed for the GUI, the command line converter runs on headless servers
+try:
+    if sys.version_info[0] < 3:
+        from Tkinter import *
+        import tkMessageBox
+        import tkFileDialog
+    else:
+        from tkinter import *
+        import tkinter.messagebox as tkMessageBox
+        import tkinter.filedialog as tkFileDialog
+except ImportError:
+    Tk = None
 import os
 import glob
 import random
+import argparse
+import multiprocessing
+import tempfile
+import time
+import itertools
+import sqlite3
+from euclid_dimindex import DimensionIndex, INDEX_FILE_NAME
+from euclid_boxes import detectFormat, parseLabelText, formatLabels, labelExtension
+from euclid_voc import parseVoc, formatVoc
 
     
 # Usage
@@ -72,11 +84,203 @@ USAGE = " \
 2. Click Convert. The labels will be converted and stored in current directory \n \
 "
 
+# Command line usage (without arguments, the GUI is started)
+CLI_USAGE = "euclid_yolo_kitti_converter.py <label dir> --to yolo|kitti|voc [--out dir] [--images dir] [--workers N] [--dim-index file]"
 
 
 
-# Object Classes (No spaces in name)
-CLASSES = ['Class0', 'Class1', 'Class2', 'Class3', 'Class4', 'Class5', 'Class6', 'Class7']
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG']
+LABEL_EXTENSIONS = ['.txt', '.xml']
+
+#-------------------------------------------------------------------------------
+# Headless conversion between YOLO, KITTI and Pascal VOC labels
+#-------------------------------------------------------------------------------
+
+class ImageLocator():
+    # Finds the image with the same name as a label, with one directory listing per image directory
+    # instead of a stat per candidate extension
+    def __init__(self):
+        self.dirStems = {}
+
+    def find(self, labelPath, imageDirs):
+        stem = os.path.splitext(os.path.basename(labelPath))[0]
+        for imageDir in imageDirs:
+            if imageDir not in self.dirStems:
+                stems = {}
+                try:
+                    for name in sorted(os.listdir(imageDir)):
+                        nameStem, ext = os.path.splitext(name)
+                        if ext in IMAGE_EXTENSIONS and nameStem not in stems:
+                            stems[nameStem] = name
+                except OSError:
+                    pass
+                self.dirStems[imageDir] = stems
+            name = self.dirStems[imageDir].get(stem)
+            if name is not None:
+                return os.path.join(imageDir, name)
+        return None
+
+def ReadLabelFile(labelPath, imageSize=None):
+    # Returns (format, imageSize, BoxSet) - imageSize from the VOC file, else the one given.
+    # Format of a .txt is decided by the token count, like Euclid does. The boxes of a YOLO file are None without imageSize
+    if labelPath.endswith('.xml'):
+        vocSize, vocName, boxes = parseVoc(labelPath)
+        return 'voc', vocSize if vocSize is not None else imageSize, boxes
+    with open(labelPath) as f:
+        text = f.read()
+    labelFormat = detectFormat(text)
+    if labelFormat == 'yolo' and imageSize is None:
+        return labelFormat, None, None
+    return labelFormat, imageSize, parseLabelText(text, imageSize)[1]
+
+def FormatLabels(outFormat, imageName, imageSize, boxes):
+    # boxes is a BoxSet, in pixels
+    if outFormat in ('yolo', 'kitti'):
+        return formatLabels(outFormat, boxes, imageSize)
+    return formatVoc(boxes, imageSize, imageName)
+
+def WriteFileAtomic(outPath, text):
+    # Whole file in one write to a temporary file, renamed over the output. Readers never see a partial file,
+    # and running the conversion again replaces the output instead of appending to it
+    outDir = os.path.dirname(outPath)
+    if not os.path.isdir(outDir):
+        try:
+            os.makedirs(outDir)
+        except OSError:
+            # created by another worker
+            pass
+    fd, tmpPath = tempfile.mkstemp(dir=outDir, prefix='.' + os.path.basename(outPath), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.replace(tmpPath, outPath)
+    except:
+        os.remove(tmpPath)
+        raise
+
+def ConvertLabelFile(job):
+    # job is (labelPath, outPath, outFormat, imagePath, imageSize), the image ones None if not found.
+    # Returns (labelPath, number of boxes, error or None).
+    # The source is parsed once, all of its boxes are converted in memory and the output is written at once.
+    # outFormat 'swap' converts YOLO to KITTI, and KITTI (or VOC) to YOLO
+    labelPath, outPath, outFormat, imagePath, indexedSize = job
+    try:
+        # Image size is needed to go from or to normalised YOLO boxes, unless the VOC file has it
+        inFormat, imageSize, boxes = ReadLabelFile(labelPath, indexedSize)
+        if outFormat == 'swap':
+            outFormat = 'kitti' if inFormat == 'yolo' else 'yolo'
+        imageName = os.path.basename(imagePath) if imagePath is not None else os.path.splitext(os.path.basename(labelPath))[0]
+        if imageSize is None and (inFormat == 'yolo' or outFormat == 'yolo' or outFormat == 'voc'):
+            return labelPath, 0, 'image not found' if imagePath is None else 'cannot read image size'
+        WriteFileAtomic(outPath, FormatLabels(outFormat, imageName, imageSize, boxes))
+        return labelPath, len(boxes), None
+    except Exception as e:
+        return labelPath, 0, str(e)
+
+def WalkLabelFiles(labelDir, skipDir, recursive=True):
+    for dirPath, dirNames, fileNames in os.walk(labelDir):
+        if os.path.abspath(dirPath) == os.path.abspath(skipDir):
+            dirNames[:] = []
+            continue
+        if recursive is True:
+            dirNames.sort()
+        else:
+            dirNames[:] = []
+        for fileName in sorted(fileNames):
+            if os.path.splitext(fileName)[1] in LABEL_EXTENSIONS:
+                yield os.path.join(dirPath, fileName)
+
+class ConvertStats():
+    def __init__(self):
+        self.files = 0
+        self.boxes = 0
+        self.errors = []
+        self.seconds = 0.
+        self.dimIndexReport = ''
+
+    def report(self):
+        seconds = max(self.seconds, 1e-9)
+        return "Converted [%d] label files, [%d] boxes in [%.2f] (s), [%.0f] files/s, [%.0f] boxes/s, [%d] errors" % (
+            self.files, self.boxes, self.seconds, self.files / seconds, self.boxes / seconds, len(self.errors))
+
+def ConvertTree(labelDir, outFormat, outDir, imageDir=None, workers=1, recursive=True, dimIndexPath=None):
+    # Converts every label under labelDir to outFormat, into the same relative path under outDir. Returns ConvertStats.
+    # Images are looked up in imageDir if given, else next to the label and in its parent directory (Euclid's LabelData).
+    # Image sizes come from the dimension index (default in imageDir, else labelDir), filled in parallel from the headers
+    outExt = labelExtension(outFormat) if outFormat != 'swap' else '.txt'
+    if dimIndexPath is None:
+        dimIndexPath = os.path.join(imageDir if imageDir is not None else labelDir, INDEX_FILE_NAME)
+    try:
+        dimIndex = DimensionIndex(dimIndexPath)
+    except sqlite3.Error as e:
+        print("Warning: Cannot open image dimension index [" + dimIndexPath + "], not persisted: " + str(e))
+        dimIndexPath = ':memory:'
+        dimIndex = DimensionIndex(dimIndexPath)
+    locator = ImageLocator()
+    def jobs():
+        labelPaths = WalkLabelFiles(labelDir, outDir, recursive)
+        while True:
+            chunk = []
+            for labelPath in itertools.islice(labelPaths, 4096):
+                relPath = os.path.relpath(labelPath, labelDir)
+                outPath = os.path.join(outDir, os.path.splitext(relPath)[0] + outExt)
+                labelParent = os.path.dirname(labelPath)
+                if imageDir is not None:
+                    imageDirs = [os.path.join(imageDir, os.path.dirname(relPath)), imageDir]
+                else:
+                    imageDirs = [labelParent, os.path.dirname(labelParent)]
+                chunk.append((labelPath, outPath, locator.find(labelPath, imageDirs)))
+            if len(chunk) == 0:
+                return
+            dims = dimIndex.scan([imagePath for labelPath, outPath, imagePath in chunk if imagePath is not None])
+            for labelPath, outPath, imagePath in chunk:
+                yield labelPath, outPath, outFormat, imagePath, dims.get(imagePath)
+    stats = ConvertStats()
+    timeStart = time.time()
+    if workers <= 1:
+        results = map(ConvertLabelFile, jobs())
+        pool = None
+    else:
+        pool = multiprocessing.Pool(workers)
+        results = pool.imap_unordered(ConvertLabelFile, jobs(), 256)
+    try:
+        for labelPath, boxCount, error in results:
+            if error is not None:
+                stats.errors.append((labelPath, error))
+                continue
+            stats.files = stats.files + 1
+            stats.boxes = stats.boxes + boxCount
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    try:
+        dimIndex.save()
+    except sqlite3.Error as e:
+        print("Warning: Cannot save image dimension index [" + dimIndexPath + "]: " + str(e))
+    stats.seconds = time.time() - timeStart
+    stats.dimIndexReport = dimIndex.report()
+    return stats
+
+def main(argv):
+    parser = argparse.ArgumentParser(usage=CLI_USAGE)
+    parser.add_argument("labelDir")
+    parser.add_argument("--to", dest="outFormat", choices=["yolo", "kitti", "voc"], required=True)
+    parser.add_argument("--out", dest="outDir", default=None, help="default: <label dir>/ConvertedLabelData")
+    parser.add_argument("--images", dest="imageDir", default=None)
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--dim-index", dest="dimIndexPath", default=None, help="image dimension index file")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.labelDir):
+        sys.exit("Error: The specified directory doesn't exist! [" + args.labelDir + "]")
+    outDir = args.outDir if args.outDir is not None else os.path.join(args.labelDir, 'ConvertedLabelData')
+    stats = ConvertTree(args.labelDir, args.outFormat, outDir, args.imageDir, args.workers, True, args.dimIndexPath)
+    for labelPath, error in stats.errors:
+        print("Error: " + labelPath + ": " + error)
+    print("Info: " + stats.report() + ", to [" + args.outFormat + "] in [" + outDir + "]")
+    print("Info: Image dimensions " + stats.dimIndexReport)
+    return 1 if len(stats.errors) > 0 else 0
 
 class EuclidConverter():
 
@@ -197,107 +401,37 @@ class EuclidConverter():
         self.frame.columnconfigure(1, weight = 1)
         self.frame.rowconfigure(4, weight = 1)
 
-    def GetBoundariesFromYoloFile(self, centerX, centerY, width, height, imageWidth, imageHeight):
-        topLeftX = (int)(centerX*imageWidth - (width*imageWidth)/2)
-        topLeftY = (int)(centerY*imageHeight - (height*imageHeight)/2)
-        bottomRightX = (int)(centerX*imageWidth + (width*imageWidth)/2)
-        bottomRightY = (int)(centerY*imageHeight + (height*imageHeight)/2)
-        return topLeftX, topLeftY, bottomRightX, bottomRightY
-    
-
-    def convert2Yolo(self, image, boxCoords):
-        
-        invWidth = 1./image[0]
-        invHeight = 1./image[1]
-        x = invWidth * (boxCoords[0] + boxCoords[2])/2.0
-        y = invHeight * (boxCoords[1] + boxCoords[3])/2.0
-        boxWidth = invWidth * (boxCoords[2] - boxCoords[0])
-        boxHeight = invHeight * (boxCoords[3] - boxCoords[1])
-        return (x,y,boxWidth,boxHeight)
- 
     def updateStatus(self, newStatus):
         self.statusText.set("Status: " + newStatus)
 
-    def YoloLabelWriteOut(self, filename, classname, topLeftX, topLeftY, bottomRightX, bottomRightY):
-        labelFile = open(filename, "a+")
-        #TODO - get image w/h
-        yoloOut = self.convert2Yolo([1000,1000], 
-                                [topLeftX, topLeftY, bottomRightX, bottomRightY] );
-        labelFile.write('%s' % CLASSES[classname])               
-        labelFile.write(' %.7f %.7f %.7f %.7f\n' % (yoloOut[0], yoloOut[1], yoloOut[2], yoloOut[3]))                                  
-        labelFile.close()
-        
-    def KittiLabelWriteOut(self, filename, classname, topLeftX, topLeftY, bottomRightX, bottomRightY):
-        labelFile = open(filename+ "Kitti.txt", "a+")
-        #TODO - get image w/h
-        #print(classname,playerNameArray[0])
-        labelFile.write('%s' % CLASSES[classname])               
-        labelFile.write(' 0.0 0 0.0 ')
-        labelFile.write('%.2f %.2f %.2f %.2f' % (topLeftX, topLeftY, bottomRightX, bottomRightY))                 
-        labelFile.write(' 0.0 0.0 0.0 0.0 0.0 0.0 0.0')
-        labelFile.write('\n')    
-        labelFile.close()
-        
-        
-    # Convert label formats
+    # Convert label formats, KITTI labels to YOLO and YOLO labels to KITTI
     def ConvertLabels(self):          
-         #get image list
-        labelFileTypes = ('*.txt') # the tuple of file types
-        self.labelFileList = []
-    
-        # load labels
-        for files in labelFileTypes:
-            self.labelFileList.extend(glob.glob(os.path.join(self.imageDir, files.lower())) )
-            if (False == self.is_windows):
-               self.labelFileList.extend(glob.glob(os.path.join(self.imageDir, files)) )
-            
-        if len(self.labelFileList) == 0:
+        if not os.path.isdir(self.imageDir):
+            tkMessageBox.showerror("Folder error", message = "The specified directory doesn't exist!")
+            return
+         # set up output dir
+        self.outDir = os.path.join(self.imageDir + '/ConvertedLabelData')
+        self.updateStatus('Converting label files from %s' % self.imageDir)
+        self.parent.update_idletasks()
+        stats = ConvertTree(self.imageDir, 'swap', self.outDir, None, multiprocessing.cpu_count(), recursive = False)
+        self.total = stats.files
+        if stats.files == 0 and len(stats.errors) == 0:
             tkMessageBox.showerror("Label files not found", message = "No labels (.txt) found in folder!")
             self.updateStatus( 'No label files found in the specified dir!')
             return
         # Change title
-        self.parent.title("Euclid Label Converter (" + self.imageDir + ") " + str(len(self.labelFileList)) + " label files")
-
-        # default to the 1st image in the collection
-        self.cur = 1
-        self.total = len(self.labelFileList)
-
-         # set up output dir
-        self.outDir = os.path.join(self.imageDir + '/ConvertedLabelData')
-        if not os.path.exists(self.outDir):
-            os.mkdir(self.outDir)
-
-        self.updateStatus( '%d label files located from %s' %(self.total, self.imageDir))
-
-        # Convert one file
-        #self.labelfilename = self.labelFileList[self.cur - 1]
-        for file in range(self.total-1):
-            self.labelfilename = self.labelFileList[file]    
-            #print(self.labelfilename, file)
-            lastPartFileName, lastPartFileExtension = os.path.splitext(os.path.split(self.labelfilename)[-1])
-            newFileName = self.outDir + '/' + lastPartFileName + lastPartFileExtension
-            bbox_cnt = 0
-            if os.path.exists(self.labelfilename):
-                with open(self.labelfilename) as f:
-                    for (i, line) in enumerate(f):
-                        bbox_cnt = len(line)
-                        tmp = [elements.strip() for elements in line.split()]
-                        
-                        # for each line, convert and writeout
-                        
-                        if(len(tmp) > 5):
-                            self.currLabelMode='KITTI'
-                            self.YoloLabelWriteOut(newFileName, int(tmp[0]), float(tmp[4]), float(tmp[5]), float(tmp[6]), float(tmp[7]) )
-                            
-                        elif(len(tmp) == 5):
-                            self.currLabelMode='YOLO'
-                            bbTuple = self.GetBoundariesFromYoloFile(float(tmp[1]),float(tmp[2]), float(tmp[3]),float(tmp[4]), 
-                                                                self.tkimg.width(), self.tkimg.height() )
-                            
-                            self.KittiLabelWriteOut(self.labelfilename, int(tmp[0]), bbTuple[0], bbTuple[1], bbTuple[2], bbTuple[3] )
-                                                   
+        self.parent.title("Euclid Label Converter (" + self.imageDir + ") " + str(stats.files) + " label files")
+        self.progLabel.config(text = "Progress: [ %04d / %04d ]" %(stats.files, stats.files + len(stats.errors)))
+        self.updateStatus(stats.report() + ' in ' + self.outDir)
+        if len(stats.errors) > 0:
+            tkMessageBox.showwarning("Conversion errors", message = '\n'.join(
+                [labelPath + ': ' + error for labelPath, error in stats.errors[:20]]))
         
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        sys.exit(main(sys.argv[1:]))
+    if Tk is None:
+        sys.exit("Error: Tk is not available, use the command line: " + CLI_USAGE)
     root = Tk()
     tool = EuclidConverter(root)
     root.mainloop()
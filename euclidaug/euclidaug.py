@@ -9,6 +9,8 @@
 # - Place all background png images in the folder 'bg' (can be any name)
 # - Update cfgWidth, cfgHeight, numClasses - in the script, to match the framework requirements
 # - Invoke this script as "python <script> <object-folder-name> <bg folder name> <output train list name>"
+# - Use "--workers N" to generate on N processes. Every (background, run) task is seeded
+#   from "--seed", so the output is identical for any worker count
 # - output image files will be written to 'output_images' and 'output_labels'
 # - output training list file will be written containing all image paths
 # - Note: The labels are in Yolo format (centerx,centery, w,h)
@@ -17,13 +19,31 @@
 #############################################################################
 
 from PIL import Image
+import numpy as np
 import glob
 import random
-from rectpack import newPacker
+from euclidpack import packRects, PackStats
+from euclidprof import StageProfiler, PROFILE_MODES
+from euclidstore import createStore, attachStore, STORE_BACKENDS
+from euclidshard import ShardWriter, SHARD_COMPRESSIONS, SHARD_CHECKSUMS
 import sys, os
 import io
 import ntpath
 import time
+import argparse
+import hashlib
+import multiprocessing
+import collections
+import threading
+import queue
+import json
+import cProfile
+import pstats
+# shared euclid modules are in the parent directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from euclid_dimindex import DimensionIndex
+from euclid_boxes import BoxSet, formatYolo, formatKitti
+from euclid_voc import formatVoc
 
 ################## USER CONFIGURATION ########################
 # Target framework image size for annotated data
@@ -36,50 +56,31 @@ enableScaleUp = False
 numTargetImagesPerClass = 10
 imageFolderName = 'out_images'
 labelFolderName = 'out_labels'
+shardFolderName = 'out_shards'   # tar shards of --output shards
+shardSizeMB = 256                # maximum shard size, can be overridden with --shard-size
 writeOutFormat = "pascalvoc"   # pascalvoc or yolo or kitti
+numWorkers = 1   # generation processes, can be overridden with --workers
+baseSeed = 0     # base seed for per task seeding, can be overridden with --seed
+blendBackend = "pil"   # pil or numpy, can be overridden with --blend. numpy also honours the sprite alpha channel
+packAlgorithm = "rectpack"   # rectpack or shelf (faster for small object counts), can be overridden with --pack-algo
+packBatchSize = 1      # canvases packed together (per background), can be overridden with --pack-batch
+packFillRatio = 0.0    # >0 keeps adding objects until they cover this ratio of the batch canvases area (--pack-fill).
+                       # 0 adds one object per class per canvas. Canvases are filled in order, so a ratio below the
+                       # packing efficiency (~0.9) leaves the last canvases of a batch empty (reported as wasted)
+spriteCacheMB = 256    # memory budget of the pre-scaled sprite cache (per process), can be overridden with --sprite-cache-mb
+writerThreads = 4      # JPEG encode and disk write threads, can be overridden with --writer-threads
+writerQueueSize = 64   # generated images waiting to be written, generation blocks beyond this
+trainListFlushEvery = 100   # flush the training list every N written images
+dimIndexFileName = 'euclidaug_dims.db'   # image dimension index of the object and background images
+manifestFileName = 'euclidaug_manifest.jsonl'   # finished tasks, used to resume a run. Can be overridden with --manifest
+sharedStoreBackend = "auto"   # decoded sprites and backgrounds shared by the workers: auto, shm, mmap or off (--shared-store)
+profileMode = "low"   # per stage timing: off, low (wall clock) or full (wall clock and CPU), can be overridden with --profile
 ##############################################################
 ##################### EUCLIDAUG ##############################
 ##############################################################
        
-def convert2Yolo(imageSize, boxCoords):
-    invWidth = 1./imageSize[0]
-    invHeight = 1./imageSize[1]
-    x = invWidth * (boxCoords[0] + boxCoords[2])/2.0
-    y = invHeight * (boxCoords[1] + boxCoords[3])/2.0
-    boxWidth = invWidth * (boxCoords[2] - boxCoords[0])
-    boxHeight = invHeight * (boxCoords[3] - boxCoords[1])
-    return (x,y,boxWidth,boxHeight)
-
-def write2Yolo(imageSize, boxCoords, writeObj, classLabel):
-    ##class1 center_box_x_ratio center_box_y_ratio width_ratio height_ratio            
-    cx, cy, bw, bh = convert2Yolo(
-                imageSize, 
-                boxCoords
-                );
-    writeObj.write('%s' % classLabel)               
-    writeObj.write(' %.7f %.7f %.7f %.7f' % (cx, cy, bw, bh))
-    writeObj.write('\n')
-
-def write2Kitti(imageSize, boxCoords, writeObj, classLabel): # writing type/class and bbox coordinates and ignoring others           
-    writeObj.write('%s' % classLabel)      
-    writeObj.write(' 0.0 0 0.0 ')           
-    writeObj.write('%.2f %.2f %.2f %.2f' % (boxCoords[0], boxCoords[1], boxCoords[2], boxCoords[3]))
-    writeObj.write(' 0.0 0.0 0.0 0.0 0.0 0.0 0.0')
-    writeObj.write('\n')
-
-def writeHeader2VOC(imagename, w, h, d, writeObj):
-    writeObj.write('<filename>"'+imagename+'"</filename><size><width>'+str(w)+'</width><height>'+str(h)+'</height><depth>'+str(d)+'</depth></size>')
-    writeObj.write('\n')
-
-def writeObject2VOC(objName, xmin, ymin, xmax, ymax, writeObj):
-    writeObj.write('<object><difficult>0</difficult><name>'+objName+'</name><bndbox><xmin>'+str(xmin)+'</xmin><ymin>'+str(ymin)+'</ymin><xmax>'+str(xmax)+'</xmax><ymax>'+str(ymax)+'</ymax></bndbox></object>')
-    writeObj.write('\n')
-
-def Finalise2VOC(annotation, writeObj):
-    writeObj.write('<?xml version="1.0" ?><annotation>'+annotation+'</annotation>')
-
 def printHelp():
-    return "Usage: name <input objects dir fullpath> <input backgrounds dir fullpath> <output training file fullpath>"
+    return "Usage: name <input objects dir fullpath> <input backgrounds dir fullpath> <output training file fullpath> [--workers N] [--seed S] [--blend pil|numpy] [--sprite-cache-mb M] [--pack-algo rectpack|shelf] [--pack-batch B] [--pack-fill R] [--writer-threads T] [--manifest F] [--no-resume] [--profile off|low|full] [--cprofile F] [--shared-store auto|shm|mmap|off] [--output files|shards] [--shard-size MB] [--shard-compression none|gz] [--shard-checksum sha256|sha1|none]"
     
     
 def get_object_file_list2(imageDir):
@@ -90,7 +91,7 @@ def get_object_file_list2(imageDir):
     for id in range(0, numClasses):
         imagesPerClass = [] 
         perClassImageCount = 0
-        imagesPerClass.extend(glob.glob(os.path.join(imageDir+"\\"+str(id), '*.png')) )
+        imagesPerClass.extend(sorted(glob.glob(os.path.join(imageDir, str(id), '*.png'))) )
         imageList.append(imagesPerClass)
         perClassImageCount = len(imagesPerClass)
         if (perClassImageCount > maxPerClassImageCount):
@@ -111,21 +112,15 @@ def get_file_list(imageDir):
     imageList = []
     imageList.extend(glob.glob(os.path.join(imageDir, '*.png')) )
     imageList.extend(glob.glob(os.path.join(imageDir, '*.jpg')) )
-    return imageList
-                
-def generateOne(iterationId, imageArrayAllClasses, baseImgName, baseImgObj):
-    imageId = 0
-    deltaW = 0
-    deltaH = 0
-    writeObj = io.StringIO()
-    objectBoundary = [5,5]
-    doRandomScale = True
-    doRandomAlpha = True
-       
-    packer = newPacker(rotation=False)
-    format = 'RGBA'
-    #create a list of PIL Image objects
-    scaledImageArray = []
+    return sorted(imageList)
+
+def taskSeed(seed, bgFileName, runId):
+    # Derived from the task only (not from the worker or the order of execution), and
+    # independent of PYTHONHASHSEED, so any worker count produces the same images
+    key = '%d:%s:%d' % (seed, bgFileName, runId)
+    return int.from_bytes(hashlib.sha1(key.encode('utf-8')).digest()[:8], 'little')
+
+def getScales():
     scales = [1.0]
     if enableScaleDown is True:
         for zm in [0.5, 0.6, 0.8, 0.9]:
@@ -133,157 +128,735 @@ def generateOne(iterationId, imageArrayAllClasses, baseImgName, baseImgObj):
     if enableScaleUp is True:
         for zm in [1.1, 1.3, 1.5, 1.7, 1.8]:
             scales.append(zm)
-       
-    # imageArrayAllClasses[numClasses][imagesPerClass] - for all classes, Choose a random image in each class
+    return scales
+
+def scaleSprite(img, scale):
+    started = profiler.start()
+    scaled = img.resize((int(img.size[0]*scale),int(img.size[1]*scale)), Image.BICUBIC)
+    profiler.stop('resize', started)
+    return scaled
+
+class SpriteCache():
+    # Object sprites resized once per scale, indexed by (classId, imageIdx, scale).
+    # Filled at load time up to the memory budget, least recently used entries are evicted beyond it.
+    # With asArray, the float32 array used by the numpy backend is kept alongside the image.
+    # Sprites found in the shared store are returned from it. With asArray their float32 array is converted
+    # once per worker and cached, only the array uses the budget.
+    def __init__(self, imageArrayAllClasses, scales, maxBytes, asArray=False, store=None):
+        self.images = imageArrayAllClasses
+        self.scales = scales
+        self.maxBytes = maxBytes
+        self.asArray = asArray
+        self.store = store
+        self.entries = collections.OrderedDict()
+        self.usedBytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def warm(self):
+        for classId in range(0, len(self.images)):
+            for imageIdx in range(0, len(self.images[classId])):
+                for scale in self.scales:
+                    if self.usedBytes >= self.maxBytes:
+                        return
+                    self.get(classId, imageIdx, scale)
+        # warm up is not a hit or miss of the generation
+        self.hits = self.misses = 0
+
+    def get(self, classId, imageIdx, scale):
+        # returns (scaled image, float32 array or None)
+        storeKey = ('sprite', classId, imageIdx, scale)
+        if self.store is not None and storeKey in self.store:
+            self.hits = self.hits + 1
+            if not self.asArray:
+                return self.store.image(storeKey), None
+            entry = self.entries.get(storeKey)
+            if entry is not None:
+                self.entries.move_to_end(storeKey)
+                return entry
+            entry = (self.store.image(storeKey), self.store.array(storeKey).astype(np.float32))
+            self.remember(storeKey, entry, self.entryBytes(entry, storeKey))
+            return entry
+        key = (classId, imageIdx, scale)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits = self.hits + 1
+            return entry
+        self.misses = self.misses + 1
+        img = scaleSprite(self.images[classId][imageIdx], scale)
+        entry = (img, np.asarray(img, np.float32) if self.asArray else None)
+        self.remember(key, entry, self.entryBytes(entry))
+        return entry
+
+    def remember(self, key, entry, entryBytes):
+        if entryBytes <= self.maxBytes:
+            self.entries[key] = entry
+            self.usedBytes = self.usedBytes + entryBytes
+            while self.usedBytes > self.maxBytes:
+                evictedKey, evicted = self.entries.popitem(last=False)
+                self.usedBytes = self.usedBytes - self.entryBytes(evicted, evictedKey)
+
+    def entryBytes(self, entry, key=None):
+        # the image of a shared sprite is in the store
+        img, arr = entry
+        imageBytes = img.size[0] * img.size[1] * len(img.getbands()) if key is None or key[0] != 'sprite' else 0
+        return imageBytes + (arr.nbytes if arr is not None else 0)
+
+    def pyramidBytes(self):
+        # memory needed to hold every (class, image, scale) entry, computed without resizing
+        total = 0
+        for perClass in self.images:
+            for img in perClass:
+                for scale in self.scales:
+                    pixels = int(img.size[0]*scale) * int(img.size[1]*scale)
+                    total = total + pixels * len(img.getbands()) + (pixels * 4 * 4 if self.asArray else 0)
+        return total
+
+    def report(self):
+        return "[%d] sprites, [%.1f] of [%.1f] MB, hits [%d] misses [%d]" % (
+            len(self.entries), self.usedBytes / 1048576., self.maxBytes / 1048576., self.hits, self.misses)
+
+# Preallocated float32 canvas and scratch buffers for the numpy backend, reused across images of the same size
+canvasBuffers = {}
+
+def getCanvas(baseArray):
+    if baseArray.shape not in canvasBuffers:
+        canvasBuffers[baseArray.shape] = (np.empty(baseArray.shape, np.float32), np.empty(baseArray.shape, np.float32))
+    canvas, scratch = canvasBuffers[baseArray.shape]
+    np.copyto(canvas, baseArray)
+    return canvas, scratch
+
+def blendNumpy(canvas, scratch, sprite, area, alpha):
+    # canvas += alpha * spriteAlpha * (sprite - canvas), on the slice covered by the sprite.
+    # With an opaque sprite this is the same as Image.blend(cropped, sprite, alpha)
+    region = canvas[area[1]:area[3], area[0]:area[2]]
+    tmp = scratch[area[1]:area[3], area[0]:area[2]]
+    np.subtract(sprite, region, out=tmp)
+    tmp[:, :, 0:3] *= sprite[:, :, 3:4] * (alpha / 255.)
+    tmp[:, :, 3] *= alpha
+    region += tmp
+                
+def drawCanvasSprites(imageArrayAllClasses, rng, spriteCache, scales, firstRectId):
+    # imageArrayAllClasses[numClasses][imagesPerClass] - for all classes, Choose a random image in each class.
+    # Returns (classId, scaled image, float32 array or None) per class, and the (w, h, rid) rects to pack
+    doRandomScale = True
+    sprites = []
+    rects = []
     for classId in range(0, numClasses):
         perClassCount = len(imageArrayAllClasses[classId])
-        selectedInClass = random.randrange(0, perClassCount)
-        img = imageArrayAllClasses[classId][selectedInClass]
+        selectedInClass = rng.randrange(0, perClassCount)
 
-        deltaW = random.randrange(10, 20)
-        deltaH = random.randrange(10, 20)
+        deltaW = rng.randrange(10, 20)
+        deltaH = rng.randrange(10, 20)
         scaleW = 1
         scaleH = 1
         if(True == doRandomScale):
-            scaleW = scaleH = scales[random.randrange(0, len(scales)-1)]           
+            scaleW = scaleH = scales[rng.randrange(0, len(scales)-1)]           
         
-        img = img.resize((int(img.size[0]*scaleW),int(img.size[1]*scaleH)), Image.BICUBIC)
-        scaledImageArray.append(img)        
-        packer.add_rect( img.size[0] + deltaW,  img.size[1] + deltaH, imageId)
-        imageId = imageId + 1
-
-    # Add the bins where the rectangles will be placed
-    for b in [(cfgWidth, cfgHeight)]:
-        packer.add_bin(*b)
-
-    # Start packing
-    packer.pack()
-    # Open the target background image as copy
-    finalImage = baseImgObj.copy()
+        if spriteCache is not None:
+            img, arr = spriteCache.get(classId, selectedInClass, scaleW)
+        else:
+            img, arr = scaleSprite(imageArrayAllClasses[classId][selectedInClass], scaleW), None
+        sprites.append((classId, img, arr))
+        rects.append((img.size[0] + deltaW,  img.size[1] + deltaH, firstRectId + classId))
+    return sprites, rects
+
+def compositeCanvas(placements, sprites, baseImgObj, rng):
+    boxes = BoxSet()
+    objectBoundary = [5,5]
+    doRandomAlpha = True
+    # Open the target background image as copy (the numpy backend gets a float32 array, and blends into a reused canvas)
+    if blendBackend == "numpy":
+        canvas, scratch = getCanvas(baseImgObj)
+    else:
+        finalImage = baseImgObj.copy()
     
-    all_rects = packer.rect_list()
     bad = False
-    for rect in all_rects:
-        # rectpack coordinate is 0,0 at bot left
-        # b - Bin index
-        # x - Rectangle bottom-left corner x coordinate
-        # y - Rectangle bottom-left corner y coordinate
+    for rect in placements:
+        # x - Rectangle corner x coordinate
+        # y - Rectangle corner y coordinate
         # w - Rectangle width
         # h - Rectangle height
-        # rid - User asigned rectangle id or None
-        b, x, y, w, h, rid = rect
+        # rid - Index of the sprite
+        x, y, w, h, rid = rect
+        classId, img, arr = sprites[rid]
         # leftx, lefty, rightx, righty
         area1 = [
             x+objectBoundary[0],
             y+objectBoundary[1],
-            x+objectBoundary[0]+scaledImageArray[rid].size[0],
-            y+objectBoundary[1]+scaledImageArray[rid].size[1]]
+            x+objectBoundary[0]+img.size[0],
+            y+objectBoundary[1]+img.size[1]]
         # Dont write image if exceeding base image - TODO - rectpack debug
         if area1[2] > cfgWidth or area1[3] > cfgHeight:
             bad = True
             break
         area2 = (area1[0], area1[1], area1[2], area1[3])
-        # crop original for blend
-        # PIL crop requires {topleft.x,topleft.y, botright.x,botright.y} - 0,0 is in top-left corner
-        cropped = finalImage.crop(area2)
         alphas = [0.7, 0.73, 0.75, 0.78, 0.8]
         alpha = 0.8
         if(True == doRandomAlpha):
-            alpha = alphas[random.randrange(0, 5)]    
+            alpha = alphas[rng.randrange(0, 5)]    
         
         if (alpha < minAlpha):
             alpha = minAlpha
         
-        blended = Image.blend(cropped, scaledImageArray[rid], alpha)
-        finalImage.paste(blended, area2)
-        if writeOutFormat == "yolo":
-            write2Yolo([cfgWidth, cfgHeight], area1,writeObj, rid)
-        elif writeOutFormat == "kitti":
-            write2Kitti([cfgWidth, cfgHeight], area1,writeObj, rid)
-        elif writeOutFormat == "pascalvoc":
-            writeObject2VOC(str(rid), area1[0], area1[1], area1[2], area1[3], writeObj)
+        if blendBackend == "numpy":
+            if arr is None:
+                arr = np.asarray(img, np.float32)
+            blendNumpy(canvas, scratch, arr, area2, alpha)
+        else:
+            # crop original for blend
+            # PIL crop requires {topleft.x,topleft.y, botright.x,botright.y} - 0,0 is in top-left corner
+            cropped = finalImage.crop(area2)
+            blended = Image.blend(cropped, img, alpha)
+            finalImage.paste(blended, area2)
+        boxes.append(classId, area1)
+
+    if blendBackend == "numpy":
+        finalImage = Image.fromarray(canvas.astype(np.uint8), 'RGBA')
+    return finalImage, boxes, bad
+
+def generateBatch(numCanvases, imageArrayAllClasses, baseImgObj, rng=random, spriteCache=None, packAlgo=packAlgorithm,
+                  fillRatio=packFillRatio):
+    # Draws one sprite per class for each canvas (and more, up to fillRatio of the canvases area), and packs all of
+    # them in one multi-bin call. Canvases are filled in order, objects that do not fit a canvas spill into the next
+    # one instead of being dropped. Returns (finalImage, boxes, bad) per canvas (None for a canvas left empty),
+    # and the PackStats of the batch
+    stats = PackStats()
+    scales = getScales()
+    sprites = []
+    rects = []
+    rectArea = 0
+    while len(sprites) < numCanvases * numClasses or rectArea < fillRatio * numCanvases * cfgWidth * cfgHeight:
+        canvasSprites, canvasRects = drawCanvasSprites(imageArrayAllClasses, rng, spriteCache, scales, len(sprites))
+        sprites.extend(canvasSprites)
+        rects.extend(canvasRects)
+        rectArea = rectArea + sum([w * h for w, h, rid in canvasRects])
+    started = profiler.start()
+    placements, dropped = packRects(rects, (cfgWidth, cfgHeight), numCanvases, packAlgo)
+    profiler.stop('pack', started)
+    stats.droppedRects = len(dropped)
+    results = []
+    for canvasPlacements in placements:
+        stats.canvases = stats.canvases + 1
+        if len(canvasPlacements) == 0:
+            stats.emptyCanvases = stats.emptyCanvases + 1
+            results.append(None)
+            continue
+        started = profiler.start()
+        result = compositeCanvas(canvasPlacements, sprites, baseImgObj, rng)
+        profiler.stop('blend', started)
+        if result[2] is True:
+            stats.badCanvases = stats.badCanvases + 1
+        else:
+            stats.placedRects = stats.placedRects + len(canvasPlacements)
+        results.append(result)
+    return results, stats
+
+def generateOne(iterationId, imageArrayAllClasses, baseImgName, baseImgObj, rng=random, spriteCache=None):
+    results, stats = generateBatch(1, imageArrayAllClasses, baseImgObj, rng, spriteCache)
+    if results[0] is None:
+        return None, BoxSet(), True
+    return results[0]
+
+def loadObjectImages(objectDir):
+    started = profiler.start()
+    #get ImageName[classCount][ImagesPerClass]
+    perClassImageNamesArray, imageCount, maxImagesPerClass = get_object_file_list2(objectDir)
+    objectImageArrayAllClasses = []      #array[numClasses][imagesPerClass]
+    for classId in range(0, numClasses):
+        objectImageArrayAllClasses.append([])
+        for classImageName in perClassImageNamesArray[classId]:
+            try:
+                img = Image.open(classImageName).convert('RGBA')
+            except:
+                raise IOError("Cannot open image " + classImageName)
+            objectImageArrayAllClasses[classId].append(img)
+    profiler.stop('load', started)
+    return objectImageArrayAllClasses, maxImagesPerClass
+
+def loadBaseImages(baseImageFileNames):
+    baseImageArray = []
+    for name in baseImageFileNames:
+        started = profiler.start()
+        img = Image.open(name).convert('RGBA')
+        profiler.stop('load', started)
+        started = profiler.start()
+        img = img.resize((cfgWidth, cfgHeight), Image.BICUBIC)
+        profiler.stop('resize', started)
+        baseImageArray.append(img)
+    return baseImageArray
 
-    return finalImage, writeObj, bad
+def buildSharedStore(objectImageArrayAllClasses, baseImageFileNames, backend):
+    # Object images, their sprites at every scale, and the resized backgrounds, decoded once here for all workers.
+    # Backgrounds are loaded one at a time, straight into the store
+    sizes = []
+    for classId in range(0, len(objectImageArrayAllClasses)):
+        for imageIdx, img in enumerate(objectImageArrayAllClasses[classId]):
+            sizes.append((('object', classId, imageIdx), img.size))
+            for scale in getScales():
+                sizes.append((('sprite', classId, imageIdx, scale), (int(img.size[0]*scale), int(img.size[1]*scale))))
+    for bgId in range(0, len(baseImageFileNames)):
+        sizes.append((('base', bgId), (cfgWidth, cfgHeight)))
+    store = createStore(sizes, backend)
+    for classId in range(0, len(objectImageArrayAllClasses)):
+        for imageIdx, img in enumerate(objectImageArrayAllClasses[classId]):
+            store.put(('object', classId, imageIdx), img)
+            for scale in getScales():
+                store.put(('sprite', classId, imageIdx, scale), scaleSprite(img, scale))
+    for bgId in range(0, len(baseImageFileNames)):
+        store.put(('base', bgId), loadBaseImages([baseImageFileNames[bgId]])[0])
+    return store
+
+def getOutputNames(imageDir, labelDir, bgFileName, runId):
+    # named by the background file name (not its place in the list), like the seed and the manifest of the task,
+    # so backgrounds added between resumed runs do not rename the outputs of the others
+    outName = bgFileName + "_" + str(runId)
+    labelExt = ".xml" if writeOutFormat == "pascalvoc" else ".txt"
+    return os.path.join(imageDir, outName + ".jpg"), os.path.join(labelDir, outName + labelExt)
+
+def formatLabel(genImageName, genImage, boxes):
+    # labels of all the objects of an image are formatted at once
+    if writeOutFormat == "pascalvoc":
+        # file name, and the path when written as a file (shard members have bare names)
+        imageName = ntpath.basename(genImageName)
+        return formatVoc(boxes, genImage.size, imageName, genImageName if imageName != genImageName else None)
+    if writeOutFormat == "yolo":
+        return formatYolo(boxes, [cfgWidth, cfgHeight])
+    return formatKitti(boxes, classPrefix='')
+
+# Per process state, filled once by initWorker (in each pool worker, or in the main process for a single worker)
+workerState = {}
+# Per process stage timings, drained into the results of each task (and from the writer threads at the end of the run)
+profiler = StageProfiler(profileMode)
+
+class Manifest():
+    # Append only JSON lines record of finished (background, run) tasks, with the seed, output paths and a
+    # checksum of the image. A restarted run skips the tasks found here, so only missing images are generated.
+    def __init__(self, fileName, resume):
+        self.records = {}
+        if resume is True and os.path.exists(fileName):
+            with open(fileName) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # last line can be partial if the previous run was killed
+                        continue
+                    self.records[(record['bg'], record['runId'])] = record
+        self.file = open(fileName, "a" if resume is True else "w")
+
+    def findDone(self, bgFileName, runId, seed, sharded=False):
+        # returns the record of a finished task, or None if it has to be (re)generated.
+        # Images written to shards are done only in a sharded run, and the other way round
+        record = self.records.get((bgFileName, runId))
+        if record is None or record['seed'] != seed:
+            return None
+        if record['image'] is not None:
+            if sharded != ('shard' in record):
+                return None
+            if sharded is True and not os.path.exists(record['shard']):
+                return None
+            if sharded is False and not (os.path.exists(record['image']) and os.path.exists(record['label'])):
+                return None
+        return record
+
+    def lastShard(self):
+        # number of the last shard of the recorded images, -1 without shards
+        shardIds = [int(os.path.basename(r['shard']).rsplit('-', 1)[1].split('.')[0]) for r in self.records.values() if 'shard' in r]
+        return max(shardIds) if len(shardIds) > 0 else -1
+
+    def append(self, record):
+        self.file.write(json.dumps(record, sort_keys=True) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class OutputWriter():
+    # Writer stage fed by a bounded queue. Threads encode (if not already encoded by a worker process) and write
+    # images and labels while generation continues. The training list is appended incrementally in task order,
+    # and flushed every trainListFlushEvery images, so a crash keeps everything written so far.
+    # Each task is recorded in the manifest once its files are written.
+    # With a ShardWriter, images and labels are added to the shards in task order instead, the training list
+    # has the finished shards, and the tasks of a shard are recorded in the manifest when the shard is closed.
+    def __init__(self, trainFileName, numThreads, queueSize, manifest, shards=None):
+        self.jobs = queue.Queue(max(1, queueSize))
+        self.lock = threading.Lock()
+        self.trainFile = open(trainFileName, "w")
+        self.manifest = manifest
+        self.shards = shards
+        self.shardRecords = []
+        self.listedShards = set()
+        if shards is not None:
+            shards.onShardClosed = self.shardClosed
+        self.nextSeq = 0
+        self.pendingNames = {}
+        self.sinceFlush = 0
+        self.written = 0
+        self.error = None
+        self.threads = [threading.Thread(target=self.run) for i in range(max(1, numThreads))]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def submit(self, seq, record, image, labelText):
+        # seq is the task index, record the manifest record of the task. image is a PIL image, already encoded
+        # JPEG bytes, or None for a rejected image. Blocks while the queue is full
+        if self.error is not None:
+            raise self.error
+        self.jobs.put((seq, record, image, labelText))
+
+    def submitDone(self, seq, record):
+        # task already finished by a previous run, only listed in the training list
+        self.completed(seq, record['image'], None, None, record.get('shard'))
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            seq, record, image, labelText = job
+            imageName = record['image']
+            try:
+                if image is not None:
+                    if not isinstance(image, bytes):
+                        started = profiler.start()
+                        encoded = io.BytesIO()
+                        image.save(encoded, "jpeg")
+                        image = encoded.getvalue()
+                        profiler.stop('encode', started)
+                    if self.shards is None:
+                        started = profiler.start()
+                        with open(imageName, 'wb') as f:
+                            f.write(image)
+                        with open(record['label'], 'w') as f:
+                            f.write(labelText)
+                        profiler.stop('write', started)
+                    record['sha1'] = hashlib.sha1(image).hexdigest()
+            except Exception as e:
+                self.error = e
+                record = None
+            if self.shards is not None and image is not None and record is not None:
+                self.completed(seq, imageName, record, (image, labelText))
+            else:
+                self.completed(seq, imageName, record)
+
+    def completed(self, seq, imageName, record, payload=None, shardPath=None):
+        # payload is the (JPEG bytes, label text) to be added to the shards, shardPath the shard of a done task
+        with self.lock:
+            if record is not None and payload is None:
+                self.manifest.append(record)
+            self.pendingNames[seq] = (imageName, record, payload, shardPath)
+            while self.nextSeq in self.pendingNames:
+                name, record, payload, shardPath = self.pendingNames.pop(self.nextSeq)
+                self.nextSeq = self.nextSeq + 1
+                if name is None:
+                    continue
+                self.written = self.written + 1
+                if payload is not None:
+                    self.addToShard(record, payload)
+                    continue
+                if shardPath is not None:
+                    self.listShard(shardPath)
+                    continue
+                self.trainFile.write('%s\n' % name)
+                self.sinceFlush = self.sinceFlush + 1
+                if self.sinceFlush >= trainListFlushEvery:
+                    self.trainFile.flush()
+                    self.sinceFlush = 0
+
+    def addToShard(self, record, payload):
+        image, labelText = payload
+        key = os.path.splitext(os.path.basename(record['image']))[0]
+        labelExt = os.path.splitext(record['label'])[1][1:]
+        started = profiler.start()
+        try:
+            record['shard'] = self.shards.add(key, [('jpg', image), (labelExt, labelText.encode('utf-8'))])
+        except Exception as e:
+            self.error = e
+            return
+        profiler.stop('write', started)
+        self.shardRecords.append(record)
+
+    def shardClosed(self, info):
+        # called by the ShardWriter (with the lock held, or from close())
+        for record in self.shardRecords:
+            self.manifest.append(record)
+        self.shardRecords = []
+        self.listShard(info['path'])
+
+    def listShard(self, shardPath):
+        if shardPath in self.listedShards:
+            return
+        self.listedShards.add(shardPath)
+        self.trainFile.write('%s\n' % shardPath)
+        self.trainFile.flush()
+
+    def close(self):
+        for t in self.threads:
+            self.jobs.put(None)
+        for t in self.threads:
+            t.join()
+        if self.shards is not None:
+            self.shards.close()
+        self.trainFile.close()
+        if self.error is not None:
+            raise self.error
+
+def initWorker(objectDir, baseImageFileNames, imageDir, labelDir, seed, blend, cacheMB, packAlgo, fillRatio, profile,
+               cprofileName, storeHandle, encode):
+    global blendBackend
+    blendBackend = blend
+    profiler.mode = profile
+    # pool workers (encode) profile themselves, the main process profiles a single worker run
+    if cprofileName is not None and encode is True:
+        workerState['cprofileName'] = cprofileName + '.' + str(os.getpid())
+        workerState['cprofile'] = cProfile.Profile()
+        workerState['cprofile'].enable()
+    workerState['packAlgo'] = packAlgo
+    workerState['fillRatio'] = fillRatio
+    workerState['baseNames'] = baseImageFileNames
+    if storeHandle is not None:
+        # zero-copy views of the pixels decoded by the main process
+        store = attachStore(storeHandle)
+        workerState['store'] = store
+        workerState['objects'] = []
+        for classId in range(0, numClasses):
+            numImages = len([key for key in store.keys() if key[0] == 'object' and key[1] == classId])
+            workerState['objects'].append([store.image(('object', classId, imageIdx)) for imageIdx in range(0, numImages)])
+        workerState['spriteCache'] = SpriteCache(workerState['objects'], getScales(), int(cacheMB * 1048576), blendBackend == "numpy", store)
+        if blendBackend == "numpy":
+            workerState['bases'] = [store.array(('base', bgId)) for bgId in range(0, len(baseImageFileNames))]
+        else:
+            workerState['bases'] = [store.image(('base', bgId)) for bgId in range(0, len(baseImageFileNames))]
+    else:
+        workerState['objects'], _ = loadObjectImages(objectDir)
+        workerState['spriteCache'] = SpriteCache(workerState['objects'], getScales(), int(cacheMB * 1048576), blendBackend == "numpy")
+        workerState['bases'] = loadBaseImages(baseImageFileNames)
+        if blendBackend == "numpy":
+            workerState['bases'] = [np.asarray(img, np.float32) for img in workerState['bases']]
+    workerState['spriteCache'].warm()
+    workerState['imageDir'] = imageDir
+    workerState['labelDir'] = labelDir
+    workerState['seed'] = seed
+    workerState['encode'] = encode
+
+def generateTask(task):
+    # Generate the (bgId, firstRunId .. firstRunId+numCanvases-1) images of one packing batch. Returns a list of
+    # (bgId, runId, imageName, labelName, image, labelText), with None contents for a rejected or empty canvas,
+    # the PackStats of the batch, and the stage timings of the task (with the worker load for the first task).
+    # image is JPEG bytes in worker processes, else the RGB image for the writer
+    bgId, firstRunId, numCanvases = task
+    baseImgName = workerState['baseNames'][bgId]
+    bgFileName, bgFileNameExt = os.path.splitext(ntpath.basename(baseImgName))
+    rng = random.Random(taskSeed(workerState['seed'], bgFileName, firstRunId))
+    canvases, stats = generateBatch(numCanvases, workerState['objects'], workerState['bases'][bgId], rng,
+                                    workerState['spriteCache'], workerState['packAlgo'], workerState['fillRatio'])
+    results = []
+    for canvasId in range(0, numCanvases):
+        runId = firstRunId + canvasId
+        genImageName, genLabelName = getOutputNames(workerState['imageDir'], workerState['labelDir'], bgFileName, runId)
+        if canvases[canvasId] is None or canvases[canvasId][2] is True:
+            results.append((bgId, runId, genImageName, genLabelName, None, None))
+            continue
+        genImage, boxes, bad = canvases[canvasId]
+        genImage = genImage.convert("RGB")
+        started = profiler.start()
+        labelText = formatLabel(genImageName, genImage, boxes)
+        profiler.stop('label', started)
+        if workerState['encode'] is True:
+            started = profiler.start()
+            encoded = io.BytesIO()
+            genImage.save(encoded, "jpeg")
+            genImage = encoded.getvalue()
+            profiler.stop('encode', started)
+        results.append((bgId, runId, genImageName, genLabelName, genImage, labelText))
+    if 'cprofile' in workerState:
+        # pool workers are terminated without notice, the profile is written after every task
+        workerState['cprofile'].dump_stats(workerState['cprofileName'])
+    return results, stats, profiler.drain()
+
+def generateAll(tasks, workers, initArgs):
+    # Yields task results in task order, so the training list does not depend on the worker count.
+    # A single worker runs in this process and leaves JPEG encoding to the writer threads
+    if workers <= 1:
+        initWorker(*(initArgs + (False,)))
+        for task in tasks:
+            yield generateTask(task)
+        return
+    chunkSize = max(1, len(tasks) // (workers * 8))
+    with multiprocessing.Pool(workers, initializer=initWorker, initargs=initArgs + (True,)) as pool:
+        for result in pool.imap(generateTask, tasks, chunkSize):
+            yield result
 
 ##############################################################
 ##############################################################
 ##############################################################
 if __name__ == "__main__":
 
-    baseImageArray = []
-    format = 'RGBA'
-    trainListObj = io.StringIO()
-    
-    if len(sys.argv) != 4:
-        printHelp()
-        sys.exit(printHelp())
+    parser = argparse.ArgumentParser(usage=printHelp())
+    parser.add_argument("objectDir")
+    parser.add_argument("backgroundDir")
+    parser.add_argument("trainFileName")
+    parser.add_argument("--workers", type=int, default=numWorkers)
+    parser.add_argument("--seed", type=int, default=baseSeed)
+    parser.add_argument("--blend", choices=["pil", "numpy"], default=blendBackend)
+    parser.add_argument("--sprite-cache-mb", type=float, default=spriteCacheMB)
+    parser.add_argument("--pack-algo", choices=["rectpack", "shelf"], default=packAlgorithm)
+    parser.add_argument("--pack-batch", type=int, default=packBatchSize)
+    parser.add_argument("--pack-fill", type=float, default=packFillRatio)
+    parser.add_argument("--writer-threads", type=int, default=writerThreads)
+    parser.add_argument("--manifest", default=manifestFileName)
+    parser.add_argument("--no-resume", action="store_true", help="ignore the manifest and regenerate everything")
+    parser.add_argument("--profile", choices=PROFILE_MODES, default=profileMode, help="per stage timing table")
+    parser.add_argument("--cprofile", default=None, help="write a cProfile dump of the run (all processes) to this file")
+    parser.add_argument("--shared-store", choices=STORE_BACKENDS, default=sharedStoreBackend,
+                        help="decoded sprites and backgrounds shared by the workers (with --workers > 1)")
+    parser.add_argument("--output", choices=["files", "shards"], default="files",
+                        help="one file per image and label, or tar shards in " + shardFolderName)
+    parser.add_argument("--shard-size", type=float, default=shardSizeMB, help="maximum shard size (MB)")
+    parser.add_argument("--shard-compression", choices=SHARD_COMPRESSIONS, default="none", help="gz compresses the labels")
+    parser.add_argument("--shard-checksum", choices=SHARD_CHECKSUMS, default="sha256", help="checksum of each shard, in its index")
+    args = parser.parse_args()
+    profiler.mode = args.profile
     # create base folders
     imageDir = os.path.join(os.getcwd(), imageFolderName)
     labelDir = os.path.join(os.getcwd(), labelFolderName)  
-    trainFileName = sys.argv[3]
+    trainFileName = args.trainFileName
     
-    if not os.path.isdir(imageDir):
+    sharded = args.output == "shards"
+    if sharded:
+        # images and labels are named by their shard member names
+        imageDir = labelDir = ''
+    if not os.path.isdir(imageDir) and not sharded:
         os.mkdir(imageDir)
-    if not os.path.isdir(labelDir):
+    if not os.path.isdir(labelDir) and not sharded:
         os.mkdir(labelDir)
         
-    #get ImageName[classCount][ImagesPerClass]
-    perClassImageNamesArray, imageCount, MAX_IMAGES_PER_CLASS = get_object_file_list2(sys.argv[1])
-    if imageCount == 0:
-        print( 'Error: No image files found in the specified dir [' + sys.argv[1] + ']')
+    # Objects are loaded here only to validate them, workers load their own copy
+    try:
+        objectImageArrayAllClasses, MAX_IMAGES_PER_CLASS = loadObjectImages(args.objectDir)
+    except IOError as e:
+        print("Error: " + str(e))
+        sys.exit(printHelp())
+    if MAX_IMAGES_PER_CLASS == 0:
+        print( 'Error: No image files found in the specified dir [' + args.objectDir + ']')
         sys.exit(printHelp())
-        
-    
-    objectImageArrayAllClasses = []      #array[numClasses][imagesPerClass]    
-    for classId in range(0, numClasses):
-        for classImageName in perClassImageNamesArray[classId]:
-            try:
-                img = Image.open(classImageName).convert(format)
-            except:
-                print("Error: Cannot open image " + classImageName)
-                sys.exit(printHelp())
-            objectImageArrayAllClasses.append([])
-            objectImageArrayAllClasses[classId].append(img)
         
     print("Info: Added [" + str(len(objectImageArrayAllClasses)) + "] object images, Max obj/class of [" + str(MAX_IMAGES_PER_CLASS) + "]")
+    # Object images larger than the canvas can never be packed, sizes come from the headers (dimension index)
+    dimIndex = DimensionIndex(dimIndexFileName)
+    objectImageNames = [name for perClass in get_object_file_list2(args.objectDir)[0] for name in perClass]
+    for name, size in sorted(dimIndex.scan(objectImageNames).items()):
+        if size[0] + 10 > cfgWidth or size[1] + 10 > cfgHeight:
+            print("Warning: Object image [" + name + "] of " + str(size) + " does not fit the canvas at scale 1.0")
+    dimIndex.save()
+    pyramidMB = SpriteCache(objectImageArrayAllClasses, getScales(), 0, args.blend == "numpy").pyramidBytes() / 1048576.
+    print("Info: Sprite pyramid needs [%.1f] MB, cache budget [%.1f] MB per worker" % (pyramidMB, args.sprite_cache_mb))
     #get background file names
-    baseImageFileNames = get_file_list(sys.argv[2])   
+    baseImageFileNames = get_file_list(args.backgroundDir)
     if len(baseImageFileNames) == 0:
-        print( 'Error: No image files found in the specified dir [' + sys.argv[2] + ']')
+        print( 'Error: No image files found in the specified dir [' + args.backgroundDir + ']')
         sys.exit(printHelp())      
-    for name in baseImageFileNames:
-        img = Image.open(name).convert(format)
-        img = img.resize((cfgWidth, cfgHeight), Image.BICUBIC)
-        baseImageArray.append(img)        
+    # backgrounds are told apart by their file name (without extension) in the output names and the manifest
+    bgFileNames = collections.Counter([os.path.splitext(ntpath.basename(name))[0] for name in baseImageFileNames])
+    sameNames = sorted([name for name, count in bgFileNames.items() if count > 1])
+    if len(sameNames) > 0:
+        print('Error: Background images with the same file name (different extensions) [' + ', '.join(sameNames) + ']')
+        sys.exit(printHelp())
     print("Info: Added [" + str(len(baseImageFileNames)) + "] base images")    
     
     # Loop across background images, then runs
     adjnumTargetImagesPerClass = int ((numTargetImagesPerClass /len(baseImageFileNames) ) + 1) 
-    timeStart = time.process_time()
-    print("Info: Beginning [" + str(adjnumTargetImagesPerClass*len(baseImageFileNames)) + "] images @ " + str(timeStart) + " (s) in ["+writeOutFormat+"] format" )    
+    tasks = [(bgId, runId) for bgId in range(0, len(baseImageFileNames)) for runId in range(0, adjnumTargetImagesPerClass)]
+    manifest = Manifest(args.manifest, not args.no_resume)
+    # Tasks of a background are generated in packing batches of args.pack_batch runs, seeded by their first run.
+    # Skip the batches finished by a previous run, they keep their place in the training list
+    packBatch = max(1, args.pack_batch)
+    taskSeq = dict((task, seq) for seq, task in enumerate(tasks))
+    doneRecords = {}
+    pendingBatches = []
+    numPending = 0
     for bgId in range(0, len(baseImageFileNames)):
-        bgFileNameFull = ntpath.basename(baseImageFileNames[bgId])   
-        bgFileName, bgFileNameExt = os.path.splitext(bgFileNameFull)
-        for runId in range(0, adjnumTargetImagesPerClass):
-            genImage, genText, bad = generateOne(runId, objectImageArrayAllClasses, baseImageFileNames[bgId], baseImageArray[bgId])
-            if bad is True: continue
-            #genImage.show()
-            genImageName = imageDir + '\\' + bgFileName+ "_" + str(bgId)+ "_" + str(runId) + ".jpg"
-            genImage = genImage.convert("RGB")
-            genImage.save(genImageName, "jpeg")
-            if writeOutFormat == "pascalvoc":
-                with open(labelDir + "\\" + bgFileName+ "_" + str(bgId) + "_" + str(runId) + ".xml", 'w') as f:
-                    writeHeader2VOC(genImageName, genImage.size[0], genImage.size[1], 3, genText)
-                    writeOutIO =io.StringIO()
-                    Finalise2VOC(genText.getvalue(), writeOutIO)
-                    f.write(writeOutIO.getvalue())               
-            else:
-                with open(labelDir + "\\" + bgFileName+ "_" + str(bgId) + "_" + str(runId) + ".txt", 'w') as f:
-                    f.write(genText.getvalue())
-            trainListObj.write('%s\n' % genImageName)
-            print('.', end='', flush=True)
-    with open(trainFileName, "w") as f:
-        f.write(trainListObj.getvalue())
-    timeEnd = time.process_time() - timeStart
+        bgFileName, bgFileNameExt = os.path.splitext(ntpath.basename(baseImageFileNames[bgId]))
+        for firstRunId in range(0, adjnumTargetImagesPerClass, packBatch):
+            numCanvases = min(packBatch, adjnumTargetImagesPerClass - firstRunId)
+            batchSeed = taskSeed(args.seed, bgFileName, firstRunId)
+            records = [manifest.findDone(bgFileName, runId, batchSeed, sharded) for runId in range(firstRunId, firstRunId + numCanvases)]
+            if None in records:
+                pendingBatches.append((bgId, firstRunId, numCanvases))
+                numPending = numPending + numCanvases
+                continue
+            for runId in range(firstRunId, firstRunId + numCanvases):
+                doneRecords[taskSeq[(bgId, runId)]] = records[runId - firstRunId]
+    # wall clock for the run time, process time of the main process misses the workers and the I/O waits
+    timeStart = time.perf_counter()
+    cpuStart = time.process_time()
+    print("Info: Beginning [" + str(numPending) + "] images @ " + time.strftime('%H:%M:%S') + " in ["+writeOutFormat+"] format on [" + str(args.workers) + "] workers" )
+    if len(doneRecords) > 0:
+        print("Info: Skipping [" + str(len(doneRecords)) + "] images finished in [" + args.manifest + "]")
+    sharedStore = None
+    if args.workers > 1 and args.shared_store != "off" and numPending > 0:
+        sharedStore = buildSharedStore(objectImageArrayAllClasses, baseImageFileNames, args.shared_store)
+        print("Info: Shared store of [%d] sprites and backgrounds, [%.1f] MB (%s) for [%d] workers" % (
+            len(sharedStore.index), sharedStore.nbytes / 1048576., sharedStore.backend, args.workers))
+    initArgs = (args.objectDir, baseImageFileNames, imageDir, labelDir, args.seed, args.blend, args.sprite_cache_mb, args.pack_algo, args.pack_fill,
+                args.profile, args.cprofile, sharedStore.handle() if sharedStore is not None else None)
+    packStats = PackStats()
+    stageTimes = StageProfiler(args.profile)
+    mainProfile = None
+    if args.cprofile is not None:
+        mainProfile = cProfile.Profile()
+        mainProfile.enable()
+    shards = None
+    if sharded:
+        # new shards are numbered after the ones of the images already done, a partial shard of an interrupted run is replaced
+        shards = ShardWriter(os.path.join(os.getcwd(), shardFolderName), 'shard', int(args.shard_size * 1048576), 0,
+                             args.shard_compression, args.shard_checksum, manifest.lastShard() + 1)
+    writer = OutputWriter(trainFileName, args.writer_threads, writerQueueSize, manifest, shards)
+    try:
+        for seq in sorted(doneRecords):
+            writer.submitDone(seq, doneRecords[seq])
+        for results, stats, timings in generateAll(pendingBatches, args.workers, initArgs):
+            packStats.add(stats)
+            stageTimes.add(timings)
+            firstRunId = results[0][1]
+            for bgId, runId, genImageName, genLabelName, genImage, labelText in results:
+                bgFileName, bgFileNameExt = os.path.splitext(ntpath.basename(baseImageFileNames[bgId]))
+                # the seed recorded is the one of the batch the image was generated in
+                record = {'bg': bgFileName, 'runId': runId, 'seed': taskSeed(args.seed, bgFileName, firstRunId),
+                          'image': genImageName if genImage is not None else None,
+                          'label': genLabelName if genImage is not None else None}
+                writer.submit(taskSeq[(bgId, runId)], record, genImage, labelText)
+                if genImage is None: continue
+                print('.', end='', flush=True)
+    finally:
+        writer.close()
+        manifest.close()
+        if sharedStore is not None:
+            sharedStore.close()
+    wallSeconds = time.perf_counter() - timeStart
+    cpuSeconds = time.process_time() - cpuStart
     print("")
-    print("Info: Completed @ " + str(timeEnd - timeStart) + " (s), in ["+writeOutFormat+"] format" )
+    print("Info: Completed in [%.2f] (s), main process CPU [%.2f] (s), in [%s] format" % (wallSeconds, cpuSeconds, writeOutFormat))
+    # the main process load (object validation) and the writer threads
+    stageTimes.add(profiler.drain())
+    for line in stageTimes.report():
+        print("Info: " + line)
+    if mainProfile is not None:
+        mainProfile.disable()
+        profileStats = pstats.Stats(mainProfile)
+        workerProfiles = sorted([name for name in glob.glob(glob.escape(args.cprofile) + '.*') if name.rsplit('.', 1)[1].isdigit()])
+        for workerProfile in workerProfiles:
+            profileStats.add(workerProfile)
+        profileStats.dump_stats(args.cprofile)
+        for workerProfile in workerProfiles:
+            os.remove(workerProfile)
+        print("Info: cProfile of [" + str(1 + len(workerProfiles)) + "] processes written to [" + args.cprofile + "], view with python -m pstats " + args.cprofile)
+    print("Info: Packing " + packStats.report())
+    if shards is not None:
+        print("Info: [%d] images in [%d] new shards in [%s], training list has [%d] shards" % (
+            shards.samples, shards.shards, shards.outDir, len(writer.listedShards)))
+    if 'spriteCache' in workerState:
+        print("Info: Sprite cache " + workerState['spriteCache'].report())
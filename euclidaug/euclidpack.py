@@ -0,0 +1,93 @@
+#############################################################################
+# Purpose:
+# Packing of object rectangles into output canvases, for euclidaug.
+# Many canvases are packed in one multi-bin call, every bin is filled before the next one is used.
+#
+# Algorithms:
+# - rectpack : rectpack MaxRects (offline, bin first fit). Best fill, slowest
+# - shelf    : shelf first fit on decreasing height. Fast, for small rect counts
+#
+# Placements are returned per bin as (x, y, w, h, rid), 0,0 at the top left of the canvas
+#############################################################################
+
+from rectpack import newPacker, PackingBin
+
+def packRectpack(rects, binSize, numBins):
+    # bin first fit: a rect goes in the first bin with room, so the canvases are filled in order
+    packer = newPacker(bin_algo=PackingBin.BFF, rotation=False)
+    for w, h, rid in rects:
+        packer.add_rect(w, h, rid)
+    # Add the bins where the rectangles will be placed
+    packer.add_bin(binSize[0], binSize[1], count=numBins)
+    # Start packing
+    packer.pack()
+    return packer.rect_list()
+
+class ShelfPacker():
+    # Rectangles (sorted by decreasing height) are placed left to right on horizontal shelves. A rectangle goes
+    # on the first shelf with room, in the first bin with room, else opens a new shelf under the last one.
+    def __init__(self, width, height, numBins):
+        self.width = width
+        self.height = height
+        self.shelves = [[] for b in range(numBins)]   # per bin, [y, height, used width] of each shelf
+        self.usedHeight = [0] * numBins
+
+    def add(self, w, h):
+        # returns (bin, x, y), or None if the rect fits in no bin
+        if w > self.width or h > self.height:
+            return None
+        for b in range(len(self.shelves)):
+            for shelf in self.shelves[b]:
+                if h <= shelf[1] and shelf[2] + w <= self.width:
+                    x = shelf[2]
+                    shelf[2] = shelf[2] + w
+                    return b, x, shelf[0]
+            if self.usedHeight[b] + h <= self.height:
+                self.shelves[b].append([self.usedHeight[b], h, w])
+                self.usedHeight[b] = self.usedHeight[b] + h
+                return b, 0, self.usedHeight[b] - h
+        return None
+
+def packShelf(rects, binSize, numBins):
+    packer = ShelfPacker(binSize[0], binSize[1], numBins)
+    rectList = []
+    for w, h, rid in sorted(rects, key=lambda r: (-r[1], -r[0])):
+        placed = packer.add(w, h)
+        if placed is not None:
+            rectList.append((placed[0], placed[1], placed[2], w, h, rid))
+    return rectList
+
+packAlgorithms = {'rectpack': packRectpack, 'shelf': packShelf}
+
+def packRects(rects, binSize, numBins, algo='rectpack'):
+    # rects is a list of (w, h, rid). Returns the placements of each bin, and the rids that did not fit any bin
+    placements = [[] for b in range(numBins)]
+    placed = set()
+    for b, x, y, w, h, rid in packAlgorithms[algo](rects, binSize, numBins):
+        placements[b].append((x, y, w, h, rid))
+        placed.add(rid)
+    dropped = [rid for w, h, rid in rects if rid not in placed]
+    return placements, dropped
+
+class PackStats():
+    # Counters of wasted work, summed across batches (and worker processes)
+    def __init__(self):
+        self.canvases = 0
+        self.emptyCanvases = 0
+        self.badCanvases = 0
+        self.placedRects = 0
+        self.droppedRects = 0
+
+    def add(self, other):
+        self.canvases = self.canvases + other.canvases
+        self.emptyCanvases = self.emptyCanvases + other.emptyCanvases
+        self.badCanvases = self.badCanvases + other.badCanvases
+        self.placedRects = self.placedRects + other.placedRects
+        self.droppedRects = self.droppedRects + other.droppedRects
+
+    def wasted(self):
+        return self.emptyCanvases + self.badCanvases
+
+    def report(self):
+        return "[%d] canvases, [%d] wasted ([%d] empty, [%d] rejected), [%d] objects placed, [%d] dropped" % (
+            self.canvases, self.wasted(), self.emptyCanvases, self.badCanvases, self.placedRects, self.droppedRects)
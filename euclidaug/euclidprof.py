@@ -0,0 +1,100 @@
+#############################################################################
+# Per stage timing of euclidaug (load, resize, pack, blend, label, encode, write)
+# Durations are counted in log scale bins (8 per octave, ~9% wide), so the p50/p95
+# of a stage are known without keeping the samples, and the counts of worker
+# processes are merged by adding them.
+# Modes: off (no timing calls), low (wall clock only), full (wall clock and thread CPU time)
+#############################################################################
+import math
+import time
+import threading
+
+PROFILE_STAGES = ['load', 'resize', 'pack', 'blend', 'label', 'encode', 'write']
+PROFILE_MODES = ['off', 'low', 'full']
+
+BINS_PER_OCTAVE = 8
+MIN_OCTAVE = -20     # first bin starts at ~1 us
+NUM_BINS = 32 * BINS_PER_OCTAVE   # up to ~4000 s
+
+def durationBin(seconds):
+    if seconds <= 0:
+        return 0
+    return min(NUM_BINS - 1, max(0, int((math.log2(seconds) - MIN_OCTAVE) * BINS_PER_OCTAVE)))
+
+def binSeconds(b):
+    # geometric middle of the bin
+    return 2 ** (MIN_OCTAVE + (b + 0.5) / BINS_PER_OCTAVE)
+
+class StageProfiler():
+    # start() returns a token (None when off), stop(stage, token) records the duration since start. Thread safe
+    def __init__(self, mode='low'):
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counts = {}
+        self.wall = {}
+        self.cpu = {}
+        self.bins = {}     # stage -> {bin: count}
+
+    def start(self):
+        if self.mode == 'off':
+            return None
+        if self.mode == 'full':
+            return time.perf_counter(), time.thread_time()
+        return time.perf_counter(), None
+
+    def stop(self, stage, token):
+        if token is None:
+            return
+        wall = time.perf_counter() - token[0]
+        cpu = time.thread_time() - token[1] if token[1] is not None else 0.
+        b = durationBin(wall)
+        with self.lock:
+            self.counts[stage] = self.counts.get(stage, 0) + 1
+            self.wall[stage] = self.wall.get(stage, 0.) + wall
+            self.cpu[stage] = self.cpu.get(stage, 0.) + cpu
+            stageBins = self.bins.setdefault(stage, {})
+            stageBins[b] = stageBins.get(b, 0) + 1
+
+    def drain(self):
+        # Returns the counts recorded since the last drain (picklable), and clears them
+        with self.lock:
+            snapshot = (self.counts, self.wall, self.cpu, self.bins)
+            self.reset()
+        return snapshot
+
+    def add(self, snapshot):
+        counts, wall, cpu, bins = snapshot
+        with self.lock:
+            for stage in counts:
+                self.counts[stage] = self.counts.get(stage, 0) + counts[stage]
+                self.wall[stage] = self.wall.get(stage, 0.) + wall[stage]
+                self.cpu[stage] = self.cpu.get(stage, 0.) + cpu[stage]
+                stageBins = self.bins.setdefault(stage, {})
+                for b, n in bins[stage].items():
+                    stageBins[b] = stageBins.get(b, 0) + n
+
+    def percentile(self, stage, q):
+        # duration (s) below which q percent of the samples of stage are, to the bin resolution
+        target = self.counts[stage] * q / 100.
+        seen = 0
+        for b in sorted(self.bins[stage]):
+            seen = seen + self.bins[stage][b]
+            if seen >= target:
+                return binSeconds(b)
+        return 0.
+
+    def report(self):
+        # Summary table lines, in PROFILE_STAGES order. Wall totals of parallel workers and threads add up,
+        # so the total column can exceed the run time
+        stages = [s for s in PROFILE_STAGES if s in self.counts] + sorted([s for s in self.counts if s not in PROFILE_STAGES])
+        if len(stages) == 0:
+            return []
+        lines = ["%-8s %9s %11s %10s %10s %10s" % ('stage', 'count', 'total (s)', 'p50 (ms)', 'p95 (ms)', 'cpu (s)')]
+        for stage in stages:
+            cpu = ('%10.3f' % self.cpu[stage]) if self.mode == 'full' else '%10s' % '-'
+            lines.append("%-8s %9d %11.3f %10.3f %10.3f %s" % (stage, self.counts[stage], self.wall[stage],
+                         self.percentile(stage, 50) * 1000., self.percentile(stage, 95) * 1000., cpu))
+        return lines
@@ -0,0 +1,174 @@
+#############################################################################
+# Sharded dataset output of euclidaug
+# Samples (the JPEG image and the label of one generated image) are written into
+# plain tar shards of a fixed maximum size, WebDataset style: members
+# <key>.jpg and <key>.txt/.xml, optionally with the labels gzipped (<key>.txt.gz).
+# Images are stored as is, so every member can be read in place.
+# Each shard has an index (<shard>.idx, JSON) with the data offset and size of every
+# member, and the checksum of the whole shard. Shards can be streamed as ordinary tar
+# files, or opened with ShardReader for memory mapped random access.
+#############################################################################
+import os
+import io
+import gzip
+import json
+import mmap
+import hashlib
+import tarfile
+
+SHARD_COMPRESSIONS = ['none', 'gz']
+SHARD_CHECKSUMS = ['sha256', 'sha1', 'none']
+# shard list, one JSON line per finished shard
+SHARD_LIST_FILE_NAME = 'shards.jsonl'
+
+def shardName(prefix, shardId):
+    return '%s-%06d.tar' % (prefix, shardId)
+
+class HashingFile():
+    # Write-only file, checksum of everything written through it
+    def __init__(self, f, checksum):
+        self.f = f
+        self.hash = hashlib.new(checksum) if checksum != 'none' else None
+
+    def write(self, data):
+        if self.hash is not None:
+            self.hash.update(data)
+        return self.f.write(data)
+
+    def tell(self):
+        return self.f.tell()
+
+class ShardWriter():
+    # add() appends a sample to the open shard, starting a new shard when the shard would grow past maxBytes
+    # (or maxSamples), a shard holds at least one sample. onShardClosed(info) is called with the shard list
+    # record of each finished shard.
+    def __init__(self, outDir, prefix='shard', maxBytes=256 * 1048576, maxSamples=0, compression='none',
+                 checksum='sha256', firstShard=0, onShardClosed=None):
+        self.outDir = outDir
+        self.prefix = prefix
+        self.maxBytes = maxBytes
+        self.maxSamples = maxSamples
+        self.compression = compression
+        self.checksum = checksum
+        self.nextShard = firstShard
+        self.onShardClosed = onShardClosed
+        self.tar = None
+        self.shards = 0
+        self.samples = 0
+        if not os.path.isdir(outDir):
+            os.makedirs(outDir)
+        if firstShard == 0 and os.path.exists(os.path.join(outDir, SHARD_LIST_FILE_NAME)):
+            # numbering starts again, the shards listed are overwritten
+            os.remove(os.path.join(outDir, SHARD_LIST_FILE_NAME))
+
+    def shardPath(self):
+        # path of the open shard (or of the next one)
+        return os.path.join(self.outDir, shardName(self.prefix, self.nextShard))
+
+    def openShard(self):
+        self.file = open(self.shardPath(), 'wb')
+        self.hashingFile = HashingFile(self.file, self.checksum)
+        self.tar = tarfile.open(fileobj=self.hashingFile, mode='w', format=tarfile.PAX_FORMAT)
+        self.index = []
+
+    def add(self, key, members):
+        # members is [(extension, bytes)], returns the path of the shard the sample is written to
+        if self.compression == 'gz':
+            # JPEG is already compressed, only the labels are
+            members = [(ext, data) if ext == 'jpg' else (ext + '.gz', gzip.compress(data, mtime=0)) for ext, data in members]
+        infos = []
+        for ext, data in members:
+            info = tarfile.TarInfo(key + '.' + ext)
+            info.size = len(data)
+            # fixed metadata, the shard only depends on its samples
+            info.mtime = 0
+            info.mode = 0o644
+            infos.append(info)
+        # headers as written (with PAX extended headers for long names) and padded data
+        sampleBytes = sum([len(info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')) + (info.size + 511) // 512 * 512
+                           for info in infos])
+        if self.tar is not None and len(self.index) > 0 and (self.shardBytes(self.tar.offset + sampleBytes) > self.maxBytes or
+                                                            (self.maxSamples > 0 and len(self.index) >= self.maxSamples)):
+            self.closeShard()
+        if self.tar is None:
+            self.openShard()
+        entry = {'key': key, 'members': {}}
+        for info, (ext, data) in zip(infos, members):
+            self.tar.addfile(info, io.BytesIO(data))
+            entry['members'][ext] = [self.tar.offset - (len(data) + 511) // 512 * 512, len(data)]
+        self.index.append(entry)
+        self.samples = self.samples + 1
+        return self.shardPath()
+
+    def shardBytes(self, offset):
+        # file size of a shard closed at offset: end of archive blocks, padded to whole tar records
+        return (offset + 2 * tarfile.BLOCKSIZE + tarfile.RECORDSIZE - 1) // tarfile.RECORDSIZE * tarfile.RECORDSIZE
+
+    def closeShard(self):
+        if self.tar is None:
+            return
+        self.tar.close()
+        size = self.file.tell()
+        self.file.close()
+        path = self.shardPath()
+        info = {'shard': os.path.basename(path), 'samples': len(self.index), 'bytes': size,
+                'checksum': self.checksum, 'digest': self.hashingFile.hash.hexdigest() if self.hashingFile.hash is not None else None}
+        with open(path + '.idx', 'w') as f:
+            json.dump(dict(info, index=self.index), f)
+        with open(os.path.join(self.outDir, SHARD_LIST_FILE_NAME), 'a') as f:
+            f.write(json.dumps(info, sort_keys=True) + '\n')
+        self.tar = None
+        self.index = []
+        self.nextShard = self.nextShard + 1
+        self.shards = self.shards + 1
+        if self.onShardClosed is not None:
+            self.onShardClosed(dict(info, path=path))
+
+    def close(self):
+        self.closeShard()
+
+def verifyShard(path):
+    # True if the shard matches the checksum of its index
+    with open(path + '.idx') as f:
+        info = json.load(f)
+    if info['checksum'] == 'none':
+        return True
+    digest = hashlib.new(info['checksum'])
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1048576), b''):
+            digest.update(block)
+    return digest.hexdigest() == info['digest']
+
+class ShardReader():
+    # Memory mapped shard, samples are read in place through the index
+    def __init__(self, path):
+        with open(path + '.idx') as f:
+            self.info = json.load(f)
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.info['index'])
+
+    def keys(self):
+        return [entry['key'] for entry in self.info['index']]
+
+    def sample(self, i):
+        # {extension: bytes} of sample i, gzipped labels are decompressed (extension without .gz)
+        entry = self.info['index'][i]
+        sample = {'__key__': entry['key']}
+        for ext, (offset, size) in entry['members'].items():
+            data = self.map[offset:offset + size]
+            if ext.endswith('.gz'):
+                ext = ext[:-3]
+                data = gzip.decompress(data)
+            sample[ext] = data
+        return sample
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.sample(i)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
@@ -0,0 +1,119 @@
+#############################################################################
+# Shared image store for the euclidaug workers
+# Decoded RGBA pixel buffers (object sprites, and the resized backgrounds), written
+# once by the main process into one shared memory block or memory mapped file.
+# Workers attach to it and get read-only zero-copy NumPy views and PIL images, so
+# adding workers does not add copies of the pixels.
+# Backends: shm (multiprocessing.shared_memory), mmap (file in the temp dir),
+# auto (shm if /dev/shm has room, else mmap).
+#############################################################################
+import os
+import tempfile
+import numpy as np
+from PIL import Image
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8, memory mapped file only
+    shared_memory = None
+
+STORE_BACKENDS = ['auto', 'shm', 'mmap', 'off']
+# offsets of the entries are aligned to this
+STORE_ALIGN = 64
+
+def chooseBackend(backend, nbytes):
+    if backend != 'auto':
+        return backend
+    if shared_memory is None:
+        return 'mmap'
+    if os.path.isdir('/dev/shm'):
+        # containers often have a small /dev/shm, running out of it is a SIGBUS in a worker
+        stat = os.statvfs('/dev/shm')
+        if stat.f_bavail * stat.f_frsize < nbytes * 1.1:
+            return 'mmap'
+    return 'shm'
+
+class SharedImageStore():
+    # Created by the main process with createStore(), and by workers from its handle() with attachStore().
+    # index is {key: (offset, (height, width, 4))}, keys are tuples
+    def __init__(self, backend, name, index, nbytes, owner):
+        self.backend = backend
+        self.name = name
+        self.index = index
+        self.nbytes = nbytes
+        self.owner = owner
+        if backend == 'shm':
+            self.shm = shared_memory.SharedMemory(name=name, create=owner, size=max(1, nbytes) if owner else 0)
+            self.buffer = np.ndarray((nbytes,), np.uint8, buffer=self.shm.buf)
+        else:
+            self.shm = None
+            if owner is True:
+                with open(name, 'wb') as f:
+                    f.truncate(max(1, nbytes))
+            self.buffer = np.memmap(name, np.uint8, 'r+' if owner else 'r', shape=(max(1, nbytes),))
+        self.images = {}
+
+    def handle(self):
+        # picklable, for attachStore() in the workers
+        return self.backend, self.name, self.index, self.nbytes
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def keys(self):
+        return self.index.keys()
+
+    def put(self, key, img):
+        # copies the pixels of an RGBA image (owner only)
+        offset, shape = self.index[key]
+        view = self.buffer[offset:offset + shape[0] * shape[1] * 4].reshape(shape)
+        view[:] = np.asarray(img, np.uint8).reshape(shape)
+
+    def array(self, key):
+        # read-only (height, width, 4) uint8 view
+        offset, shape = self.index[key]
+        view = self.buffer[offset:offset + shape[0] * shape[1] * 4].reshape(shape)
+        view.flags.writeable = False
+        return view
+
+    def image(self, key):
+        # read-only RGBA image sharing the pixels of the store, copy() it before drawing on it
+        img = self.images.get(key)
+        if img is None:
+            shape = self.index[key][1]
+            img = Image.frombuffer('RGBA', (shape[1], shape[0]), self.array(key), 'raw', 'RGBA', 0, 1)
+            self.images[key] = img
+        return img
+
+    def close(self):
+        # views and images of the store must not be used after close
+        self.images = {}
+        self.buffer = None
+        if self.shm is not None:
+            self.shm.close()
+            if self.owner is True:
+                self.shm.unlink()
+        elif self.owner is True:
+            os.remove(self.name)
+
+def createStore(sizes, backend='auto'):
+    # sizes is [(key, (width, height))] of the RGBA images to be stored, filled with put()
+    index = {}
+    nbytes = 0
+    for key, size in sizes:
+        index[key] = (nbytes, (size[1], size[0], 4))
+        nbytes = nbytes + (size[0] * size[1] * 4 + STORE_ALIGN - 1) // STORE_ALIGN * STORE_ALIGN
+    backend = chooseBackend(backend, nbytes)
+    if backend == 'shm':
+        name = None
+    else:
+        fd, name = tempfile.mkstemp(prefix='euclidaug_store', suffix='.bin')
+        os.close(fd)
+    store = SharedImageStore(backend, name, index, nbytes, True)
+    if backend == 'shm':
+        store.name = store.shm.name
+    return store
+
+def attachStore(handle):
+    backend, name, index, nbytes = handle
+    return SharedImageStore(backend, name, index, nbytes, False)
@@ -1,5 +1,5 @@
 from distutils.core import setup
 setup(name='euclid',
       version='0.1',
-      py_modules=['euclid'],
+      py_modules=['euclid', 'euclid_dimindex', 'euclid_prefetch', 'euclid_viewport', 'euclid_labelstore', 'euclid_boxes', 'euclid_validate', 'euclid_bench', 'euclid_labelindex', 'euclid_voc', 'euclid_coco', 'euclid_prelabel'],
       )
\ No newline at end of file